@@ -0,0 +1,294 @@
+# keystore_client.py v0.1.0
+#
+"""
+Shared client for the API Key Management Service (Keystore).
+
+Used by the sample apps to fetch secrets with:
+  * a pooled keep-alive HTTP session
+  * a TTL cache with refresh-ahead (hot keys are refreshed in the background
+    shortly before they expire, so callers never wait on the keystore)
+  * single-flight coalescing (concurrent misses for a key share one request)
+  * batch prefetch through POST /keys:batch_get
+  * re-fetch on demand when an upstream provider rejects a stale key
+  * optional push invalidation from the Keystore change feed (GET /keys:changes)
+"""
+
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Error reasons that mean the provider rejected the key itself. Gemini answers an
+# invalid or revoked key with HTTP 400 and this reason rather than 401/403.
+KEY_REJECTION_REASONS = ('API_KEY_INVALID',)
+
+
+class _Flight:
+    """One in-progress fetch that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class KeystoreClient:
+    """Thread-safe, caching client for the Keystore API."""
+
+    def __init__(self, base_url, token, ttl=300, refresh_ahead=60, timeout=10, pool_size=10, retries=2, max_stale=60):
+        self.base_url = (base_url or '').rstrip('/')
+        self.token = token
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        # How long past its TTL a key may still be served while the Keystore cannot be reached
+        self.max_stale = max_stale
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'POST']))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        })
+
+        self._cache = {}    # key_name -> (value, fetched_at)
+        self._flights = {}  # key_name -> _Flight
+        self._lock = threading.Lock()
+        self._watch_thread = None
+
+    # --- Public API ---
+
+    def get_key(self, key_name):
+        """Return the value of key_name, or None if it cannot be retrieved."""
+        if not key_name:
+            logger.error("KeystoreClient.get_key called without a key_name.")
+            return None
+
+        with self._lock:
+            cached = self._cache.get(key_name)
+            if cached is not None:
+                value, fetched_at = cached
+                age = time.monotonic() - fetched_at
+                if age < self.ttl:
+                    if age >= self.ttl - self.refresh_ahead and key_name not in self._flights:
+                        # Serve the cached value and refresh it in the background
+                        flight = self._flights[key_name] = _Flight()
+                        threading.Thread(target=self._run_flight, args=(key_name, flight),
+                                         name=f'keystore-refresh-{key_name}', daemon=True).start()
+                    return value
+            flight, leader = self._join_flight(key_name)
+
+        if leader:
+            self._run_flight(key_name, flight)
+        else:
+            flight.done.wait()
+        return flight.value
+
+    def refresh(self, key_name, rejected_value=None):
+        """Force a re-fetch of key_name and return the new value.
+
+        If rejected_value is given and the cache already holds a different
+        value (another thread refreshed it first), that value is returned
+        without contacting the keystore.
+        """
+        with self._lock:
+            cached = self._cache.get(key_name)
+            if rejected_value is not None and cached is not None and cached[0] != rejected_value:
+                return cached[0]
+            self._cache.pop(key_name, None)
+            flight, leader = self._join_flight(key_name)
+
+        if leader:
+            self._run_flight(key_name, flight)
+        else:
+            flight.done.wait()
+        return flight.value
+
+    def invalidate(self, key_name=None):
+        """Drop one cached key, or the whole cache when key_name is None."""
+        with self._lock:
+            if key_name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key_name, None)
+
+    def prefetch(self, key_names):
+        """Load several keys with one batch request. Returns {key_name: value} for keys found."""
+        with self._lock:
+            now = time.monotonic()
+            flights = {}
+            for key_name in dict.fromkeys(name for name in key_names if name):
+                # Same freshness test as get_key: expired entries are fetched again in the batch
+                cached = self._cache.get(key_name)
+                if key_name in self._flights or (cached is not None and now - cached[1] < self.ttl):
+                    continue
+                flights[key_name] = self._flights[key_name] = _Flight()
+
+        if not flights:
+            return {}
+
+        values = {}
+        try:
+            values = self._fetch_batch(list(flights))
+        finally:
+            for key_name, flight in flights.items():
+                self._finish_flight(key_name, flight, values.get(key_name))
+        logger.info(f"Prefetched {len(values)} of {len(flights)} keys from Keystore.")
+        return values
+
+    def call_with_key(self, key_name, send, stale_statuses=(401, 403)):
+        """Call send(api_key) and retry once with a fresh key if the response looks like a stale-key rejection.
+
+        A rejection is a status in stale_statuses, or an error body naming one of
+        KEY_REJECTION_REASONS (Gemini's 400 API_KEY_INVALID). send must return a
+        requests.Response. Returns None if no key could be obtained.
+        """
+        api_key = self.get_key(key_name)
+        if not api_key:
+            return None
+        response = send(api_key)
+        if self._rejects_key(response, stale_statuses):
+            logger.warning(f"Upstream rejected key '{key_name}' (HTTP {response.status_code}). Re-fetching from Keystore.")
+            fresh_key = self.refresh(key_name, rejected_value=api_key)
+            if fresh_key and fresh_key != api_key:
+                response = send(fresh_key)
+        return response
+
+    def start_change_watch(self, wait=30):
+        """Invalidate cached keys as soon as the Keystore reports them changed.
+
+        Runs a daemon thread that long-polls GET /keys:changes. Safe to call more than once.
+        """
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+        self._watch_thread = threading.Thread(target=self._watch_changes, args=(wait,),
+                                              name='keystore-change-watch', daemon=True)
+        self._watch_thread.start()
+
+    # --- Internals ---
+
+    @staticmethod
+    def _rejects_key(response, stale_statuses):
+        if response.status_code in stale_statuses:
+            return True
+        if response.ok:
+            return False
+        try:
+            body = response.text
+        except (requests.exceptions.RequestException, ValueError):
+            return False
+        return any(reason in body for reason in KEY_REJECTION_REASONS)
+
+    def _watch_changes(self, wait):
+        since = None
+        while True:
+            params = {'wait': wait}
+            if since is not None:
+                params['since'] = since
+            try:
+                response = self.session.get(f"{self.base_url}/keys:changes", params=params,
+                                            timeout=wait + self.timeout)
+                if not response.ok:
+                    logger.error(f"Keystore change feed returned HTTP {response.status_code}. Retrying later.")
+                    time.sleep(wait)
+                    continue
+                data = response.json()
+                for change in data.get('changes', []):
+                    logger.info(f"Keystore reported '{change['key_name']}' {change['op']}. Dropping cached value.")
+                    self.invalidate(change['key_name'])
+                since = data.get('last_seq', since)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"Error polling Keystore change feed: {e}. Retrying later.")
+                time.sleep(min(wait, 5))
+
+    def _join_flight(self, key_name):
+        """Return (flight, is_leader). Must be called with self._lock held."""
+        flight = self._flights.get(key_name)
+        if flight is not None:
+            return flight, False
+        flight = self._flights[key_name] = _Flight()
+        return flight, True
+
+    def _run_flight(self, key_name, flight):
+        value = None
+        try:
+            value = self._fetch_one(key_name)
+        finally:
+            self._finish_flight(key_name, flight, value)
+
+    def _finish_flight(self, key_name, flight, value):
+        with self._lock:
+            if value is not None:
+                self._cache[key_name] = (value, time.monotonic())
+            elif key_name in self._cache:
+                # A failed refresh keeps serving the old value, but at most max_stale seconds past its TTL
+                old_value, fetched_at = self._cache[key_name]
+                if time.monotonic() - fetched_at < self.ttl + self.max_stale:
+                    value = old_value
+                else:
+                    del self._cache[key_name]
+            if self._flights.get(key_name) is flight:
+                del self._flights[key_name]
+        flight.value = value
+        flight.done.set()
+
+    def _fetch_one(self, key_name):
+        if not self.token:
+            logger.error("KeystoreClient: KEYSTORE_JWT_TOKEN is not set.")
+            return None
+        url = f"{self.base_url}/keys/{key_name}"
+        try:
+            logger.info(f"Retrieving key '{key_name}' from Keystore at URL: {url}")
+            response = self.session.get(url, timeout=self.timeout)
+            if not response.ok:
+                logger.error(f"Keystore returned HTTP {response.status_code} for '{key_name}': {response.text}")
+                return None
+            api_key = response.json().get('api_key')
+            if not api_key:
+                logger.error(f"'api_key' field missing or empty in Keystore response for '{key_name}'.")
+                return None
+            return api_key
+        except requests.exceptions.ConnectionError as e:
+            logger.error(f"Connection Error: Could not connect to Keystore service at {self.base_url}. Details: {e}")
+        except requests.exceptions.Timeout as e:
+            logger.error(f"Timeout Error: Request to Keystore service timed out at {self.base_url}. Details: {e}")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error retrieving key '{key_name}' from Keystore: {e}")
+        except ValueError:
+            logger.error(f"Could not decode JSON response from Keystore for '{key_name}'.")
+        return None
+
+    def _fetch_batch(self, key_names):
+        if not self.token:
+            logger.error("KeystoreClient: KEYSTORE_JWT_TOKEN is not set.")
+            return {}
+        try:
+            response = self.session.post(f"{self.base_url}/keys:batch_get",
+                                         json={'key_names': key_names}, timeout=self.timeout)
+            if response.status_code == 404:
+                # Keystore without the batch endpoint: fall back to one request per key
+                logger.info("Keystore has no batch endpoint. Prefetching keys one by one.")
+                values = {name: self._fetch_one(name) for name in key_names}
+                return {name: value for name, value in values.items() if value}
+            if not response.ok:
+                logger.error(f"Keystore batch fetch returned HTTP {response.status_code}: {response.text}")
+                return {}
+            values = {}
+            for entry in response.json().get('keys', []):
+                if entry.get('status') == 'found' and entry.get('api_key'):
+                    values[entry['key_name']] = entry['api_key']
+                else:
+                    logger.warning(f"Keystore batch fetch: key '{entry.get('key_name')}' is {entry.get('status')}.")
+            return values
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error prefetching keys from Keystore at {self.base_url}: {e}")
+        except ValueError:
+            logger.error("Could not decode JSON response from Keystore batch fetch.")
+        return {}
@@ -1,5 +1,6 @@
 #!/bin/bash
 # backup-data.sh - Backup the keystore database and .env file to the persistent Docker volume
+# Usage: backup-data.sh [--incremental]
 
 set -e # Exit immediately if a command exits with a non-zero status
 
@@ -24,17 +25,29 @@ else
     DB_PATH_IN_VOLUME="${VOLUME_MOUNT_PATH}/keystore.db"
     TARGET_DB_BACKUP_FILE="${BACKUP_DIR}/${DB_BACKUP_FILE}"
 
-    # Check if the database file exists in the volume
-    if [ ! -f "$DB_PATH_IN_VOLUME" ]; then
+    if [ "$(docker inspect -f '{{.State.Running}}' api-keystore 2>/dev/null)" = "true" ]; then
+        # The service is running: take a consistent hot backup with the SQLite backup API
+        # (pass --incremental as the first argument to store only the pages changed since the last backup)
+        BACKUP_ID=$(docker exec api-keystore python keystore_backup.py backup $1 | tail -n 1)
+        # Copy the new backup (and any earlier ones it builds on) out of the volume
+        cp -n "${VOLUME_MOUNT_PATH}/backups/"keystore-* "$BACKUP_DIR/"
+        echo "✅ Hot backup created: ${BACKUP_DIR}/${BACKUP_ID}.json (restore with restore-data.sh ${BACKUP_ID})"
+        DB_BACKUP_SUCCESS=true
+    elif [ ! -f "$DB_PATH_IN_VOLUME" ]; then
         echo "⚠️ Warning: keystore.db not found in the volume at $DB_PATH_IN_VOLUME. Database might not be initialized yet."
         echo "    A database backup file will still be created, but it might be empty or contain only default data."
         touch "$TARGET_DB_BACKUP_FILE" # Create empty file to indicate backup attempt
+        DB_BACKUP_SUCCESS=true
     else
-        # Copy the database file from the volume's mount point to the backup directory
+        # The service is stopped, so the files are not changing. Recent writes may still
+        # live in the WAL file, so it has to be copied along with the database.
         cp "$DB_PATH_IN_VOLUME" "$TARGET_DB_BACKUP_FILE"
+        if [ -f "${DB_PATH_IN_VOLUME}-wal" ]; then
+            cp "${DB_PATH_IN_VOLUME}-wal" "${TARGET_DB_BACKUP_FILE}-wal"
+        fi
+        echo "✅ Database backup created: ${TARGET_DB_BACKUP_FILE}"
+        DB_BACKUP_SUCCESS=true
     fi
-    echo "✅ Database backup created: ${TARGET_DB_BACKUP_FILE}"
-    DB_BACKUP_SUCCESS=true
 fi
 
 echo "🔐 Backing up .env file..."
@@ -8,12 +8,36 @@ ENV_BACKUP_FILE=""     # Will be derived from DB_BACKUP_FILE_ARG
 
 # Check if a database backup file argument is provided
 if [ -z "$DB_BACKUP_FILE_ARG" ]; then
-    echo "Usage: $0 <database_backup_file>"
+    echo "Usage: $0 <database_backup_file | hot_backup_id>"
+    echo "Available hot backups:"
+    ls ./backups/keystore-*.json 2>/dev/null | xargs -n 1 basename 2>/dev/null | sed 's/\.json$//' || echo "    No hot backups found in ./backups/"
     echo "Available database backups:"
     ls -la ./backups/*.db 2>/dev/null || echo "    No .db backup files found in ./backups/"
     exit 1
 fi
 
+# Hot backups (created by keystore_backup.py) are verified and restored by the service image itself
+if [ -f "./backups/${DB_BACKUP_FILE_ARG}.json" ]; then
+    read -p "⚠️  This will replace the current database with hot backup ${DB_BACKUP_FILE_ARG}. Proceed? (y/N): " -n 1 -r
+    echo
+    if [[ ! "$REPLY" =~ ^[Yy]$ ]]; then
+        echo "Restore cancelled."
+        exit 1
+    fi
+    echo "🔄 Stopping API Keystore container (if running) for safe restore..."
+    docker stop api-keystore 2>/dev/null || echo "API Keystore container not running."
+    echo "📥 Verifying and restoring ${DB_BACKUP_FILE_ARG}..."
+    docker run --rm \
+        -v keystore_data:/app/data \
+        -v "$(realpath ./backups):/backups:ro" \
+        api-keystore \
+        python keystore_backup.py --dir /backups restore "$DB_BACKUP_FILE_ARG" --yes
+    echo "🚀 Starting API Keystore container..."
+    docker start api-keystore
+    echo "✅ Restore complete! Please allow a few seconds for the service to become healthy."
+    exit 0
+fi
+
 # Convert the provided backup file argument to an absolute path
 # This is crucial for Docker to correctly resolve the host path.
 HOST_ABS_DB_BACKUP_PATH=$(realpath "$DB_BACKUP_FILE_ARG")
@@ -55,15 +79,26 @@ echo "📥 Restoring database backup to persistent volume using Docker's bind mo
 # Use a temporary busybox container to:
 # 1. Mount the persistent 'keystore_data' volume to /volume_data
 # 2. Mount the *specific database backup file* from the host (now an absolute path) to /tmp/backup.db (read-only)
-# 3. Copy the database file from /tmp/backup.db to /volume_data/keystore.db
+# 3. Remove any WAL/shared-memory files left by the old database (SQLite would replay them onto the restored file)
+#    and copy the database file from /tmp/backup.db to /volume_data/keystore.db
 # 4. Set correct ownership (appuser:appuser, uid 1001) for the copied file within the volume
 # All operations are now combined into a single sh -c command for atomicity and path consistency.
+# Backups taken while the service was stopped carry their WAL file alongside; restore it too
+WAL_ARGS=()
+WAL_COPY="true"
+if [ -f "${HOST_ABS_DB_BACKUP_PATH}-wal" ]; then
+    WAL_ARGS=(-v "${HOST_ABS_DB_BACKUP_PATH}-wal:/tmp/backup.db-wal:ro")
+    WAL_COPY="cp /tmp/backup.db-wal /volume_data/keystore.db-wal && chown 1001:1001 /volume_data/keystore.db-wal"
+fi
 docker run --rm \
     -v keystore_data:/volume_data \
     -v "$HOST_ABS_DB_BACKUP_PATH:/tmp/backup.db:ro" \
+    "${WAL_ARGS[@]}" \
     busybox \
-    sh -c "cp /tmp/backup.db /volume_data/keystore.db && \
-           chown 1001:1001 /volume_data/keystore.db"
+    sh -c "rm -f /volume_data/keystore.db-wal /volume_data/keystore.db-shm && \
+           cp /tmp/backup.db /volume_data/keystore.db && \
+           chown 1001:1001 /volume_data/keystore.db && \
+           $WAL_COPY"
 
 echo "✅ Database restored to volume."
 
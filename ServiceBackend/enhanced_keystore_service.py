@@ -4,18 +4,42 @@ Enhanced API Key Management Service with Web Authentication
 Features: User management, role-based access, web interface support
 """
 
+import io
 import os
+import base64
+import math
+import mmap
+import struct
+import csv
 import json
+import gzip
+import fcntl
+import time
+import atexit
+import queue
 import hashlib
 import secrets
+import tempfile
+import sys
 import sqlite3
+import threading
+import multiprocessing
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
+from contextlib import closing, contextmanager
 import jwt
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, request, jsonify, g, send_from_directory
+from flask import Flask, Response, request, jsonify, g, send_from_directory, stream_with_context, has_request_context
 from flask_cors import CORS
+import keystore_backup
+import keystore_metrics
+import keystore_replication
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for web frontend
@@ -39,30 +63,534 @@ if not ENCRYPTION_KEY:
     ENCRYPTION_KEY = Fernet.generate_key().decode()
     print(f"WARNING: ENCRYPTION_KEY not set in environment. Using newly generated key: {ENCRYPTION_KEY}")
 
-cipher = Fernet(ENCRYPTION_KEY.encode()) # Fernet key must be bytes
+# Previous encryption keys (comma-separated) stay valid for decryption while
+# POST /admin/key-rotation re-encrypts stored values with ENCRYPTION_KEY.
+ENCRYPTION_KEYS_PREVIOUS = [key.strip() for key in os.environ.get('ENCRYPTION_KEYS_PREVIOUS', '').split(',') if key.strip()]
+
+# New values are always encrypted with ENCRYPTION_KEY; every listed key can decrypt
+primary_cipher = Fernet(ENCRYPTION_KEY.encode()) # Fernet key must be bytes
+cipher = MultiFernet([primary_cipher] + [Fernet(key.encode()) for key in ENCRYPTION_KEYS_PREVIOUS])
 
 JWT_EXPIRY_HOURS = 24
 
+# The Flask debugger is only enabled when explicitly requested
+DEBUG = os.environ.get('FLASK_DEBUG', '0').lower() in ('1', 'true', 'yes')
+
+# Page sizes for GET /logs (default per role, and the largest page a caller may ask for)
+LOGS_PAGE_SIZE_ADMIN = 100
+LOGS_PAGE_SIZE_USER = 50
+LOGS_MAX_PAGE_SIZE = int(os.environ.get('LOGS_MAX_PAGE_SIZE', 500))
+
+# Rows read per query by GET /logs/export; memory use is bounded by one chunk
+LOGS_EXPORT_CHUNK_SIZE = int(os.environ.get('LOGS_EXPORT_CHUNK_SIZE', 1000))
+
+# Largest number of rows returned by GET /logs/stats
+LOGS_STATS_MAX_ROWS = int(os.environ.get('LOGS_STATS_MAX_ROWS', 5000))
+
+# Page sizes for GET /keys and GET /users (default, and the largest page a caller may ask for)
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', 100))
+LIST_MAX_PAGE_SIZE = int(os.environ.get('LIST_MAX_PAGE_SIZE', 1000))
+
+# Upper bound on the number of key names accepted by POST /keys:batch_get
+BATCH_GET_MAX_KEYS = int(os.environ.get('BATCH_GET_MAX_KEYS', 100))
+
+# Bulk key import (POST /keys:import) and export (GET /keys:export)
+KEY_IMPORT_MAX_ROWS = int(os.environ.get('KEY_IMPORT_MAX_ROWS', 50000))
+KEY_EXPORT_CHUNK_SIZE = int(os.environ.get('KEY_EXPORT_CHUNK_SIZE', 500))
+
+# Key change feed (GET /keys:changes long-poll and GET /keys:watch SSE stream)
+CHANGE_FEED_MAX_WAIT = int(os.environ.get('CHANGE_FEED_MAX_WAIT', 30))
+CHANGE_FEED_POLL_INTERVAL = float(os.environ.get('CHANGE_FEED_POLL_INTERVAL', 1.0))
+CHANGE_FEED_HEARTBEAT = int(os.environ.get('CHANGE_FEED_HEARTBEAT', 15))
+CHANGE_FEED_STREAM_MAX_SECONDS = int(os.environ.get('CHANGE_FEED_STREAM_MAX_SECONDS', 300))
+CHANGE_FEED_PAGE_SIZE = 500
+
+# SQLite connection pool and tuning. Connections are opened once per worker and
+# reused across requests; the database runs in WAL mode so readers do not block
+# behind the writer.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -16000))  # negative = KiB
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_STATEMENT_CACHE = int(os.environ.get('SQLITE_STATEMENT_CACHE', 128))
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    print(f"WARNING: Unknown SQLITE_SYNCHRONOUS '{SQLITE_SYNCHRONOUS}'. Falling back to 'NORMAL'.")
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+
+# In-process cache of decrypted key values. Entries are bounded by count and
+# total size and expire after KEY_CACHE_TTL seconds (0 disables the cache).
+KEY_CACHE_TTL = float(os.environ.get('KEY_CACHE_TTL', 300))
+KEY_CACHE_MAX_ENTRIES = int(os.environ.get('KEY_CACHE_MAX_ENTRIES', 1000))
+KEY_CACHE_MAX_BYTES = int(os.environ.get('KEY_CACHE_MAX_BYTES', 4 * 1024 * 1024))
+
+# Verified JWTs are cached (by SHA-256 digest) until they expire, so repeat
+# requests skip jwt.decode. Revoked tokens are kept in memory and re-synced
+# from the access_tokens table every TOKEN_REVOCATION_SYNC_INTERVAL seconds.
+JWT_CACHE_MAX_ENTRIES = int(os.environ.get('JWT_CACHE_MAX_ENTRIES', 10000))
+TOKEN_REVOCATION_SYNC_INTERVAL = float(os.environ.get('TOKEN_REVOCATION_SYNC_INTERVAL', 5))
+
+# Password hashing runs on a small bounded pool so a burst of logins cannot
+# occupy every request thread. PASSWORD_HASH_METHOD is a werkzeug method spec;
+# stored hashes made with a different spec are upgraded on the next login.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_MAX_WAITING = int(os.environ.get('PASSWORD_HASH_MAX_WAITING', 32))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
+
+# Prometheus metrics at GET /metrics. With several gunicorn workers each worker
+# writes a snapshot to METRICS_DIR every METRICS_SNAPSHOT_INTERVAL seconds and a
+# scrape merges them. Set METRICS_TOKEN to require "Authorization: Bearer <token>".
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'keystore-metrics'))
+METRICS_SNAPSHOT_INTERVAL = float(os.environ.get('METRICS_SNAPSHOT_INTERVAL', 5))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Per-request phase timing (auth, db, crypto, audit) sent as a Server-Timing
+# header; requests slower than SLOW_REQUEST_MS are logged with their phases (0 disables).
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', '1').lower() in ('1', 'true', 'yes')
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+
+# Longest capture accepted by POST /admin/profile
+PROFILER_MAX_SECONDS = int(os.environ.get('PROFILER_MAX_SECONDS', 30))
+
+# Hot backups (see keystore_backup.py for step pacing settings)
+BACKUP_DIR = os.environ.get('BACKUP_DIR', os.path.join(os.path.dirname(DATABASE), 'backups'))
+
+# Background re-encryption after an ENCRYPTION_KEY rotation: keys per batch and pause between batches
+KEY_ROTATION_BATCH_SIZE = int(os.environ.get('KEY_ROTATION_BATCH_SIZE', 100))
+KEY_ROTATION_BATCH_PAUSE = float(os.environ.get('KEY_ROTATION_BATCH_PAUSE', 0.1))
+
+# Audit log retention: rows older than AUDIT_RETENTION_DAYS are moved into
+# gzip-compressed NDJSON files, one per month, under AUDIT_ARCHIVE_DIR, and the
+# freed pages are reclaimed with incremental vacuum (0 days disables retention).
+AUDIT_RETENTION_DAYS = int(os.environ.get('AUDIT_RETENTION_DAYS', 90))
+AUDIT_ARCHIVE_DIR = os.environ.get('AUDIT_ARCHIVE_DIR', os.path.join(os.path.dirname(DATABASE), 'archive'))
+AUDIT_RETENTION_INTERVAL = int(os.environ.get('AUDIT_RETENTION_INTERVAL', 3600))
+AUDIT_RETENTION_BATCH_SIZE = int(os.environ.get('AUDIT_RETENTION_BATCH_SIZE', 5000))
+AUDIT_RETENTION_BATCH_PAUSE = float(os.environ.get('AUDIT_RETENTION_BATCH_PAUSE', 0.05))
+AUDIT_VACUUM_STEP_PAGES = int(os.environ.get('AUDIT_VACUUM_STEP_PAGES', 1000))
+
+# Audit log durability mode:
+#   sync  - every request inserts and commits its own audit rows (default)
+#   group - rows are committed by a background writer in batches; the request
+#           waits until its batch has been committed
+#   async - rows are queued for the background writer and the request returns
+#           immediately (rows still queued at a crash are lost)
+AUDIT_LOG_MODE = os.environ.get('AUDIT_LOG_MODE', 'sync').lower()
+if AUDIT_LOG_MODE not in ('sync', 'group', 'async'):
+    print(f"WARNING: Unknown AUDIT_LOG_MODE '{AUDIT_LOG_MODE}'. Falling back to 'sync'.")
+    AUDIT_LOG_MODE = 'sync'
+AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', 10000))
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+AUDIT_FLUSH_INTERVAL_MS = int(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', 5))
+# A batch that fails to commit is retried this many times before its rows are dropped
+AUDIT_WRITE_RETRIES = int(os.environ.get('AUDIT_WRITE_RETRIES', 3))
+
+# Admission control (off unless RATE_LIMIT_ENABLED=1). Every authenticated
+# request takes a token from its user's bucket; RATE_LIMITS lists
+# "name=rate:burst" entries (requests per second and bucket size) where name is
+# user:<username> or role:<role>, and a user entry wins over its role. The
+# 'login' entry limits login attempts per submitted username and client address.
+# With KEYSTORE_PRELOAD=1 all gunicorn workers share the same buckets.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '0').lower() in ('1', 'true', 'yes')
+RATE_LIMITS = os.environ.get('RATE_LIMITS', 'role:user=50:100,role:admin=100:200,login=1:10')
+RATE_LIMIT_SLOTS = int(os.environ.get('RATE_LIMIT_SLOTS', 4096))
+
+# At most WRITE_CONCURRENCY requests per worker run a DB-writing route at once;
+# others wait up to WRITE_QUEUE_TIMEOUT seconds for a slot and then get a 503.
+WRITE_CONCURRENCY = int(os.environ.get('WRITE_CONCURRENCY', 4))
+WRITE_QUEUE_TIMEOUT = float(os.environ.get('WRITE_QUEUE_TIMEOUT', 2))
+
+# In group/async audit mode, requests get a 503 while more than this many
+# batches are waiting for the audit writer
+AUDIT_QUEUE_HIGH_WATER = int(os.environ.get('AUDIT_QUEUE_HIGH_WATER', AUDIT_QUEUE_SIZE * 8 // 10))
+
+# Replication (see keystore_replication.py). With REPLICATION_ENABLED=1 the
+# primary publishes the pages changed in DATABASE to REPLICATION_DIR every
+# REPLICATION_INTERVAL seconds, with a full snapshot every
+# REPLICATION_FULL_EVERY publishes. An instance started with
+# KEYSTORE_ROLE=follower serves read-only routes from its own copy of the
+# database (DATABASE becomes a symlink to it), and forwards writes to
+# FOLLOWER_PRIMARY_URL (or rejects them when it is not set).
+KEYSTORE_ROLE = os.environ.get('KEYSTORE_ROLE', 'primary').lower()
+if KEYSTORE_ROLE not in ('primary', 'follower'):
+    print(f"WARNING: Unknown KEYSTORE_ROLE '{KEYSTORE_ROLE}'. Falling back to 'primary'.")
+    KEYSTORE_ROLE = 'primary'
+FOLLOWER = KEYSTORE_ROLE == 'follower'
+REPLICATION_ENABLED = os.environ.get('REPLICATION_ENABLED', '0').lower() in ('1', 'true', 'yes')
+REPLICATION_DIR = os.environ.get('REPLICATION_DIR', os.path.join(os.path.dirname(DATABASE), 'replication'))
+REPLICATION_INTERVAL = float(os.environ.get('REPLICATION_INTERVAL', 5))
+REPLICATION_FULL_EVERY = int(os.environ.get('REPLICATION_FULL_EVERY', 100))
+REPLICATION_POLL_INTERVAL = float(os.environ.get('REPLICATION_POLL_INTERVAL', 1))
+FOLLOWER_PRIMARY_URL = os.environ.get('FOLLOWER_PRIMARY_URL', '').rstrip('/')
+FOLLOWER_FORWARD_TIMEOUT = float(os.environ.get('FOLLOWER_FORWARD_TIMEOUT', 30))
+# /health reports a follower unhealthy once its copy is older than this (seconds)
+FOLLOWER_MAX_LAG = float(os.environ.get('FOLLOWER_MAX_LAG', 60))
+
+metrics = keystore_metrics.MetricsRegistry(METRICS_DIR, METRICS_SNAPSHOT_INTERVAL)
+http_requests_total = metrics.counter(
+    'keystore_http_requests_total', 'HTTP requests by route and status.', ('method', 'route', 'status'))
+http_request_duration = metrics.histogram(
+    'keystore_http_request_duration_seconds', 'HTTP request latency by route.', ('method', 'route'))
+http_requests_in_flight = metrics.gauge(
+    'keystore_http_requests_in_flight', 'HTTP requests currently being served.', ('route',))
+sqlite_statement_duration = metrics.histogram(
+    'keystore_sqlite_statement_duration_seconds', 'SQLite statement execution time, including lock waits.', ('statement',))
+sqlite_commit_duration = metrics.histogram(
+    'keystore_sqlite_commit_duration_seconds', 'SQLite commit time.')
+crypto_duration = metrics.histogram(
+    'keystore_crypto_duration_seconds', 'Fernet encrypt/decrypt time.', ('operation',))
+jwt_verify_duration = metrics.histogram(
+    'keystore_jwt_verify_duration_seconds', 'JWT verification time by outcome.', ('result',))
+audit_write_duration = metrics.histogram(
+    'keystore_audit_write_duration_seconds', 'Time a request spends writing (or queueing) its audit rows.', ('mode',))
+audit_batch_duration = metrics.histogram(
+    'keystore_audit_batch_write_duration_seconds', 'Background audit writer batch commit time.')
+audit_queue_depth = metrics.gauge(
+    'keystore_audit_queue_depth', 'Audit rows waiting for the background writer.')
+audit_rows_dropped = metrics.counter(
+    'keystore_audit_rows_dropped_total', 'Audit rows the background writer could not commit.')
+admission_rejections = metrics.counter(
+    'keystore_admission_rejections_total', 'Requests rejected by admission control, by reason.', ('reason',))
+
+class request_phase:
+    """Times one phase of the current request and optionally records it in a histogram.
+
+    Phase times are exclusive: time spent in a nested phase (e.g. the SQL run
+    while writing audit rows) is only counted once, under the inner phase.
+    Outside a request (background threads) only the histogram is updated.
+    """
+    __slots__ = ('name', 'histogram', 'labels', 'start', 'children', 'elapsed', 'tracked')
+
+    def __init__(self, name, histogram=None, *labels):
+        self.name = name
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.tracked = SERVER_TIMING_ENABLED and has_request_context()
+        self.children = 0.0
+        if self.tracked:
+            g.setdefault('phase_stack', []).append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        if self.histogram is not None:
+            self.histogram.observe(self.elapsed, *self.labels)
+        if self.tracked:
+            stack = g.phase_stack
+            stack.pop()
+            if stack:
+                stack[-1].children += self.elapsed
+            phases = g.setdefault('request_phases', {})
+            phases[self.name] = phases.get(self.name, 0.0) + self.elapsed - self.children
+        return False
+
+SQL_STATEMENT_KINDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'PRAGMA', 'BEGIN')
+
+def sql_statement_kind(sql):
+    kind = sql.lstrip()[:6].upper()
+    return kind if kind in SQL_STATEMENT_KINDS else 'OTHER'
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that records statement and commit timings."""
+
+    def execute(self, sql, *args):
+        with request_phase('db', sqlite_statement_duration, sql_statement_kind(sql)):
+            return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        with request_phase('db', sqlite_statement_duration, sql_statement_kind(sql)):
+            return super().executemany(sql, *args)
+
+    def commit(self):
+        with request_phase('db', sqlite_commit_duration):
+            return super().commit()
+
+class TimedCipher:
+    """Wraps the MultiFernet cipher to record encrypt/decrypt timings."""
+
+    def __init__(self, cipher):
+        self._cipher = cipher
+
+    def encrypt(self, data):
+        with request_phase('crypto', crypto_duration, 'encrypt'):
+            return self._cipher.encrypt(data)
+
+    def decrypt(self, token):
+        with request_phase('crypto', crypto_duration, 'decrypt'):
+            return self._cipher.decrypt(token)
+
+    def rotate(self, token):
+        with request_phase('crypto', crypto_duration, 'rotate'):
+            return self._cipher.rotate(token)
+
+TIMING_ENABLED = METRICS_ENABLED or SERVER_TIMING_ENABLED
+if TIMING_ENABLED:
+    cipher = TimedCipher(cipher)
+
+class ReplicaConnection(sqlite3.Connection):
+    """Connection to a follower's copy that holds the copy's read lock until it is closed."""
+
+    replica_lock = None
+
+    def close(self):
+        super().close()
+        if self.replica_lock is not None:
+            self.replica_lock.close()
+
+class TimedReplicaConnection(TimedConnection, ReplicaConnection):
+    pass
+
+def open_db_connection():
+    """Open a tuned SQLite connection to DATABASE."""
+    if FOLLOWER:
+        # A follower's copy is never modified while it is open (the lock is the
+        # proof): skip locking and change checks
+        path, replica_lock = keystore_replication.open_replica(DATABASE)
+        database, uri = f"file:{urllib.parse.quote(path)}?mode=ro&immutable=1", True
+        factory = TimedReplicaConnection if TIMING_ENABLED else ReplicaConnection
+    else:
+        database, uri = DATABASE, False
+        factory = TimedConnection if TIMING_ENABLED else sqlite3.Connection
+    try:
+        conn = sqlite3.connect(
+            database,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+            check_same_thread=False,  # Pooled connections move between request threads
+            cached_statements=SQLITE_STATEMENT_CACHE,
+            factory=factory,
+            uri=uri
+        )
+    except Exception:
+        if FOLLOWER:
+            replica_lock.close()
+        raise
+    if FOLLOWER:
+        conn.replica_lock = replica_lock
+    conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA cache_size = {SQLITE_CACHE_SIZE}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+    return conn
+
+class ConnectionPool:
+    """Fixed-size pool of pre-opened SQLite connections."""
+
+    def __init__(self, size, timeout):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.generation = 0
+        self._reset()
+
+    def _reset(self):
+        # Connections inherited across fork() must not be reused by the child
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._generations = {}  # id(conn) -> generation it was opened in
+
+    def invalidate(self):
+        """Close idle connections and retire busy ones when they are released (the database file was replaced)."""
+        with self._lock:
+            self.generation += 1
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._generations.pop(id(conn), None)
+                self._opened -= 1
+                conn.close()
+
+    def acquire(self):
+        """Take a connection from the pool, opening one if the pool is not full yet."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    conn = open_db_connection()
+                except Exception:
+                    self._opened -= 1
+                    raise
+                self._generations[id(conn)] = self.generation
+                return conn
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError(f'No database connection available after {self.timeout}s')
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work."""
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            print(f"Discarding broken database connection: {e}")
+            with self._lock:
+                self._generations.pop(id(conn), None)
+                self._opened -= 1
+            return
+        if self._generations.get(id(conn)) != self.generation:
+            # Opened before invalidate(): hand a connection to the new file to the next caller instead
+            self._generations.pop(id(conn), None)
+            conn.close()
+            try:
+                conn = open_db_connection()
+            except Exception as e:
+                print(f"Could not reopen database connection: {e}")
+                with self._lock:
+                    self._opened -= 1
+                return
+            with self._lock:
+                self._generations[id(conn)] = self.generation
+        self._idle.put(conn)
+
+db_pool = ConnectionPool(DB_POOL_SIZE, DB_POOL_TIMEOUT)
+
 def get_db():
     """Get database connection."""
     if 'db' not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
+        g.db = db_pool.acquire()
     return g.db
 
 def close_db(error):
-    """Close database connection."""
-    db = g.get('db')
+    """Return the database connection to the pool."""
+    db = g.pop('db', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
 
 @app.teardown_appcontext
 def close_db_context(error):
     close_db(error)
 
+class DecryptedKeyCache:
+    """LRU/TTL cache of decrypted key values.
+
+    Entries are keyed by key_name and only count as a hit while the row's
+    updated_at and ciphertext are unchanged, so a rotation made by another
+    worker is never served stale. Access checks are not cached.
+    """
+
+    def __init__(self, ttl, max_entries, max_bytes):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def _entry_size(encrypted_value, value):
+        return len(encrypted_value) + len(value)
+
+    def get(self, key_name, updated_at, encrypted_value):
+        """Return the cached plaintext for this exact row version, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key_name)
+            if entry is not None:
+                cached_updated_at, cached_encrypted_value, value, expires_at = entry
+                if (cached_updated_at == updated_at and cached_encrypted_value == encrypted_value
+                        and expires_at > time.monotonic()):
+                    self._entries.move_to_end(key_name)
+                    self.hits += 1
+                    return value
+                self._remove(key_name)
+            self.misses += 1
+            return None
+
+    def put(self, key_name, updated_at, encrypted_value, value):
+        if not self.enabled:
+            return
+        size = self._entry_size(encrypted_value, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key_name)
+            self._entries[key_name] = (updated_at, encrypted_value, value, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, *key_names):
+        with self._lock:
+            for key_name in key_names:
+                self._remove(key_name)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key_name):
+        entry = self._entries.pop(key_name, None)
+        if entry is not None:
+            self._bytes -= self._entry_size(entry[1], entry[2])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+key_cache = DecryptedKeyCache(KEY_CACHE_TTL, KEY_CACHE_MAX_ENTRIES, KEY_CACHE_MAX_BYTES)
+
+def decrypt_api_key(key):
+    """Decrypt the value of an api_keys row, going through the key cache."""
+    value = key_cache.get(key['key_name'], key['updated_at'], key['encrypted_value'])
+    if value is None:
+        value = cipher.decrypt(key['encrypted_value'].encode()).decode()
+        key_cache.put(key['key_name'], key['updated_at'], key['encrypted_value'], value)
+    return value
+
 def init_db():
     """Initialize the database with required tables."""
-    with sqlite3.connect(DATABASE) as conn:
+    # closing() so no connection is left open when gunicorn forks workers after init
+    with closing(sqlite3.connect(DATABASE)) as conn:
+        # Incremental auto-vacuum lets audit retention give space back in small steps.
+        # Existing databases need a one-time VACUUM for the setting to take effect.
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            has_tables = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table'").fetchone()
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            if has_tables:
+                print("Converting database to incremental auto-vacuum (one-time VACUUM)...")
+                conn.execute('VACUUM')
+        
+        # WAL mode is persistent, so setting it once here applies to every connection
+        conn.execute('PRAGMA journal_mode = WAL')
         conn.executescript('''
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -83,6 +611,7 @@ def init_db():
                 created_by TEXT,
                 owner_id INTEGER,
                 description TEXT,
+                version INTEGER NOT NULL DEFAULT 1,
                 FOREIGN KEY (owner_id) REFERENCES users (id)
             );
             
@@ -108,17 +637,117 @@ def init_db():
                 success BOOLEAN DEFAULT 1,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             );
+            
+            CREATE INDEX IF NOT EXISTS idx_access_log_timestamp ON access_log (timestamp);
+            CREATE INDEX IF NOT EXISTS idx_access_log_user_timestamp ON access_log (user_id, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_access_log_action_timestamp ON access_log (action, timestamp);
+            
+            -- Keyset pagination and owner filters of GET /keys and GET /users
+            CREATE INDEX IF NOT EXISTS idx_api_keys_created_at ON api_keys (created_at);
+            CREATE INDEX IF NOT EXISTS idx_api_keys_owner_created_at ON api_keys (owner_id, created_at);
+            CREATE INDEX IF NOT EXISTS idx_api_keys_owner_key_name ON api_keys (owner_id, key_name);
+            CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at);
+            CREATE INDEX IF NOT EXISTS idx_users_role_created_at ON users (role, created_at);
+        ''')
+        
+        # Per-key edit counter behind key ETags and the change feed; older databases lack it
+        if 'version' not in [column[1] for column in conn.execute('PRAGMA table_info(api_keys)')]:
+            conn.execute('ALTER TABLE api_keys ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+        
+        # Checkpoint of the background re-encryption job (a single row)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS key_rotation (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                target_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                reencrypted INTEGER NOT NULL DEFAULT 0,
+                already_current INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                started_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        
+        init_access_log_fts(conn)
+        init_access_log_rollup(conn)
+        
+        # Version counters bumped on every api_keys change and on user renames (created_by
+        # in listings is the owner's current username); together they back the GET /keys ETag
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS table_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            );
+            
+            INSERT OR IGNORE INTO table_versions (name, version) VALUES ('api_keys', 0);
+            INSERT OR IGNORE INTO table_versions (name, version) VALUES ('users', 0);
+            
+            CREATE TRIGGER IF NOT EXISTS users_version_update AFTER UPDATE OF username ON users BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'users';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS users_version_delete AFTER DELETE ON users BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'users';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS api_keys_version_insert AFTER INSERT ON api_keys BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'api_keys';
+            END;
+            
+            -- Only edits count: they bump api_keys.version, while re-encryption by the key
+            -- rotation job leaves it alone. Recreated so older databases pick this up.
+            DROP TRIGGER IF EXISTS api_keys_version_update;
+            CREATE TRIGGER api_keys_version_update AFTER UPDATE OF version ON api_keys BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'api_keys';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS api_keys_version_delete AFTER DELETE ON api_keys BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'api_keys';
+            END;
+        ''')
+        
+        # Monotonically sequenced log of key mutations, served by the change feed.
+        # Written by triggers so it commits atomically with the change itself
+        # (including the bulk key deletion done by delete_user).
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS key_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key_name TEXT NOT NULL,
+                owner_id INTEGER,
+                op TEXT NOT NULL,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            
+            CREATE INDEX IF NOT EXISTS idx_key_changes_owner_seq ON key_changes (owner_id, seq);
+            
+            CREATE TRIGGER IF NOT EXISTS api_keys_change_insert AFTER INSERT ON api_keys BEGIN
+                INSERT INTO key_changes (key_name, owner_id, op) VALUES (new.key_name, new.owner_id, 'add');
+            END;
+            
+            -- Re-encryption does not bump version: not a change clients need to hear about
+            DROP TRIGGER IF EXISTS api_keys_change_update;
+            CREATE TRIGGER api_keys_change_update AFTER UPDATE OF version ON api_keys BEGIN
+                INSERT INTO key_changes (key_name, owner_id, op) VALUES (new.key_name, new.owner_id, 'update');
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS api_keys_change_delete AFTER DELETE ON api_keys BEGIN
+                INSERT INTO key_changes (key_name, owner_id, op) VALUES (old.key_name, old.owner_id, 'delete');
+            END;
         ''')
         
         # Create default admin user (password: admin123)
-        admin_hash = generate_password_hash('admin123')
+        admin_hash = generate_password_hash('admin123', PASSWORD_HASH_METHOD)
         conn.execute('''
             INSERT OR IGNORE INTO users (username, password_hash, role) 
             VALUES (?, ?, ?)
         ''', ('admin', admin_hash, 'admin'))
         
         # Create default regular user (password: user123)
-        user_hash = generate_password_hash('user123')
+        user_hash = generate_password_hash('user123', PASSWORD_HASH_METHOD)
         conn.execute('''
             INSERT OR IGNORE INTO users (username, password_hash, role) 
             VALUES (?, ?, ?)
@@ -126,6 +755,385 @@ def init_db():
         
         conn.commit()
 
+def init_access_log_fts(conn):
+    """Create the trigram full-text index over access_log and its sync triggers.
+
+    The index is optional: SQLite builds without FTS5 (or older than 3.34,
+    which lacks the trigram tokenizer) fall back to LIKE scans for ?q= searches.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'access_log_fts'"
+    ).fetchone()
+    try:
+        conn.executescript('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS access_log_fts USING fts5(
+                user_name, key_name, action, ip_address,
+                content='access_log', content_rowid='id', tokenize='trigram'
+            );
+            
+            CREATE TRIGGER IF NOT EXISTS access_log_fts_insert AFTER INSERT ON access_log BEGIN
+                INSERT INTO access_log_fts (rowid, user_name, key_name, action, ip_address)
+                VALUES (new.id, new.user_name, new.key_name, new.action, new.ip_address);
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS access_log_fts_delete AFTER DELETE ON access_log BEGIN
+                INSERT INTO access_log_fts (access_log_fts, rowid, user_name, key_name, action, ip_address)
+                VALUES ('delete', old.id, old.user_name, old.key_name, old.action, old.ip_address);
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS access_log_fts_update AFTER UPDATE ON access_log BEGIN
+                INSERT INTO access_log_fts (access_log_fts, rowid, user_name, key_name, action, ip_address)
+                VALUES ('delete', old.id, old.user_name, old.key_name, old.action, old.ip_address);
+                INSERT INTO access_log_fts (rowid, user_name, key_name, action, ip_address)
+                VALUES (new.id, new.user_name, new.key_name, new.action, new.ip_address);
+            END;
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"WARNING: Full-text search over access logs is unavailable: {e}")
+        return
+    
+    if not exists:
+        # Index rows written before the full-text table existed
+        conn.execute("INSERT INTO access_log_fts (access_log_fts) VALUES ('rebuild')")
+
+def init_access_log_rollup(conn):
+    """Create the hourly access_log rollup table and the trigger that maintains it.
+
+    Every inserted log row bumps one counter per dimension ('all', 'user',
+    'action', 'key') in its hour bucket, so /logs/stats reads a number of rows
+    proportional to buckets x distinct values rather than to raw log volume.
+    Rows removed by audit retention keep their counts.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'access_log_rollup'"
+    ).fetchone()
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS access_log_rollup (
+            dimension TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            value TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, bucket, value)
+        ) WITHOUT ROWID;
+        
+        CREATE TRIGGER IF NOT EXISTS access_log_rollup_insert AFTER INSERT ON access_log BEGIN
+            INSERT INTO access_log_rollup (dimension, bucket, value, total, failures)
+            VALUES
+                ('all', strftime('%Y-%m-%d %H:00:00', new.timestamp), '', 1, NOT new.success),
+                ('user', strftime('%Y-%m-%d %H:00:00', new.timestamp), COALESCE(new.user_name, ''), 1, NOT new.success),
+                ('action', strftime('%Y-%m-%d %H:00:00', new.timestamp), COALESCE(new.action, ''), 1, NOT new.success),
+                ('key', strftime('%Y-%m-%d %H:00:00', new.timestamp), COALESCE(new.key_name, ''), 1, NOT new.success)
+            ON CONFLICT (dimension, bucket, value) DO UPDATE SET
+                total = total + excluded.total,
+                failures = failures + excluded.failures;
+        END;
+    ''')
+    
+    if not exists:
+        # Roll up rows written before the rollup table existed
+        for dimension, column in (('all', "''"), ('user', 'user_name'), ('action', 'action'), ('key', 'key_name')):
+            conn.execute(f'''
+                INSERT INTO access_log_rollup (dimension, bucket, value, total, failures)
+                SELECT '{dimension}', strftime('%Y-%m-%d %H:00:00', timestamp), COALESCE({column}, ''),
+                       COUNT(*), SUM(NOT success)
+                FROM access_log
+                GROUP BY 2, 3
+            ''')
+
+_access_log_fts_available = None
+
+def access_log_fts_available(db):
+    """Whether the access_log_fts index exists in the database (cached per process)."""
+    global _access_log_fts_available
+    if _access_log_fts_available is None:
+        _access_log_fts_available = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'access_log_fts'"
+        ).fetchone() is not None
+    return _access_log_fts_available
+
+class PasswordHashingBusy(Exception):
+    """Raised when the password hashing pool cannot accept more work."""
+
+class PasswordHasher:
+    """Bounded pool for password hashing and verification.
+
+    At most `workers` hashes run at once and at most `max_waiting` callers
+    queue for a slot; beyond that, or after waiting `queue_timeout` seconds,
+    PasswordHashingBusy is raised so the request fails fast with a 503.
+    Werkzeug's PBKDF2/scrypt implementations release the GIL, so pool threads
+    hash in parallel without blocking other request threads.
+    """
+
+    def __init__(self, method, workers, max_waiting, queue_timeout):
+        self.method = method
+        self.workers = max(1, workers)
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self.run_time_total = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            # Threads do not survive fork(), so each worker process builds its own pool
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+            return self._executor
+
+    def _run(self, func, *args):
+        # Queue wait plus hashing shows up as the 'password' phase in Server-Timing
+        with request_phase('password'):
+            return self._run_in_pool(func, *args)
+
+    def _run_in_pool(self, func, *args):
+        with self._lock:
+            if self._waiting >= self.max_waiting:
+                self.rejected += 1
+                raise PasswordHashingBusy()
+            self._waiting += 1
+        
+        queued_at = time.monotonic()
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        queue_time = time.monotonic() - queued_at
+        with self._lock:
+            self._waiting -= 1
+            if not acquired:
+                self.rejected += 1
+        if not acquired:
+            raise PasswordHashingBusy()
+        
+        try:
+            started_at = time.monotonic()
+            result = self._get_executor().submit(func, *args).result()
+            run_time = time.monotonic() - started_at
+        finally:
+            self._slots.release()
+        
+        with self._lock:
+            self.completed += 1
+            self.queue_time_total += queue_time
+            self.queue_time_max = max(self.queue_time_max, queue_time)
+            self.run_time_total += run_time
+        return result
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with a different method than PASSWORD_HASH_METHOD."""
+        configured = self.method.split(':')
+        stored = password_hash.split('$', 1)[0].split(':')
+        # A partial spec such as "pbkdf2" or "pbkdf2:sha256" only pins the parts it names
+        return stored[:len(configured)] != configured
+
+    def stats(self):
+        with self._lock:
+            return {
+                'method': self.method,
+                'workers': self.workers,
+                'max_waiting': self.max_waiting,
+                'waiting': self._waiting,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'queue_time_avg_ms': round(self.queue_time_total / self.completed * 1000, 3) if self.completed else 0,
+                'queue_time_max_ms': round(self.queue_time_max * 1000, 3),
+                'run_time_avg_ms': round(self.run_time_total / self.completed * 1000, 3) if self.completed else 0
+            }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_WAITING, PASSWORD_HASH_QUEUE_TIMEOUT)
+
+class RateLimited(Exception):
+    """Raised when a caller has used up its token bucket; answered with a 429."""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+class ServerOverloaded(Exception):
+    """Raised to shed load when writes or the audit queue back up; answered with a 503."""
+
+    def __init__(self, reason, retry_after=1):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+def parse_rate_limits(spec):
+    """Parse "name=rate:burst,..." into {name: (rate, burst)}.
+
+    Names are user:<username>, role:<role> or login, so a user called 'admin'
+    or 'login' cannot pick up a role's or the login limit.
+    """
+    limits = {}
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        try:
+            name, value = entry.split('=', 1)
+            name = name.strip()
+            if name != 'login' and not (name.startswith(('user:', 'role:')) and len(name) > 5):
+                print(f"WARNING: Ignoring RATE_LIMITS entry '{entry}': name must be user:<username>, role:<role> or login.")
+                continue
+            rate, _, burst = value.partition(':')
+            rate = float(rate)
+            burst = float(burst) if burst else max(rate, 1.0)
+            if rate <= 0 or burst < 1:
+                raise ValueError(entry)
+        except ValueError:
+            print(f"WARNING: Ignoring invalid RATE_LIMITS entry '{entry}'.")
+            continue
+        limits[name] = (rate, burst)
+    return limits
+
+class RateLimiter:
+    """Token buckets per identity in memory shared by the gunicorn workers.
+
+    The buckets live in an anonymous shared mmap created at import, so workers
+    forked from a preloaded master draw from the same buckets (without preload
+    each worker has its own). The table is a fixed-size open-addressing hash;
+    when all probed slots are taken, the least recently used one is reused,
+    which at worst gives that identity a fresh burst.
+    """
+
+    _SLOT = struct.Struct('=Qdd')  # identity hash, tokens, last refill (time.monotonic)
+    _PROBES = 8
+
+    def __init__(self, limits, slots):
+        self.limits = limits
+        self.slots = max(self._PROBES, slots)
+        self._memory = mmap.mmap(-1, self._SLOT.size * self.slots)
+        self._lock = multiprocessing.Lock()
+
+    def limit_for(self, username, role):
+        return self.limits.get(f'user:{username}') or self.limits.get(f'role:{role}')
+
+    def acquire(self, identity, rate, burst):
+        """Take one token from identity's bucket. Returns 0, or the seconds until a token is available."""
+        key = int.from_bytes(hashlib.blake2b(identity.encode(), digest_size=8).digest(), 'little') or 1
+        start = key % self.slots
+        now = time.monotonic()
+        with self._lock:
+            found = None
+            reusable = None
+            oldest = None
+            for probe in range(self._PROBES):
+                offset = (start + probe) % self.slots * self._SLOT.size
+                slot_key, tokens, updated = self._SLOT.unpack_from(self._memory, offset)
+                if slot_key == key:
+                    found = (offset, min(burst, tokens + (now - updated) * rate))
+                    break
+                if slot_key == 0:
+                    if reusable is None:
+                        reusable = offset
+                elif oldest is None or updated < oldest[1]:
+                    oldest = (offset, updated)
+            if found is not None:
+                offset, tokens = found
+            else:
+                offset, tokens = (reusable if reusable is not None else oldest[0]), burst
+            
+            if tokens >= 1:
+                self._SLOT.pack_into(self._memory, offset, key, tokens - 1, now)
+                return 0
+            self._SLOT.pack_into(self._memory, offset, key, tokens, now)
+            return (1 - tokens) / rate
+
+class WriteAdmission:
+    """Bounds the DB-writing requests a worker runs at once.
+
+    SQLite runs one writer at a time, so extra concurrent writers only queue
+    on its lock while holding request threads. Callers wait up to
+    queue_timeout seconds for a slot and are then rejected with a 503.
+    """
+
+    def __init__(self, limit, queue_timeout):
+        self.limit = max(1, limit)
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self._waiting -= 1
+            if acquired:
+                self._running += 1
+                self.admitted += 1
+            else:
+                self.rejected += 1
+        if not acquired:
+            raise ServerOverloaded('write_concurrency')
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'queue_timeout_seconds': self.queue_timeout,
+                'running': self._running,
+                'waiting': self._waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected
+            }
+
+rate_limiter = RateLimiter(parse_rate_limits(RATE_LIMITS), RATE_LIMIT_SLOTS)
+write_admission = WriteAdmission(WRITE_CONCURRENCY, WRITE_QUEUE_TIMEOUT)
+
+def check_audit_backlog(pending=0):
+    """Shed load while the audit writer is behind. `pending` adds batches queued elsewhere."""
+    if AUDIT_LOG_MODE != 'sync' and audit_writer.pending() + pending > AUDIT_QUEUE_HIGH_WATER:
+        admission_rejections.inc('audit_backlog')
+        raise ServerOverloaded('audit_backlog')
+
+def check_rate_limit(identity, limit):
+    if not RATE_LIMIT_ENABLED or limit is None:
+        return
+    retry_after = rate_limiter.acquire(identity, *limit)
+    if retry_after:
+        admission_rejections.inc('rate_limit')
+        raise RateLimited(retry_after)
+
+def admit_request(user, pending=0):
+    """Admission checks for an authenticated request. Raises ServerOverloaded or RateLimited."""
+    check_audit_backlog(pending)
+    check_rate_limit(f"user:{user['user_id']}", rate_limiter.limit_for(user['username'], user['role']))
+
+def limit_writes(f):
+    """Decorator to run a DB-writing endpoint inside a write admission slot."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            with write_admission.slot():
+                return f(*args, **kwargs)
+        except ServerOverloaded as e:
+            if e.reason == 'write_concurrency':
+                admission_rejections.inc(e.reason)
+            raise
+    return decorated_function
+
 def generate_jwt_token(user_id, username, role):
     """Generate JWT token for user authentication."""
     payload = {
@@ -133,21 +1141,150 @@ def generate_jwt_token(user_id, username, role):
         'username': username,
         'role': role,
         'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRY_HOURS),
-        'iat': datetime.utcnow()
+        'iat': datetime.utcnow(),
+        'jti': secrets.token_hex(16)  # Unique per token, so revoking one never affects another
     }
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
+def token_digest(token):
+    """SHA-256 digest of a JWT, as stored in access_tokens.token_hash."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class TokenRevocationList:
+    """In-memory view of revoked tokens, backed by the access_tokens table.
+
+    A revoked token has an access_tokens row with is_active = 0. Revocations
+    made in this process apply immediately; those made by other workers are
+    picked up by the next sync.
+    """
+
+    def __init__(self, sync_interval):
+        self.sync_interval = sync_interval
+        self._revoked = {}  # token digest -> exp (unix time)
+        self._last_id = 0
+        self._next_sync = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def is_revoked(self, digest):
+        self._sync_if_due()
+        return digest in self._revoked
+
+    def revoke(self, digest, user_id, exp):
+        """Persist a revocation and apply it to this process right away."""
+        expires_at = datetime.utcfromtimestamp(exp).strftime('%Y-%m-%d %H:%M:%S')
+        conn = db_pool.acquire()
+        try:
+            # Expired revocations no longer matter: the signature check rejects those tokens
+            conn.execute('DELETE FROM access_tokens WHERE is_active = 0 AND expires_at < CURRENT_TIMESTAMP')
+            conn.execute('''
+                INSERT INTO access_tokens (token_hash, user_id, expires_at, is_active)
+                VALUES (?, ?, ?, 0)
+                ON CONFLICT (token_hash) DO UPDATE SET is_active = 0
+            ''', (digest, user_id, expires_at))
+            conn.commit()
+        finally:
+            db_pool.release(conn)
+        with self._lock:
+            self._revoked[digest] = exp
+
+    def _sync_if_due(self):
+        now = time.time()
+        if now < self._next_sync and self._pid == os.getpid():
+            return
+        with self._lock:
+            if now < self._next_sync and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._revoked = {}
+                self._last_id = 0
+            conn = db_pool.acquire()
+            try:
+                rows = conn.execute('''
+                    SELECT id, token_hash, CAST(strftime('%s', expires_at) AS INTEGER) AS exp
+                    FROM access_tokens
+                    WHERE id > ? AND is_active = 0
+                    ORDER BY id
+                ''', (self._last_id,)).fetchall()
+            finally:
+                db_pool.release(conn)
+            for row in rows:
+                self._revoked[row['token_hash']] = row['exp'] or 0
+                self._last_id = row['id']
+            # Forget revocations of tokens that have expired anyway
+            self._revoked = {digest: exp for digest, exp in self._revoked.items() if exp > now}
+            self._next_sync = now + self.sync_interval
+
+class VerifiedTokenCache:
+    """Bounded LRU cache of decoded JWT payloads, keyed by token digest, valid until exp."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            payload = self._entries.get(digest)
+            if payload is None:
+                return None
+            if payload['exp'] <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return dict(payload)
+
+    def put(self, digest, payload):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[digest] = dict(payload)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+token_revocations = TokenRevocationList(TOKEN_REVOCATION_SYNC_INTERVAL)
+verified_tokens = VerifiedTokenCache(JWT_CACHE_MAX_ENTRIES)
+
 def verify_jwt_token(token):
     """Verify and decode JWT token."""
+    digest = token_digest(token)
+    if token_revocations.is_revoked(digest):
+        print("Token revoked.")
+        verified_tokens.discard(digest)
+        return None
+    
+    payload = verified_tokens.get(digest)
+    if payload is not None:
+        return payload
+    
+    start = time.perf_counter()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        return payload
     except jwt.ExpiredSignatureError:
+        jwt_verify_duration.observe(time.perf_counter() - start, 'expired')
         print("Token expired.")
         return None
     except jwt.InvalidTokenError as e:
+        jwt_verify_duration.observe(time.perf_counter() - start, 'invalid')
         print(f"Invalid token: {e}")
         return None
+    jwt_verify_duration.observe(time.perf_counter() - start, 'decoded')
+    
+    if 'exp' in payload:
+        verified_tokens.put(digest, payload)
+    return payload
+
+def revoke_jwt_token(token, payload):
+    """Revoke a token until it expires."""
+    digest = token_digest(token)
+    token_revocations.revoke(digest, payload.get('user_id'), payload.get('exp', 0))
+    verified_tokens.discard(digest)
 
 def require_auth(f):
     """Decorator to require authentication for endpoints."""
@@ -158,11 +1295,14 @@ def require_auth(f):
             return jsonify({'error': 'Authentication required', 'details': 'No token provided'}), 401
         
         token = auth_header.split(' ')[1]
-        payload = verify_jwt_token(token)
+        with request_phase('auth'):
+            payload = verify_jwt_token(token)
         if not payload:
             return jsonify({'error': 'Invalid or expired token', 'details': 'Token verification failed'}), 401
         
         g.current_user = payload
+        g.auth_token = token
+        admit_request(payload)
         return f(*args, **kwargs)
     return decorated_function
 
@@ -175,18 +1315,24 @@ def require_admin(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def log_access(action, key_name=None, success=True, user_id=None, username=None):
-    """Log user access to the database."""
-    db = get_db()
-    
+ACCESS_LOG_INSERT = '''
+    INSERT INTO access_log (user_id, user_name, key_name, action, ip_address, user_agent, success)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Rows written by followers carry their own timestamp (see keystore_replication.import_inbox)
+ACCESS_LOG_IMPORT = '''
+    INSERT INTO access_log (timestamp, user_id, user_name, key_name, action, ip_address, user_agent, success)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def access_log_row(action, key_name=None, success=True, user_id=None, username=None):
+    """Build the access_log parameter tuple for the current request."""
     # Use g.current_user if available, otherwise use provided user_id/username
     effective_user_id = user_id if user_id is not None else g.get('current_user', {}).get('user_id')
     effective_username = username if username is not None else g.get('current_user', {}).get('username')
 
-    db.execute('''
-        INSERT INTO access_log (user_id, user_name, key_name, action, ip_address, user_agent, success)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (
+    return (
         effective_user_id,
         effective_username,
         key_name,
@@ -194,8 +1340,931 @@ def log_access(action, key_name=None, success=True, user_id=None, username=None)
         request.remote_addr,
         request.headers.get('User-Agent', ''),
         success
-    ))
-    db.commit()
+    )
+
+class AuditWriteFailed(Exception):
+    """Raised to a caller waiting on audit rows the writer could not commit; answered with a 503."""
+
+class AuditLogWriter:
+    """Background writer that commits queued access_log rows in batches.
+
+    Rows are collected from a bounded queue and inserted in one transaction
+    once AUDIT_BATCH_SIZE rows are pending or AUDIT_FLUSH_INTERVAL_MS has
+    passed, so many requests share a single commit. A failed commit is
+    retried `retries` times; after that the rows are dropped (and counted)
+    and waiting callers get AuditWriteFailed.
+    """
+
+    _STOP = object()
+
+    class _Waiter:
+        __slots__ = ('done', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.error = None
+
+    def __init__(self, max_queue, batch_size, flush_interval_ms, retries=0):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0, flush_interval_ms) / 1000.0
+        self.retries = max(0, retries)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Started lazily so a forked worker gets its own thread
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, rows, wait=False):
+        """Queue rows for writing. With wait=True, block until they are committed.
+
+        Raises AuditWriteFailed if wait=True and the rows had to be dropped.
+        """
+        self._ensure_started()
+        waiter = self._Waiter() if wait else None
+        # A full queue blocks the caller, which keeps memory bounded under overload
+        self.queue.put((rows, waiter))
+        if waiter is not None:
+            waiter.done.wait()
+            if waiter.error is not None:
+                raise AuditWriteFailed(str(waiter.error)) from waiter.error
+
+    def pending(self):
+        """Number of queued batches not yet picked up by the writer."""
+        return self.queue.qsize()
+
+    def flush(self):
+        """Block until everything queued so far has been committed."""
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.join()
+
+    def stop(self):
+        """Flush outstanding rows and stop the writer thread."""
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            return
+        self.queue.put((self._STOP, None))
+        self._thread.join()
+
+    def _collect_batch(self):
+        """Wait for queued rows and gather a batch. Returns (batch, stopping)."""
+        item = self.queue.get()
+        if item[0] is self._STOP:
+            return [], True
+        batch = [item]
+        row_count = len(item[0])
+        deadline = time.monotonic() + self.flush_interval
+        while row_count < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item[0] is self._STOP:
+                return batch, True
+            batch.append(item)
+            row_count += len(item[0])
+        return batch, False
+
+    def _run(self):
+        conn = open_db_connection()
+        try:
+            while True:
+                batch, stopping = self._collect_batch()
+                self._write_batch(conn, batch)
+                for _ in range(len(batch) + int(stopping)):
+                    self.queue.task_done()
+                if stopping:
+                    break
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn, batch):
+        if not batch:
+            return
+        rows = [row for item_rows, _ in batch for row in item_rows]
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Mostly lock contention: give the other writer a moment
+                time.sleep(0.05 * attempt)
+            start = time.perf_counter()
+            try:
+                conn.executemany(ACCESS_LOG_INSERT, rows)
+                conn.commit()
+                audit_batch_duration.observe(time.perf_counter() - start)
+                error = None
+                break
+            except Exception as e:
+                conn.rollback()
+                error = e
+                print(f"Error writing {len(batch)} audit log batches (attempt {attempt + 1}): {e}")
+        if error is not None:
+            audit_rows_dropped.inc(amount=len(rows))
+        for _, waiter in batch:
+            if waiter is not None:
+                waiter.error = error
+                waiter.done.set()
+
+audit_writer = AuditLogWriter(AUDIT_QUEUE_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL_MS, AUDIT_WRITE_RETRIES)
+atexit.register(audit_writer.stop)
+
+def append_follower_access_rows(rows):
+    """Hand access_log rows to the primary through the replication inbox (followers cannot write)."""
+    timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    keystore_replication.append_inbox(REPLICATION_DIR, [[timestamp, *row] for row in rows])
+
+def write_access_rows(rows):
+    """Persist access_log rows according to AUDIT_LOG_MODE."""
+    with request_phase('audit', audit_write_duration, 'inbox' if FOLLOWER else AUDIT_LOG_MODE):
+        if FOLLOWER:
+            append_follower_access_rows(rows)
+        elif AUDIT_LOG_MODE == 'sync':
+            db = get_db()
+            db.executemany(ACCESS_LOG_INSERT, rows)
+            db.commit()
+        else:
+            audit_writer.submit(rows, wait=AUDIT_LOG_MODE == 'group')
+
+metrics.before_collect.append(lambda: audit_queue_depth.set(audit_writer.pending()))
+
+def log_access(action, key_name=None, success=True, user_id=None, username=None):
+    """Log user access to the database."""
+    write_access_rows([access_log_row(action, key_name, success, user_id, username)])
+
+def log_access_many(entries):
+    """Log several (action, key_name, success) entries in a single transaction."""
+    write_access_rows([
+        access_log_row(action, key_name, success) for action, key_name, success in entries
+    ])
+
+class AuditRetention:
+    """Moves old access_log rows into compressed monthly archive files.
+
+    Each pass copies rows older than the cutoff, in batches, to
+    access_log-YYYY-MM.ndjson.gz (appended as new gzip members and fsynced),
+    deletes them from the live table in a short transaction, pauses, and
+    finally reclaims free pages with incremental vacuum. A file lock makes
+    sure only one worker process runs a pass at a time. Archiving is
+    at-least-once: rows archived just before a crash may appear twice.
+    """
+
+    def __init__(self, retention_days, archive_dir, interval, batch_size, batch_pause, vacuum_step):
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        self.vacuum_step = max(1, vacuum_step)
+        self._thread = None
+        self._pid = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self.last_run = None
+        self.last_archived = 0
+        self.total_archived = 0
+        self.last_error = None
+
+    @property
+    def enabled(self):
+        return self.retention_days > 0
+
+    def ensure_started(self):
+        if not self.enabled:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-retention', daemon=True)
+            self._thread.start()
+
+    def trigger(self):
+        """Run a pass as soon as possible instead of waiting for the interval."""
+        self.ensure_started()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Audit retention pass failed: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def archive_path(self, month):
+        return os.path.join(self.archive_dir, f'access_log-{month}.ndjson.gz')
+
+    def run_once(self):
+        """Archive everything older than the cutoff. Returns the number of rows moved."""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with open(os.path.join(self.archive_dir, '.retention.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # Another worker is running a pass
+            
+            cutoff = (datetime.utcnow() - timedelta(days=self.retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+            archived = 0
+            conn = open_db_connection()
+            try:
+                while True:
+                    rows = conn.execute(
+                        'SELECT * FROM access_log WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?',
+                        (cutoff, self.batch_size)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    self._append_to_archive(rows)
+                    ids = [row['id'] for row in rows]
+                    conn.execute(f"DELETE FROM access_log WHERE id IN ({', '.join('?' * len(ids))})", ids)
+                    conn.commit()
+                    archived += len(rows)
+                    # Leave room for request writers between batches
+                    time.sleep(self.batch_pause)
+                
+                if archived:
+                    self._incremental_vacuum(conn)
+            finally:
+                conn.close()
+            
+            self.last_run = datetime.utcnow().isoformat()
+            self.last_archived = archived
+            self.total_archived += archived
+            self.last_error = None
+            if archived:
+                print(f"Audit retention archived {archived} access log rows older than {cutoff}")
+            return archived
+
+    def _append_to_archive(self, rows):
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(str(row['timestamp'])[:7], []).append(dict(row))
+        for month, entries in by_month.items():
+            with open(self.archive_path(month), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+                    for entry in entries:
+                        archive.write((json.dumps(entry) + '\n').encode())
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def _incremental_vacuum(self, conn):
+        while conn.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+            # executescript steps the pragma to completion; execute() frees a single page
+            conn.executescript(f'PRAGMA incremental_vacuum({self.vacuum_step});')
+            time.sleep(self.batch_pause)
+
+    def archived_months(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        months = []
+        for name in sorted(os.listdir(self.archive_dir)):
+            if name.startswith('access_log-') and name.endswith('.ndjson.gz'):
+                months.append(name[len('access_log-'):-len('.ndjson.gz')])
+        return months
+
+    def iter_archived(self, start=None, end=None):
+        """Yield archived rows with start <= timestamp < end (either bound may be None)."""
+        for month in self.archived_months():
+            if (start and month < start[:7]) or (end and month > end[:7]):
+                continue
+            with gzip.open(self.archive_path(month), 'rt', encoding='utf-8') as archive:
+                for line in archive:
+                    entry = json.loads(line)
+                    if start and entry['timestamp'] < start:
+                        continue
+                    if end and entry['timestamp'] >= end:
+                        continue
+                    yield entry
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'retention_days': self.retention_days,
+            'archive_dir': self.archive_dir,
+            'archived_months': self.archived_months(),
+            'last_run': self.last_run,
+            'last_archived': self.last_archived,
+            'total_archived': self.total_archived,
+            'last_error': self.last_error
+        }
+
+audit_retention = AuditRetention(
+    AUDIT_RETENTION_DAYS, AUDIT_ARCHIVE_DIR, AUDIT_RETENTION_INTERVAL,
+    AUDIT_RETENTION_BATCH_SIZE, AUDIT_RETENTION_BATCH_PAUSE, AUDIT_VACUUM_STEP_PAGES
+)
+
+def encryption_key_fingerprint(key):
+    """Short, non-reversible identifier for an encryption key."""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+class KeyRotationJob:
+    """Re-encrypts api_keys values with the primary ENCRYPTION_KEY in the background.
+
+    Walks api_keys by id in small batches. Each batch is decrypted and
+    re-encrypted outside any transaction, then written together with the
+    checkpoint in one short write transaction, so live reads and writes are
+    only briefly delayed. Rows changed concurrently are left alone (they
+    were written with the primary key anyway). Progress lives in the
+    key_rotation table, so an interrupted job resumes where it stopped, and
+    a file lock keeps it to one worker process at a time.
+    """
+
+    def __init__(self, batch_size, batch_pause):
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        self.target_key = encryption_key_fingerprint(ENCRYPTION_KEY)
+        self.lock_path = os.path.join(os.path.dirname(DATABASE), '.key_rotation.lock')
+        self._thread = None
+        self._pid = None
+        self._checked_pid = None
+        self._lock = threading.Lock()
+
+    def running_here(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def start(self, restart=False):
+        """Start (or resume) re-encryption towards the current primary key.
+
+        Returns False if the job is already running in this process.
+        """
+        with self._lock:
+            if self.running_here():
+                return False
+            conn = open_db_connection()
+            try:
+                state = conn.execute('SELECT * FROM key_rotation WHERE id = 1').fetchone()
+                if restart or state is None or state['target_key'] != self.target_key or state['status'] != 'running':
+                    total = conn.execute('SELECT COUNT(*) FROM api_keys').fetchone()[0]
+                    conn.execute('''
+                        INSERT OR REPLACE INTO key_rotation
+                            (id, target_key, status, last_id, total, reencrypted, already_current, failed,
+                             last_error, started_at, updated_at, finished_at)
+                        VALUES (1, ?, 'running', 0, ?, 0, 0, 0, NULL, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, NULL)
+                    ''', (self.target_key, total))
+                    conn.commit()
+            finally:
+                conn.close()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='key-rotation', daemon=True)
+            self._thread.start()
+            return True
+
+    def resume_if_pending(self):
+        """Resume an interrupted job once per process (cheap after the first call)."""
+        if self._checked_pid == os.getpid():
+            return
+        self._checked_pid = os.getpid()
+        conn = open_db_connection()
+        try:
+            state = conn.execute('SELECT target_key, status FROM key_rotation WHERE id = 1').fetchone()
+        finally:
+            conn.close()
+        if state and state['status'] == 'running' and state['target_key'] == self.target_key:
+            self.start()
+
+    def _run(self):
+        with open(self.lock_path, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Another worker is already running the job
+            
+            conn = open_db_connection()
+            try:
+                while True:
+                    state = conn.execute('SELECT * FROM key_rotation WHERE id = 1').fetchone()
+                    if state is None or state['status'] != 'running' or state['target_key'] != self.target_key:
+                        return
+                    if not self._run_batch(conn, state['last_id']):
+                        conn.execute('''
+                            UPDATE key_rotation SET status = 'completed', finished_at = CURRENT_TIMESTAMP,
+                                updated_at = CURRENT_TIMESTAMP WHERE id = 1
+                        ''')
+                        conn.commit()
+                        print("Key rotation completed: all stored keys use the current ENCRYPTION_KEY")
+                        return
+                    time.sleep(self.batch_pause)
+            except Exception as e:
+                conn.rollback()
+                print(f"Key rotation failed: {e}")
+                conn.execute('''
+                    UPDATE key_rotation SET status = 'failed', last_error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = 1
+                ''', (str(e),))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _run_batch(self, conn, last_id):
+        """Re-encrypt the next batch after last_id. Returns False when there is nothing left."""
+        rows = conn.execute(
+            'SELECT id, key_name, encrypted_value FROM api_keys WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, self.batch_size)
+        ).fetchall()
+        if not rows:
+            return False
+        
+        updates = []
+        already_current = 0
+        failed = 0
+        last_error = None
+        for row in rows:
+            token = row['encrypted_value'].encode()
+            try:
+                primary_cipher.decrypt(token)
+                already_current += 1
+                continue
+            except InvalidToken:
+                pass
+            try:
+                updates.append((cipher.rotate(token).decode(), row['id'], row['encrypted_value']))
+            except InvalidToken:
+                failed += 1
+                last_error = f"Key '{row['key_name']}' cannot be decrypted with any configured ENCRYPTION_KEY"
+                print(f"Key rotation: {last_error}")
+        
+        conn.execute('BEGIN IMMEDIATE')
+        # Compare-and-set: a concurrent update already wrote a fresh value with the primary key
+        reencrypted = 0
+        for new_value, key_id, old_value in updates:
+            reencrypted += conn.execute(
+                'UPDATE api_keys SET encrypted_value = ? WHERE id = ? AND encrypted_value = ?',
+                (new_value, key_id, old_value)
+            ).rowcount
+        conn.execute('''
+            UPDATE key_rotation SET last_id = ?, reencrypted = reencrypted + ?, already_current = already_current + ?,
+                failed = failed + ?, last_error = COALESCE(?, last_error), updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1
+        ''', (rows[-1]['id'], reencrypted, already_current + len(updates) - reencrypted, failed, last_error))
+        conn.commit()
+        return True
+
+    def stats(self):
+        conn = open_db_connection()
+        try:
+            state = conn.execute('SELECT * FROM key_rotation WHERE id = 1').fetchone()
+        finally:
+            conn.close()
+        stats = {
+            'primary_key': self.target_key,
+            'previous_keys': [encryption_key_fingerprint(key) for key in ENCRYPTION_KEYS_PREVIOUS],
+            'running_in_this_worker': self.running_here(),
+            'job': dict(state) if state else None
+        }
+        if state and state['total']:
+            done = state['reencrypted'] + state['already_current'] + state['failed']
+            stats['job']['progress'] = round(min(done / state['total'], 1.0), 4)
+            stats['job']['stale'] = state['target_key'] != self.target_key
+        return stats
+
+key_rotation = KeyRotationJob(KEY_ROTATION_BATCH_SIZE, KEY_ROTATION_BATCH_PAUSE)
+
+class BackupRunner:
+    """Runs one hot backup at a time in a background thread of this worker."""
+
+    def __init__(self, database, backup_dir):
+        self.database = database
+        self.backup_dir = backup_dir
+        self._thread = None
+        self._lock = threading.Lock()
+        self.last_backup = None
+        self.last_error = None
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, incremental):
+        """Start a backup. Returns False if one is already running in this worker."""
+        with self._lock:
+            if self.running():
+                return False
+            self._thread = threading.Thread(target=self._run, args=(incremental,), name='backup', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, incremental):
+        try:
+            self.last_backup = keystore_backup.create_backup(self.database, self.backup_dir, incremental=incremental)
+            self.last_error = None
+            print(f"Backup {self.last_backup['id']} created ({self.last_backup['kind']}, {self.last_backup['file_size']} bytes)")
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Backup failed: {e}")
+
+backup_runner = BackupRunner(DATABASE, BACKUP_DIR)
+
+class ReplicationPublisher:
+    """Publishes DATABASE to REPLICATION_DIR for read-only followers.
+
+    One worker process at a time holds the publisher lock. Every interval it
+    imports the access_log rows followers left in the inbox, then publishes
+    the pages committed since the last publish, read from the WAL (see
+    keystore_replication.Publisher). The heartbeat is refreshed either way
+    so followers can tell how current their copy is.
+
+    Imported rows alone do not start a publish, or reads on followers would
+    republish every interval; they go out with the next change, or once
+    IMPORTED_ROWS_PER_PUBLISH of them are waiting.
+    """
+
+    IMPORTED_ROWS_PER_PUBLISH = 1000
+
+    def __init__(self, database, replication_dir, interval, full_every):
+        self.database = database
+        self.replication_dir = replication_dir
+        self.interval = interval
+        self.full_every = max(1, full_every)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.leader = False
+        self.published = 0
+        self.imported_rows = 0
+        self.unpublished_rows = 0
+        self.last_publish = None
+        self.last_error = None
+
+    @property
+    def enabled(self):
+        return REPLICATION_ENABLED and not FOLLOWER
+
+    def ensure_started(self):
+        if not self.enabled:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='replication-publisher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self.leader = False
+        os.makedirs(self.replication_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.replication_dir, '.publisher.lock'), 'w')
+        while not self.leader:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.leader = True
+            except BlockingIOError:
+                time.sleep(self.interval)
+
+        publisher = keystore_replication.Publisher(
+            self.database, self.replication_dir, self.full_every, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0)
+        while True:
+            try:
+                self.run_once(publisher)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Replication publish failed: {e}")
+            time.sleep(self.interval)
+
+    def run_once(self, publisher):
+        """Import follower audit rows, then publish what changed since the last run."""
+        # Taken first: everything committed before this moment is in what gets published
+        checked_at = datetime.utcnow().isoformat()
+        # Through the publisher's own connection, so the import does not count as a change
+        imported = keystore_replication.import_inbox(self.replication_dir, publisher.conn, ACCESS_LOG_IMPORT)
+        self.imported_rows += imported
+        self.unpublished_rows += imported
+        manifest = publisher.publish(checked_at, force=self.unpublished_rows >= self.IMPORTED_ROWS_PER_PUBLISH)
+        if manifest is not None:
+            self.published += 1
+            self.last_publish = manifest
+            self.unpublished_rows = 0
+        self.last_error = None
+
+    def stats(self):
+        heartbeat = keystore_replication.read_heartbeat(self.replication_dir) or {}
+        return {
+            'role': 'primary',
+            'enabled': self.enabled,
+            'replication_dir': self.replication_dir,
+            'interval_seconds': self.interval,
+            'publisher': self.leader,
+            'latest': heartbeat.get('latest'),
+            'checked_at': heartbeat.get('checked_at'),
+            'chain_length': heartbeat.get('chain_length'),
+            'published': self.published,
+            'imported_rows': self.imported_rows,
+            'unpublished_rows': self.unpublished_rows,
+            'last_publish': self.last_publish,
+            'last_error': self.last_error
+        }
+
+class ReplicaFollower:
+    """Keeps a follower's copy of the database current.
+
+    One worker process at a time (file lock next to DATABASE) installs new
+    snapshots from REPLICATION_DIR. Every worker re-reads the follower state
+    each poll interval and, once a new copy is in place, reopens its pooled
+    connections and wakes change-feed waiters.
+    """
+
+    def __init__(self, database, replication_dir, poll_interval):
+        self.database = database
+        self.replication_dir = replication_dir
+        self.poll_interval = poll_interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._lock_pid = None
+        self.installer = False
+        self.state = None
+        self.heartbeat = None
+        self.last_error = None
+
+    @property
+    def enabled(self):
+        return FOLLOWER
+
+    def ensure_started(self):
+        if not self.enabled:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='replica-follower', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.sync()
+            time.sleep(self.poll_interval)
+
+    def _try_lock(self):
+        if self._lock_pid != os.getpid():
+            # A descriptor inherited across fork() shares its lock with the parent: open our own
+            self._lock_pid = os.getpid()
+            self._lock_file = open(self.database + '.replica.lock', 'w')
+            self.installer = False
+        if not self.installer:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.installer = True
+            except BlockingIOError:
+                pass
+        return self.installer
+
+    def install_latest(self):
+        """Install the newest snapshot now, waiting for the follower lock (run before workers fork)."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.database)), exist_ok=True)
+        with open(self.database + '.replica.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            return keystore_replication.update_follower(self.replication_dir, self.database)
+
+    def sync(self):
+        """Install a new snapshot if this process is the installer, then switch to the current copy."""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.database)), exist_ok=True)
+            if self._try_lock():
+                keystore_replication.update_follower(self.replication_dir, self.database)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Replica update failed: {e}")
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the heartbeat and the follower state; reopen connections if the copy was replaced."""
+        try:
+            self.heartbeat = keystore_replication.read_heartbeat(self.replication_dir)
+            state = keystore_replication.read_follower_state(self.database)
+        except (OSError, ValueError) as e:
+            self.last_error = str(e)
+            return
+        if state and (self.state is None or state['applied'] != self.state['applied']):
+            self.state = state
+            db_pool.invalidate()
+            notify_key_change()
+
+    def ready(self):
+        if self.state is None:
+            self.refresh()
+        return self.state is not None
+
+    def lag(self):
+        """Seconds this copy may be behind the primary, or None before the first snapshot."""
+        return keystore_replication.replication_lag(self.heartbeat, self.state)
+
+    def stats(self):
+        state = self.state or {}
+        return {
+            'role': 'follower',
+            'replication_dir': self.replication_dir,
+            'primary_url': FOLLOWER_PRIMARY_URL or None,
+            'installer': self.installer,
+            'applied': state.get('applied'),
+            'installed_at': state.get('installed_at'),
+            'latest': (self.heartbeat or {}).get('latest'),
+            'lag_seconds': self.lag(),
+            'max_lag_seconds': FOLLOWER_MAX_LAG,
+            'last_error': self.last_error
+        }
+
+replication_publisher = ReplicationPublisher(DATABASE, REPLICATION_DIR, REPLICATION_INTERVAL, REPLICATION_FULL_EVERY)
+replica = ReplicaFollower(DATABASE, REPLICATION_DIR, REPLICATION_POLL_INTERVAL)
+
+def request_route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def format_request_phases(total):
+    """Phase timings of the current request as (name, milliseconds) pairs, ending with total."""
+    phases = g.get('request_phases', {})
+    timings = [(name, seconds * 1000) for name, seconds in phases.items()]
+    timings.append(('app', max(total - sum(phases.values()), 0.0) * 1000))
+    timings.append(('total', total * 1000))
+    return timings
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    if not METRICS_ENABLED:
+        return
+    metrics.ensure_started()
+    g.metrics_start = g.request_start
+    http_requests_in_flight.inc(request_route())
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    if SERVER_TIMING_ENABLED and 'request_start' in g:
+        timings = format_request_phases(time.perf_counter() - g.request_start)
+        response.headers['Server-Timing'] = ', '.join(f'{name};dur={ms:.2f}' for name, ms in timings)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if 'request_start' in g and SLOW_REQUEST_MS > 0:
+        elapsed = time.perf_counter() - g.request_start
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            phases = ' '.join(f'{name}={ms:.1f}ms' for name, ms in format_request_phases(elapsed))
+            print(f"Slow request: {request.method} {request.path} -> {g.get('metrics_status', 500)} {phases}")
+    if 'metrics_start' not in g:
+        return
+    route = request_route()
+    http_requests_in_flight.dec(route)
+    http_request_duration.observe(time.perf_counter() - g.metrics_start, request.method, route)
+    http_requests_total.inc(request.method, route, str(g.get('metrics_status', 500)))
+
+@app.before_request
+def start_background_jobs():
+    # Started lazily so each forked worker runs its own (lock-coordinated) thread
+    if FOLLOWER:
+        replica.ensure_started()
+        return
+    audit_retention.ensure_started()
+    key_rotation.resume_if_pending()
+    replication_publisher.ensure_started()
+
+# Non-GET routes a follower still serves itself because they only read
+FOLLOWER_READ_ENDPOINTS = {'batch_get_keys'}
+# Routes a follower serves before it has a copy of the database
+FOLLOWER_STARTUP_ENDPOINTS = {'health_check', 'prometheus_metrics', 'serve_frontend', 'serve_static'}
+# Not passed on when relaying a request to the primary
+FORWARD_SKIP_HEADERS = {'host', 'connection', 'keep-alive', 'transfer-encoding', 'te', 'upgrade',
+                        'proxy-authorization', 'content-length', 'accept-encoding'}
+FORWARD_RESPONSE_HEADERS = ('Retry-After', 'ETag', 'Location', 'Cache-Control', 'Content-Disposition')
+
+def forward_to_primary():
+    """Relay the current request to FOLLOWER_PRIMARY_URL and return the primary's response."""
+    url = FOLLOWER_PRIMARY_URL + urllib.parse.quote(request.path, safe='/:')
+    if request.query_string:
+        url += '?' + request.query_string.decode('latin-1')
+    headers = {name: value for name, value in request.headers.items() if name.lower() not in FORWARD_SKIP_HEADERS}
+    headers['X-Forwarded-For'] = ', '.join(filter(None, [request.headers.get('X-Forwarded-For'), request.remote_addr]))
+    forwarded = urllib.request.Request(url, data=request.get_data(), headers=headers, method=request.method)
+    g.forwarded_to_primary = True
+    try:
+        with request_phase('forward'):
+            try:
+                with urllib.request.urlopen(forwarded, timeout=FOLLOWER_FORWARD_TIMEOUT) as upstream:
+                    status, upstream_headers, body = upstream.status, upstream.headers, upstream.read()
+            except urllib.error.HTTPError as e:
+                status, upstream_headers, body = e.code, e.headers, e.read()
+    except (urllib.error.URLError, OSError) as e:
+        return jsonify({'error': 'Primary unavailable', 'details': f'Could not forward the request: {e}'}), 502
+
+    response = Response(body, status=status, content_type=upstream_headers.get('Content-Type'))
+    for name in FORWARD_RESPONSE_HEADERS:
+        if name in upstream_headers:
+            response.headers[name] = upstream_headers[name]
+    return response
+
+@app.before_request
+def route_follower_request():
+    """On a follower: serve reads from the local copy, forward (or refuse) everything else."""
+    if not FOLLOWER:
+        return None
+    if request.method in ('GET', 'HEAD', 'OPTIONS') or request.endpoint in FOLLOWER_READ_ENDPOINTS:
+        if request.endpoint in FOLLOWER_STARTUP_ENDPOINTS or replica.ready():
+            return None
+        return jsonify({'error': 'Replica not ready', 'details': 'No snapshot from the primary has been installed yet'}), 503
+    if FOLLOWER_PRIMARY_URL:
+        return forward_to_primary()
+    return jsonify({'error': 'Read-only follower', 'details': 'This instance only serves reads; send writes to the primary'}), 503
+
+@app.after_request
+def advertise_replication_lag(response):
+    if FOLLOWER and not g.get('forwarded_to_primary'):
+        lag = replica.lag()
+        if lag is not None:
+            response.headers['X-Replication-Lag'] = f'{lag:.3f}'
+    return response
+
+def key_etag(key):
+    """Strong ETag for a single api_keys row.
+
+    Built from the row's edit counter rather than the ciphertext or updated_at
+    (one-second resolution): every edit changes it, re-encrypting the key with
+    a new encryption key does not.
+    """
+    digest = hashlib.sha256(f"{key['id']}:{key['version']}".encode()).hexdigest()
+    return digest[:32]
+
+def key_list_etag(db):
+    """Strong ETag for the caller's GET /keys listing, read without touching api_keys rows."""
+    versions = dict(db.execute("SELECT name, version FROM table_versions WHERE name IN ('api_keys', 'users')").fetchall())
+    scope = 'all' if g.current_user['role'] == 'admin' else f"user-{g.current_user['user_id']}"
+    return f"keys-{versions.get('api_keys', 0)}.{versions.get('users', 0)}-{scope}"
+
+def not_modified(etag):
+    """Empty 304 response carrying the current ETag."""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+# Wakes change-feed waiters in this process as soon as a local write commits;
+# writes made by other workers are picked up on the next poll.
+key_change_condition = threading.Condition()
+
+# Extra callables run on every local key change (the asyncio serving mode registers one)
+key_change_listeners = []
+
+def notify_key_change():
+    with key_change_condition:
+        key_change_condition.notify_all()
+    for listener in key_change_listeners:
+        listener()
+
+def read_key_changes(since, limit=CHANGE_FEED_PAGE_SIZE):
+    """Return key changes after seq `since` visible to the current user.
+
+    Borrows a pooled connection only for the duration of the query so that
+    long-poll and streaming clients do not hold one while they wait.
+    """
+    query = 'SELECT seq, key_name, op, changed_at FROM key_changes WHERE seq > ?'
+    params = [since]
+    if g.current_user['role'] != 'admin':
+        query += ' AND owner_id = ?'
+        params.append(g.current_user['user_id'])
+    query += f' ORDER BY seq LIMIT {int(limit)}'
+    
+    conn = db_pool.acquire()
+    try:
+        rows = conn.execute(query, params).fetchall()
+    finally:
+        db_pool.release(conn)
+    return [{'seq': row['seq'], 'key_name': row['key_name'], 'op': row['op'], 'changed_at': row['changed_at']} for row in rows]
+
+def latest_key_change_seq():
+    conn = db_pool.acquire()
+    try:
+        row = conn.execute('SELECT MAX(seq) AS seq FROM key_changes').fetchone()
+    finally:
+        db_pool.release(conn)
+    return row['seq'] or 0
+
+def wait_for_key_changes(since, timeout):
+    """Block until changes after `since` are visible or `timeout` seconds pass."""
+    deadline = time.monotonic() + timeout
+    while True:
+        changes = read_key_changes(since)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        with key_change_condition:
+            key_change_condition.wait(min(CHANGE_FEED_POLL_INTERVAL, remaining))
 
 # Authentication endpoints
 @app.route('/auth/login', methods=['POST'])
@@ -208,17 +2277,32 @@ def login():
     username = data['username']
     password = data['password']
     
+    # Limit attempts per account and address: guessing from one address cannot
+    # lock the real user out from theirs
+    check_audit_backlog()
+    check_rate_limit(f"login:{request.remote_addr}:{username}", rate_limiter.limits.get('login'))
+    
     db = get_db()
     user = db.execute(
         'SELECT * FROM users WHERE username = ? AND is_active = 1',
         (username,)
     ).fetchone()
     
-    if not user or not check_password_hash(user['password_hash'], password):
+    if not user or not password_hasher.verify(user['password_hash'], password):
         # Log failed login attempt
         log_access('login_attempt', key_name=None, success=False, username=username, user_id=user['id'] if user else None)
         return jsonify({'error': 'Invalid credentials'}), 401
     
+    # Upgrade the stored hash if the configured work factor has changed
+    if password_hasher.needs_rehash(user['password_hash']):
+        try:
+            db.execute(
+                'UPDATE users SET password_hash = ? WHERE id = ?',
+                (password_hasher.hash(password), user['id'])
+            )
+        except PasswordHashingBusy:
+            print(f"Skipping password rehash for {user['username']}: hashing pool busy")
+    
     # Update last login
     db.execute(
         'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?',
@@ -241,47 +2325,159 @@ def login():
 @app.route('/auth/logout', methods=['POST'])
 @require_auth
 def logout():
-    """User logout endpoint."""
+    """User logout endpoint. Revokes the presented token."""
+    revoke_jwt_token(g.auth_token, g.current_user)
     log_access('logout')
     return jsonify({'message': 'Logged out successfully'})
 
+# Listing helpers shared by GET /keys and GET /users
+KEY_LIST_FIELDS = ('key_name', 'description', 'created_at', 'updated_at', 'created_by')
+USER_LIST_FIELDS = ('id', 'username', 'role', 'created_at', 'last_login', 'is_active')
+
+def parse_list_args(allowed_fields):
+    """Read ?fields=, ?sort=, ?limit= and ?cursor= of a list endpoint.
+
+    Returns (fields, sort, limit, cursor) where cursor is None or the decoded
+    position of the last row of the previous page. Raises ValueError.
+    """
+    fields = request.args.get('fields')
+    if fields:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in allowed_fields]
+        if unknown or not fields:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}. Choose from {', '.join(allowed_fields)}")
+    else:
+        fields = list(allowed_fields)
+    
+    sort = request.args.get('sort', 'created')
+    if sort not in ('created', 'name'):
+        raise ValueError("sort must be 'created' (newest first) or 'name'")
+    
+    limit = request.args.get('limit', type=int) or LIST_PAGE_SIZE
+    limit = max(1, min(limit, LIST_MAX_PAGE_SIZE))
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+        if not isinstance(cursor, list) or not cursor or cursor[0] != sort or len(cursor) != (3 if sort == 'created' else 2):
+            raise ValueError('Invalid cursor (it belongs to a different sort order)')
+        cursor = cursor[1:]
+    else:
+        cursor = None
+    return fields, sort, limit, cursor
+
+def encode_list_cursor(sort, row, name_column):
+    """Opaque cursor pointing just after row in the given sort order."""
+    position = [sort, row['created_at'], row['id']] if sort == 'created' else [sort, row[name_column]]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def prefix_range(prefix):
+    """Half-open range [low, high) of the strings starting with prefix.
+
+    SQLite's BINARY collation orders UTF-8 by code point, so the range is
+    served by the column's index, unlike LIKE 'prefix%'.
+    """
+    last = ord(prefix[-1])
+    if last >= sys.maxunicode:
+        return prefix, None
+    following = last + 1
+    if 0xD800 <= following <= 0xDFFF:
+        # Surrogates cannot be encoded (and never occur in stored names): skip the block
+        following = 0xE000
+    return prefix, prefix[:-1] + chr(following)
+
+def add_list_conditions(conditions, params, sort, cursor, prefix, name_column, alias):
+    """Append the prefix and cursor conditions and return the ORDER BY clause."""
+    if prefix:
+        low, high = prefix_range(prefix)
+        conditions.append(f"AND {alias}.{name_column} >= ?")
+        params.append(low)
+        if high is not None:
+            conditions.append(f"AND {alias}.{name_column} < ?")
+            params.append(high)
+    if sort == 'created':
+        if cursor is not None:
+            conditions.append(f"AND ({alias}.created_at, {alias}.id) < (?, ?)")
+            params.extend(cursor)
+        return f"ORDER BY {alias}.created_at DESC, {alias}.id DESC"
+    if cursor is not None:
+        conditions.append(f"AND {alias}.{name_column} > ?")
+        params.append(cursor[0])
+    return f"ORDER BY {alias}.{name_column}"
+
 # API Key management endpoints
 @app.route('/keys', methods=['GET'])
 @require_auth
 def get_keys():
-    """Get all API keys (users see only their keys, admins see all)."""
+    """List API keys a page at a time (users see only their keys, admins see all).
+
+    ?prefix= filters on the key name, ?owner= (admins only) on the owning
+    user name. ?sort=created (newest first, the default) or ?sort=name,
+    ?fields= selects the returned fields and ?limit= the page size. Pass the
+    returned next_cursor as ?cursor= to fetch the next page.
+    """
     db = get_db()
     
-    if g.current_user['role'] == 'admin':
-        # Admins can see all keys
-        keys = db.execute('''
-            SELECT k.*, u.username as created_by_username
-            FROM api_keys k
-            LEFT JOIN users u ON k.owner_id = u.id
-            ORDER BY k.created_at DESC
-        ''').fetchall()
-    else:
-        # Regular users see only their keys
-        keys = db.execute('''
-            SELECT k.*, u.username as created_by_username
-            FROM api_keys k
-            LEFT JOIN users u ON k.owner_id = u.id
-            WHERE k.owner_id = ?
-            ORDER BY k.created_at DESC
-        ''', (g.current_user['user_id'],)).fetchall()
+    etag = key_list_etag(db)
+    if request.if_none_match.contains_weak(etag):
+        log_access('list_keys')
+        return not_modified(etag)
     
+    try:
+        fields, sort, limit, cursor = parse_list_args(KEY_LIST_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': 'Invalid list parameters', 'details': str(e)}), 400
+    
+    conditions = []
+    params = []
+    owner_filter = request.args.get('owner')
+    if g.current_user['role'] != 'admin':
+        # Regular users see only their keys
+        conditions.append("AND k.owner_id = ?")
+        params.append(g.current_user['user_id'])
+    elif owner_filter:
+        owner = db.execute('SELECT id FROM users WHERE username = ?', (owner_filter,)).fetchone()
+        conditions.append("AND k.owner_id = ?")
+        params.append(owner['id'] if owner else None)
+    order_by = add_list_conditions(conditions, params, sort, cursor, request.args.get('prefix'), 'key_name', 'k')
+    
+    # Only read the columns that will be returned; the users join is only needed for created_by
+    columns = ['k.id', 'k.key_name', 'k.created_at'] + [f'k.{field}' for field in fields if field in ('description', 'updated_at')]
+    join = ''
+    if 'created_by' in fields:
+        columns += ['k.created_by', 'u.username AS created_by_username']
+        join = 'LEFT JOIN users u ON k.owner_id = u.id'
+    keys = db.execute(f'''
+        SELECT {', '.join(columns)}
+        FROM api_keys k
+        {join}
+        WHERE 1=1 {' '.join(conditions)}
+        {order_by}
+        LIMIT {limit + 1}
+    ''', params).fetchall()
+    
+    next_cursor = encode_list_cursor(sort, keys[limit - 1], 'key_name') if len(keys) > limit else None
     keys_list = []
-    for key in keys:
-        keys_list.append({
+    for key in keys[:limit]:
+        values = {
             'key_name': key['key_name'],
-            'description': key['description'],
-            'created_at': key['created_at'],
-            'updated_at': key['updated_at'],
-            'created_by': key['created_by_username'] or key['created_by']
-        })
+            'created_at': key['created_at']
+        }
+        if 'description' in fields:
+            values['description'] = key['description']
+        if 'updated_at' in fields:
+            values['updated_at'] = key['updated_at']
+        if 'created_by' in fields:
+            values['created_by'] = key['created_by_username'] or key['created_by']
+        keys_list.append({field: values[field] for field in fields})
     
     log_access('list_keys')
-    return jsonify({'keys': keys_list})
+    response = jsonify({'keys': keys_list, 'next_cursor': next_cursor})
+    response.set_etag(etag)
+    return response
 
 @app.route('/keys/<key_name>', methods=['GET'])
 @require_auth
@@ -305,25 +2501,337 @@ def get_key(key_name):
         log_access('view_key', key_name, success=False)
         return jsonify({'error': 'Key not found'}), 404
     
+    # The caller already holds this version: skip decryption entirely
+    etag = key_etag(key)
+    if request.if_none_match.contains_weak(etag):
+        log_access('view_key', key_name)
+        return not_modified(etag)
+    
     # Decrypt the API key
     try:
-        decrypted_key = cipher.decrypt(key['encrypted_value'].encode()).decode()
+        decrypted_key = decrypt_api_key(key)
     except Exception as e:
         log_access('view_key', key_name, success=False)
         print(f"Decryption error for key {key_name}: {e}") # Log internal error
         return jsonify({'error': 'Failed to decrypt key', 'details': str(e)}), 500
     
     log_access('view_key', key_name)
-    return jsonify({
+    response = jsonify({
         'key_name': key['key_name'],
         'api_key': decrypted_key,
         'description': key['description'],
         'created_at': key['created_at'],
         'updated_at': key['updated_at']
     })
+    response.set_etag(etag)
+    return response
+
+@app.route('/keys:batch_get', methods=['POST'])
+@require_auth
+def batch_get_keys():
+    """Get several API keys with their values in a single request."""
+    data = request.get_json(silent=True)
+    key_names = data.get('key_names') if isinstance(data, dict) else None
+    
+    if not isinstance(key_names, list) or not key_names:
+        return jsonify({'error': 'key_names must be a non-empty list'}), 400
+    if not all(isinstance(name, str) and name for name in key_names):
+        return jsonify({'error': 'key_names must contain only non-empty strings'}), 400
+    
+    # Drop duplicates while keeping the order the caller asked for
+    key_names = list(dict.fromkeys(key_names))
+    if len(key_names) > BATCH_GET_MAX_KEYS:
+        return jsonify({'error': f'At most {BATCH_GET_MAX_KEYS} keys can be requested at once'}), 400
+    
+    db = get_db()
+    placeholders = ', '.join('?' * len(key_names))
+    query = f'SELECT * FROM api_keys WHERE key_name IN ({placeholders})'
+    params = list(key_names)
+    # Regular users only see keys they own: like GET /keys/<name>, another user's
+    # key is reported as missing so key names cannot be probed
+    if g.current_user['role'] != 'admin':
+        query += ' AND owner_id = ?'
+        params.append(g.current_user['user_id'])
+    rows_by_name = {row['key_name']: row for row in db.execute(query, params).fetchall()}
+    
+    results = []
+    log_entries = []
+    for key_name in key_names:
+        key = rows_by_name.get(key_name)
+        if key is None:
+            results.append({'key_name': key_name, 'status': 'missing'})
+            log_entries.append(('view_key', key_name, False))
+            continue
+        
+        try:
+            decrypted_key = decrypt_api_key(key)
+        except Exception as e:
+            print(f"Decryption error for key {key_name}: {e}") # Log internal error
+            results.append({'key_name': key_name, 'status': 'error', 'error': 'Failed to decrypt key'})
+            log_entries.append(('view_key', key_name, False))
+            continue
+        
+        results.append({
+            'key_name': key['key_name'],
+            'status': 'found',
+            'api_key': decrypted_key,
+            'description': key['description'],
+            'created_at': key['created_at'],
+            'updated_at': key['updated_at']
+        })
+        log_entries.append(('view_key', key_name, True))
+    
+    log_access_many(log_entries)
+    
+    summary = {'found': 0, 'missing': 0, 'error': 0}
+    for result in results:
+        summary[result['status']] += 1
+    return jsonify({'keys': results, 'summary': summary})
+
+KEY_BUNDLE_TYPE = 'keystore-bundle'
+KEY_IMPORT_POLICIES = ('skip', 'overwrite', 'fail')
+
+def parse_key_import_line(line):
+    """Parse one NDJSON import line into (key_name, encrypted_value, description).
+
+    A line carries either a plaintext 'api_key' or, when it comes from a
+    GET /keys:export bundle, the stored 'encrypted_value'. Returns None for
+    blank lines and the bundle header; raises ValueError for invalid rows.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    entry = json.loads(line)
+    if not isinstance(entry, dict):
+        raise ValueError('Each line must be a JSON object')
+    if entry.get('type') == KEY_BUNDLE_TYPE:
+        return None
+    
+    key_name = entry.get('key_name')
+    if not isinstance(key_name, str) or not key_name.strip():
+        raise ValueError('key_name is required')
+    description = entry.get('description') or ''
+    if not isinstance(description, str):
+        raise ValueError('description must be a string')
+    
+    if isinstance(entry.get('encrypted_value'), str):
+        # Bundles keep the stored ciphertext; make sure this service can read it
+        cipher.decrypt(entry['encrypted_value'].encode())
+        encrypted_value = entry['encrypted_value']
+    elif isinstance(entry.get('api_key'), str) and entry['api_key']:
+        encrypted_value = cipher.encrypt(entry['api_key'].encode()).decode()
+    else:
+        raise ValueError('api_key or encrypted_value is required')
+    return key_name.strip(), encrypted_value, description.strip()
+
+@app.route('/keys:import', methods=['POST'])
+@require_auth
+@limit_writes
+def import_keys():
+    """Import many API keys from an NDJSON body in a single transaction.
+
+    ?on_conflict= decides what happens to keys that already exist: 'skip'
+    (default) leaves them alone, 'overwrite' replaces value and description,
+    'fail' writes nothing if any row conflicts or is invalid. Regular users
+    may only overwrite keys they own. Returns a per-row report.
+    """
+    on_conflict = request.args.get('on_conflict', 'skip')
+    if on_conflict not in KEY_IMPORT_POLICIES:
+        return jsonify({'error': 'Invalid on_conflict policy', 'details': 'on_conflict must be skip, overwrite or fail'}), 400
+    
+    # Parse and encrypt while streaming the body, before taking the write lock
+    results = []
+    rows = []
+    for line_number, line in enumerate(request.stream, start=1):
+        try:
+            row = parse_key_import_line(line.decode('utf-8'))
+        except Exception as e:
+            results.append({'line': line_number, 'status': 'invalid', 'error': str(e)})
+            continue
+        if row is None:
+            continue
+        if len(rows) >= KEY_IMPORT_MAX_ROWS:
+            return jsonify({'error': f'At most {KEY_IMPORT_MAX_ROWS} keys can be imported at once'}), 413
+        rows.append((line_number, row))
+    
+    if not rows and not results:
+        return jsonify({'error': 'No keys provided', 'details': 'Send one JSON object per line'}), 400
+    
+    db = get_db()
+    is_admin = g.current_user['role'] == 'admin'
+    inserts = []
+    updates = []
+    # Take the write lock up front so existing keys cannot change between the check and the write
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        existing = {}
+        names = list(dict.fromkeys(row[0] for _, row in rows))
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            for key in db.execute(
+                f"SELECT key_name, owner_id FROM api_keys WHERE key_name IN ({', '.join('?' * len(chunk))})", chunk
+            ):
+                existing[key['key_name']] = key['owner_id']
+        
+        seen = set()
+        for line_number, (key_name, encrypted_value, description) in rows:
+            if key_name in seen:
+                results.append({'line': line_number, 'key_name': key_name, 'status': 'invalid', 'error': 'Duplicate key_name in import'})
+                continue
+            seen.add(key_name)
+            
+            if key_name not in existing:
+                inserts.append((key_name, encrypted_value, description, g.current_user['username'], g.current_user['user_id']))
+                status = 'created'
+            elif on_conflict == 'skip':
+                status = 'skipped'
+            elif on_conflict == 'fail':
+                status = 'conflict'
+            elif not is_admin and existing[key_name] != g.current_user['user_id']:
+                status = 'denied'
+            else:
+                updates.append((encrypted_value, description, key_name))
+                status = 'overwritten'
+            results.append({'line': line_number, 'key_name': key_name, 'status': status})
+        
+        failed = any(result['status'] in ('invalid', 'conflict') for result in results)
+        if on_conflict == 'fail' and failed:
+            db.rollback()
+        else:
+            db.executemany('''
+                INSERT INTO api_keys (key_name, encrypted_value, description, created_by, owner_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', inserts)
+            db.executemany('''
+                UPDATE api_keys SET encrypted_value = ?, description = ?, updated_at = CURRENT_TIMESTAMP,
+                    version = version + 1
+                WHERE key_name = ?
+            ''', updates)
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    
+    results.sort(key=lambda result: result['line'])
+    if on_conflict == 'fail' and failed:
+        for result in results:
+            if result['status'] in ('created', 'overwritten'):
+                result['status'] = 'aborted'
+    summary = {'created': 0, 'overwritten': 0, 'skipped': 0, 'conflict': 0, 'denied': 0, 'invalid': 0, 'aborted': 0}
+    for result in results:
+        summary[result['status']] += 1
+    
+    if on_conflict == 'fail' and failed:
+        log_access('import_keys', success=False)
+        return jsonify({'error': 'Import aborted, no keys were written', 'summary': summary, 'results': results}), 409
+    
+    if updates:
+        key_cache.invalidate(*[name for _, _, name in updates])
+    if inserts or updates:
+        notify_key_change()
+    log_access_many(
+        [('import_key', result['key_name'], result['status'] in ('created', 'overwritten'))
+         for result in results if 'key_name' in result]
+    )
+    return jsonify({'summary': summary, 'results': results})
+
+@app.route('/keys:export', methods=['GET'])
+@require_auth
+def export_keys():
+    """Stream the caller's keys (all keys for admins) as an encrypted NDJSON bundle.
+
+    Values stay encrypted with the service's ENCRYPTION_KEY, exactly as
+    stored, so the bundle can be re-imported through POST /keys:import into
+    any keystore that shares the key.
+    """
+    owner_id = None if g.current_user['role'] == 'admin' else g.current_user['user_id']
+    header = {
+        'type': KEY_BUNDLE_TYPE,
+        'version': 1,
+        'exported_at': datetime.utcnow().isoformat(),
+        'exported_by': g.current_user['username']
+    }
+    
+    log_access('export_keys')
+    
+    def generate():
+        yield json.dumps(header) + '\n'
+        last_id = 0
+        while True:
+            query = 'SELECT id, key_name, encrypted_value, description, created_by, created_at, updated_at FROM api_keys WHERE id > ?'
+            params = [last_id]
+            if owner_id is not None:
+                query += ' AND owner_id = ?'
+                params.append(owner_id)
+            query += f' ORDER BY id LIMIT {int(KEY_EXPORT_CHUNK_SIZE)}'
+            
+            # Borrow a connection per chunk, like the log export
+            conn = db_pool.acquire()
+            try:
+                keys = conn.execute(query, params).fetchall()
+            finally:
+                db_pool.release(conn)
+            
+            if not keys:
+                return
+            yield ''.join(json.dumps({column: key[column] for column in key.keys() if column != 'id'}) + '\n' for key in keys)
+            last_id = keys[-1]['id']
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=keystore-bundle.ndjson'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable nginx response buffering
+    return response
+
+@app.route('/keys:changes', methods=['GET'])
+@require_auth
+def get_key_changes():
+    """Long-poll for key changes after ?since=<seq>, waiting up to ?wait= seconds."""
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = latest_key_change_seq()
+    wait = request.args.get('wait', default=CHANGE_FEED_MAX_WAIT, type=int)
+    wait = max(0, min(wait, CHANGE_FEED_MAX_WAIT))
+    
+    changes = wait_for_key_changes(since, wait)
+    last_seq = changes[-1]['seq'] if changes else since
+    
+    log_access('key_changes')
+    return jsonify({'changes': changes, 'last_seq': last_seq})
+
+@app.route('/keys:watch', methods=['GET'])
+@require_auth
+def watch_key_changes():
+    """Stream key changes as Server-Sent Events, resuming after ?since= or Last-Event-ID."""
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = latest_key_change_seq()
+    
+    log_access('watch_keys')
+    
+    @stream_with_context
+    def generate(since):
+        # Clients reconnect with Last-Event-ID once the stream ends
+        stream_deadline = time.monotonic() + CHANGE_FEED_STREAM_MAX_SECONDS
+        yield f"retry: {int(CHANGE_FEED_POLL_INTERVAL * 1000)}\n\n"
+        while time.monotonic() < stream_deadline:
+            changes = wait_for_key_changes(since, min(CHANGE_FEED_HEARTBEAT, stream_deadline - time.monotonic()))
+            if not changes:
+                yield ": heartbeat\n\n"
+                continue
+            for change in changes:
+                yield f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+            since = changes[-1]['seq']
+    
+    response = Response(generate(since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable nginx response buffering
+    return response
 
 @app.route('/keys', methods=['POST'])
 @require_auth
+@limit_writes
 def add_key():
     """Add a new API key."""
     data = request.get_json()
@@ -357,6 +2865,7 @@ def add_key():
             VALUES (?, ?, ?, ?, ?)
         ''', (key_name, encrypted_key, description, g.current_user['username'], g.current_user['user_id']))
         db.commit()
+        notify_key_change()
         
         log_access('add_key', key_name)
         return jsonify({'message': 'API key added successfully'}), 201
@@ -367,6 +2876,7 @@ def add_key():
 
 @app.route('/keys/<key_name>', methods=['PUT'])
 @require_auth
+@limit_writes
 def update_key(key_name):
     """Update an existing API key."""
     data = request.get_json()
@@ -415,17 +2925,21 @@ def update_key(key_name):
         return jsonify({'message': 'No fields provided for update'}), 200 # No actual change
 
     update_fields.append('updated_at = CURRENT_TIMESTAMP')
+    update_fields.append('version = version + 1')
     params.append(key_name)
     
     query = f"UPDATE api_keys SET {', '.join(update_fields)} WHERE key_name = ?"
     db.execute(query, params)
     db.commit()
+    key_cache.invalidate(key_name)
+    notify_key_change()
     
     log_access('update_key', key_name)
     return jsonify({'message': 'API key updated successfully'})
 
 @app.route('/keys/<key_name>', methods=['DELETE'])
 @require_auth
+@limit_writes
 def delete_key(key_name):
     """Delete an API key."""
     db = get_db()
@@ -448,6 +2962,8 @@ def delete_key(key_name):
     
     db.execute('DELETE FROM api_keys WHERE key_name = ?', (key_name,))
     db.commit()
+    key_cache.invalidate(key_name)
+    notify_key_change()
     
     log_access('delete_key', key_name)
     return jsonify({'message': 'API key deleted successfully'})
@@ -456,32 +2972,64 @@ def delete_key(key_name):
 @app.route('/logs', methods=['GET'])
 @require_auth
 def get_logs():
-    """Get access logs with optional filtering."""
+    """Get access logs, newest first, with optional filtering and cursor pagination.
+
+    Pass the returned next_before value as ?before= to fetch the next page.
+    """
     db = get_db()
+    is_admin = g.current_user['role'] == 'admin'
     
+    search_filter = request.args.get('q', '').strip()
     user_name_filter = request.args.get('user_name')
     action_filter = request.args.get('action')
+    action_exact_filter = request.args.get('action_exact')
     ip_address_filter = request.args.get('ip_address')
+    user_id_filter = request.args.get('user_id', type=int)
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', type=int) or (LOGS_PAGE_SIZE_ADMIN if is_admin else LOGS_PAGE_SIZE_USER)
+    limit = max(1, min(limit, LOGS_MAX_PAGE_SIZE))
 
     query_parts = ["SELECT * FROM access_log WHERE 1=1"]
     params = []
 
-    if g.current_user['role'] != 'admin':
+    if not is_admin:
         query_parts.append("AND user_id = ?")
         params.append(g.current_user['user_id'])
+    elif user_id_filter is not None:
+        query_parts.append("AND user_id = ?")
+        params.append(user_id_filter)
     
     if user_name_filter:
         query_parts.append("AND user_name LIKE ?")
         params.append(f"%{user_name_filter}%")
+    if action_exact_filter:
+        # Exact match can be served by idx_access_log_action_timestamp
+        query_parts.append("AND action = ?")
+        params.append(action_exact_filter)
     if action_filter:
         query_parts.append("AND action LIKE ?")
         params.append(f"%{action_filter}%")
     if ip_address_filter:
         query_parts.append("AND ip_address LIKE ?")
         params.append(f"%{ip_address_filter}%")
+    if search_filter:
+        # The trigram tokenizer needs at least 3 characters to match anything
+        if len(search_filter) >= 3 and access_log_fts_available(db):
+            query_parts.append("AND id IN (SELECT rowid FROM access_log_fts WHERE access_log_fts MATCH ?)")
+            params.append('"' + search_filter.replace('"', '""') + '"')
+        else:
+            query_parts.append("AND (user_name LIKE ? OR key_name LIKE ? OR action LIKE ? OR ip_address LIKE ?)")
+            params.extend([f"%{search_filter}%"] * 4)
 
-    query_parts.append("ORDER BY timestamp DESC")
-    limit = 100 if g.current_user['role'] == 'admin' else 50
+    if before is not None:
+        # Keyset pagination: continue strictly after the (timestamp, id) of the cursor row
+        cursor_row = db.execute('SELECT timestamp FROM access_log WHERE id = ?', (before,)).fetchone()
+        if not cursor_row:
+            return jsonify({'error': 'Invalid cursor', 'details': f'No log entry with id {before}'}), 400
+        query_parts.append("AND (timestamp, id) < (?, ?)")
+        params.extend([cursor_row['timestamp'], before])
+
+    query_parts.append("ORDER BY timestamp DESC, id DESC")
     query_parts.append(f"LIMIT {limit}") # Use f-string for limit as it's an int
 
     query = " ".join(query_parts)
@@ -490,6 +3038,7 @@ def get_logs():
     logs_list = []
     for log in logs:
         logs_list.append({
+            'id': log['id'],
             'timestamp': log['timestamp'],
             'user_name': log['user_name'],
             'key_name': log['key_name'],
@@ -498,39 +3047,234 @@ def get_logs():
             'success': bool(log['success'])
         })
     
+    next_before = logs_list[-1]['id'] if len(logs_list) == limit else None
+    
     log_access('list_logs') # Log the action of viewing logs
-    return jsonify({'logs': logs_list})
+    return jsonify({'logs': logs_list, 'next_before': next_before})
+
+LOG_EXPORT_COLUMNS = ['id', 'timestamp', 'user_id', 'user_name', 'key_name', 'action', 'ip_address', 'user_agent', 'success']
+
+def iter_log_export_chunks(conditions, params, chunk_size=LOGS_EXPORT_CHUNK_SIZE):
+    """Yield access_log rows matching conditions, oldest first, one chunk at a time.
+
+    Each chunk is a separate keyset query on a briefly borrowed pooled
+    connection, so a long export neither holds a connection nor keeps a read
+    transaction open (which would stop WAL checkpoints) between chunks.
+    """
+    base_query = f"SELECT {', '.join(LOG_EXPORT_COLUMNS)} FROM access_log WHERE 1=1 {' '.join(conditions)}"
+    last = None
+    while True:
+        query = base_query
+        chunk_params = list(params)
+        if last is not None:
+            query += " AND (timestamp, id) > (?, ?)"
+            chunk_params.extend(last)
+        query += f" ORDER BY timestamp, id LIMIT {int(chunk_size)}"
+        
+        conn = db_pool.acquire()
+        try:
+            rows = conn.execute(query, chunk_params).fetchall()
+        finally:
+            db_pool.release(conn)
+        
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = (rows[-1]['timestamp'], rows[-1]['id'])
+
+@app.route('/logs/export', methods=['GET'])
+@require_auth
+def export_logs():
+    """Stream access logs as NDJSON or CSV.
+
+    ?format=ndjson|csv (default ndjson), ?from= and ?to= limit the time range
+    (from inclusive, to exclusive). Users export their own logs; admins may
+    export everything or filter with ?user_id=.
+    """
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Invalid format', 'details': 'format must be ndjson or csv'}), 400
+    
+    conditions = []
+    params = []
+    if g.current_user['role'] != 'admin':
+        conditions.append("AND user_id = ?")
+        params.append(g.current_user['user_id'])
+    elif request.args.get('user_id', type=int) is not None:
+        conditions.append("AND user_id = ?")
+        params.append(request.args.get('user_id', type=int))
+    if request.args.get('from'):
+        conditions.append("AND timestamp >= ?")
+        params.append(request.args['from'])
+    if request.args.get('to'):
+        conditions.append("AND timestamp < ?")
+        params.append(request.args['to'])
+    if request.args.get('action_exact'):
+        conditions.append("AND action = ?")
+        params.append(request.args['action_exact'])
+    
+    log_access('export_logs')
+    
+    def generate():
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(LOG_EXPORT_COLUMNS)
+            yield buffer.getvalue()
+        for rows in iter_log_export_chunks(conditions, params):
+            if export_format == 'csv':
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(tuple(row) for row in rows)
+                yield buffer.getvalue()
+            else:
+                yield ''.join(json.dumps(dict(row)) + '\n' for row in rows)
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=access_log.{export_format}'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable nginx response buffering
+    return response
+
+# Length of the 'YYYY-MM-DD HH:00:00' bucket prefix that identifies each period
+LOG_STATS_BUCKETS = {'hour': 19, 'day': 10, 'month': 7}
+LOG_STATS_DIMENSIONS = ('all', 'user', 'action', 'key')
+
+@app.route('/logs/stats', methods=['GET'])
+@require_auth
+@require_admin
+def get_log_stats():
+    """Access counts and failure rates from the hourly rollups (admin only).
+
+    ?dimension=all|user|action|key, ?bucket=hour|day|month|total,
+    ?from= / ?to= (hour granularity, to exclusive), ?value= (one user, action
+    or key), ?limit=.
+    """
+    dimension = request.args.get('dimension', 'all')
+    bucket = request.args.get('bucket', 'day')
+    if dimension not in LOG_STATS_DIMENSIONS:
+        return jsonify({'error': 'Invalid dimension', 'details': f"dimension must be one of {', '.join(LOG_STATS_DIMENSIONS)}"}), 400
+    if bucket not in LOG_STATS_BUCKETS and bucket != 'total':
+        return jsonify({'error': 'Invalid bucket', 'details': 'bucket must be hour, day, month or total'}), 400
+    limit = request.args.get('limit', default=LOGS_STATS_MAX_ROWS, type=int)
+    limit = max(1, min(limit, LOGS_STATS_MAX_ROWS))
+    
+    period = f"substr(bucket, 1, {LOG_STATS_BUCKETS[bucket]})" if bucket != 'total' else 'NULL'
+    query_parts = [f"SELECT {period} AS period, value, SUM(total) AS total, SUM(failures) AS failures",
+                   "FROM access_log_rollup WHERE dimension = ?"]
+    params = [dimension]
+    if request.args.get('from'):
+        query_parts.append("AND bucket >= ?")
+        params.append(request.args['from'])
+    if request.args.get('to'):
+        query_parts.append("AND bucket < ?")
+        params.append(request.args['to'])
+    if request.args.get('value') is not None:
+        query_parts.append("AND value = ?")
+        params.append(request.args['value'])
+    query_parts.append("GROUP BY period, value ORDER BY period, total DESC")
+    query_parts.append(f"LIMIT {limit}")
+    
+    rows = get_db().execute(" ".join(query_parts), params).fetchall()
+    stats = []
+    for row in rows:
+        entry = {
+            'period': row['period'],
+            'total': row['total'],
+            'failures': row['failures'],
+            'failure_rate': round(row['failures'] / row['total'], 4) if row['total'] else 0.0
+        }
+        if dimension != 'all':
+            entry[dimension] = row['value']
+        stats.append(entry)
+    
+    log_access('view_log_stats')
+    return jsonify({'dimension': dimension, 'bucket': bucket, 'stats': stats})
+
+@app.route('/logs/archive', methods=['GET'])
+@require_auth
+@require_admin
+def get_archived_logs():
+    """Query archived access logs by time range (admin only).
+
+    ?from= and ?to= take 'YYYY-MM-DD[ HH:MM:SS]' timestamps; only the monthly
+    archive files overlapping the range are read.
+    """
+    start = request.args.get('from')
+    end = request.args.get('to')
+    user_name_filter = request.args.get('user_name')
+    action_filter = request.args.get('action')
+    limit = request.args.get('limit', default=LOGS_PAGE_SIZE_ADMIN, type=int)
+    limit = max(1, min(limit, LOGS_MAX_PAGE_SIZE))
+    
+    logs_list = []
+    for entry in audit_retention.iter_archived(start, end):
+        if user_name_filter and user_name_filter not in (entry['user_name'] or ''):
+            continue
+        if action_filter and action_filter not in (entry['action'] or ''):
+            continue
+        logs_list.append({
+            'id': entry['id'],
+            'timestamp': entry['timestamp'],
+            'user_name': entry['user_name'],
+            'key_name': entry['key_name'],
+            'action': entry['action'],
+            'ip_address': entry['ip_address'],
+            'success': bool(entry['success'])
+        })
+        if len(logs_list) >= limit:
+            break
+    
+    log_access('list_archived_logs')
+    return jsonify({'logs': logs_list, 'months': audit_retention.archived_months()})
 
 # User management endpoints (Admin only)
 @app.route('/users', methods=['GET'])
 @require_auth
 @require_admin
 def get_users():
-    """Get all users (admin only)."""
+    """List users a page at a time (admin only).
+
+    ?prefix= filters on the user name and ?role= on the role; ?sort=,
+    ?fields=, ?limit= and ?cursor= work as for GET /keys.
+    """
     db = get_db()
-    users = db.execute('''
-        SELECT id, username, role, created_at, last_login, is_active
-        FROM users
-        ORDER BY created_at DESC
-    ''').fetchall()
+    try:
+        fields, sort, limit, cursor = parse_list_args(USER_LIST_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': 'Invalid list parameters', 'details': str(e)}), 400
     
+    conditions = []
+    params = []
+    role_filter = request.args.get('role')
+    if role_filter:
+        conditions.append("AND u.role = ?")
+        params.append(role_filter)
+    order_by = add_list_conditions(conditions, params, sort, cursor, request.args.get('prefix'), 'username', 'u')
+    
+    columns = dict.fromkeys(['id', 'username', 'created_at'] + fields)
+    users = db.execute(f'''
+        SELECT {', '.join(f'u.{column}' for column in columns)}
+        FROM users u
+        WHERE 1=1 {' '.join(conditions)}
+        {order_by}
+        LIMIT {limit + 1}
+    ''', params).fetchall()
+    
+    next_cursor = encode_list_cursor(sort, users[limit - 1], 'username') if len(users) > limit else None
     users_list = []
-    for user in users:
-        users_list.append({
-            'id': user['id'],
-            'username': user['username'],
-            'role': user['role'],
-            'created_at': user['created_at'],
-            'last_login': user['last_login'],
-            'is_active': bool(user['is_active'])
-        })
+    for user in users[:limit]:
+        users_list.append({field: bool(user[field]) if field == 'is_active' else user[field] for field in fields})
     
     log_access('list_users')
-    return jsonify({'users': users_list})
+    return jsonify({'users': users_list, 'next_cursor': next_cursor})
 
 @app.route('/users', methods=['POST'])
 @require_auth
 @require_admin
+@limit_writes
 def add_user():
     """Add a new user (admin only)."""
     data = request.get_json()
@@ -557,7 +3301,7 @@ def add_user():
         return jsonify({'error': 'Role must be either "user" or "admin"'}), 400
     
     # Hash password
-    password_hash = generate_password_hash(password)
+    password_hash = password_hasher.hash(password)
     
     db = get_db()
     
@@ -582,6 +3326,7 @@ def add_user():
 @app.route('/users/<int:user_id>', methods=['PUT'])
 @require_auth
 @require_admin
+@limit_writes
 def update_user(user_id):
     """Update a user (admin only)."""
     data = request.get_json()
@@ -606,7 +3351,7 @@ def update_user(user_id):
         if len(data['password']) < 6:
             log_access('update_user', key_name=None, success=False, user_id=user_id, action_details='Password too short')
             return jsonify({'error': 'Password must be at least 6 characters'}), 400
-        password_hash = generate_password_hash(data['password'])
+        password_hash = password_hasher.hash(data['password'])
         update_fields.append('password_hash = ?')
         params.append(password_hash)
     
@@ -635,6 +3380,7 @@ def update_user(user_id):
 @app.route('/users/<int:user_id>', methods=['DELETE'])
 @require_auth
 @require_admin
+@limit_writes
 def delete_user(user_id):
     """Delete a user (admin only)."""
     db = get_db()
@@ -651,12 +3397,18 @@ def delete_user(user_id):
         return jsonify({'error': 'Cannot delete your own account'}), 400
     
     try:
+        owned_keys = [row['key_name'] for row in db.execute(
+            'SELECT key_name FROM api_keys WHERE owner_id = ?', (user_id,)
+        ).fetchall()]
+        
         # Delete user's API keys first
         db.execute('DELETE FROM api_keys WHERE owner_id = ?', (user_id,))
         
         # Delete user
         db.execute('DELETE FROM users WHERE id = ?', (user_id,))
         db.commit()
+        key_cache.invalidate(*owned_keys)
+        notify_key_change()
         
         log_access('delete_user', username=user['username'])
         return jsonify({'message': 'User deleted successfully'})
@@ -665,6 +3417,118 @@ def delete_user(user_id):
         print(f"Error deleting user {user_id}: {e}")
         return jsonify({'error': 'Internal server error while deleting user'}), 500
 
+# Service administration endpoints (Admin only)
+@app.route('/admin/key-cache', methods=['GET'])
+@require_auth
+@require_admin
+def get_key_cache_stats():
+    """Get decrypted-key cache statistics (admin only)."""
+    return jsonify(key_cache.stats())
+
+@app.route('/admin/password-hashing', methods=['GET'])
+@require_auth
+@require_admin
+def get_password_hashing_stats():
+    """Get password hashing pool statistics (admin only)."""
+    return jsonify(password_hasher.stats())
+
+@app.route('/admin/admission', methods=['GET'])
+@require_auth
+@require_admin
+def get_admission_stats():
+    """Admission control settings and counters of the worker serving the request (admin only)."""
+    return jsonify({
+        'rate_limit_enabled': RATE_LIMIT_ENABLED,
+        'rate_limits': {name: {'rate': rate, 'burst': burst} for name, (rate, burst) in rate_limiter.limits.items()},
+        'writes': write_admission.stats(),
+        'audit_queue': {'mode': AUDIT_LOG_MODE, 'pending': audit_writer.pending(), 'high_water': AUDIT_QUEUE_HIGH_WATER}
+    })
+
+@app.route('/admin/retention', methods=['GET'])
+@require_auth
+@require_admin
+def get_retention_status():
+    """Get audit log retention status (admin only)."""
+    return jsonify(audit_retention.stats())
+
+@app.route('/admin/retention/run', methods=['POST'])
+@require_auth
+@require_admin
+def run_retention():
+    """Start an audit log retention pass now (admin only)."""
+    if not audit_retention.enabled:
+        return jsonify({'error': 'Audit log retention is disabled', 'details': 'Set AUDIT_RETENTION_DAYS > 0'}), 400
+    audit_retention.trigger()
+    log_access('run_retention')
+    return jsonify({'message': 'Retention pass started'}), 202
+
+@app.route('/admin/key-rotation', methods=['GET'])
+@require_auth
+@require_admin
+def get_key_rotation_status():
+    """Get progress of the background re-encryption job (admin only)."""
+    return jsonify(key_rotation.stats())
+
+@app.route('/admin/key-rotation', methods=['POST'])
+@require_auth
+@require_admin
+def start_key_rotation():
+    """Re-encrypt all stored keys with the current ENCRYPTION_KEY (admin only).
+
+    Resumes an interrupted job from its checkpoint unless {"restart": true} is sent.
+    """
+    data = request.get_json(silent=True) or {}
+    if not key_rotation.start(restart=bool(data.get('restart'))):
+        return jsonify({'message': 'Key rotation is already running', 'status': key_rotation.stats()}), 200
+    log_access('start_key_rotation')
+    return jsonify({'message': 'Key rotation started', 'status': key_rotation.stats()}), 202
+
+@app.route('/admin/backups', methods=['GET'])
+@require_auth
+@require_admin
+def get_backups():
+    """List hot backups and the state of the last one started here (admin only)."""
+    return jsonify({
+        'backup_dir': BACKUP_DIR,
+        'running': backup_runner.running(),
+        'last_backup': backup_runner.last_backup,
+        'last_error': backup_runner.last_error,
+        'backups': keystore_backup.list_backups(BACKUP_DIR)
+    })
+
+@app.route('/admin/backups', methods=['POST'])
+@require_auth
+@require_admin
+def start_backup():
+    """Start a hot backup (admin only). Send {"incremental": true} to store only changed pages."""
+    data = request.get_json(silent=True) or {}
+    if not backup_runner.start(incremental=bool(data.get('incremental'))):
+        return jsonify({'error': 'A backup is already running'}), 409
+    log_access('create_backup')
+    return jsonify({'message': 'Backup started'}), 202
+
+@app.route('/admin/backups/<backup_id>/verify', methods=['POST'])
+@require_auth
+@require_admin
+def verify_backup(backup_id):
+    """Rebuild a backup in a temporary file and check its checksums and integrity (admin only)."""
+    if not backup_id.startswith('keystore-') or os.sep in backup_id:
+        return jsonify({'error': 'Invalid backup id'}), 400
+    try:
+        keystore_backup.verify_backup(BACKUP_DIR, backup_id)
+    except keystore_backup.BackupError as e:
+        log_access('verify_backup', success=False)
+        return jsonify({'error': 'Backup verification failed', 'details': str(e)}), 422
+    log_access('verify_backup')
+    return jsonify({'message': f'Backup {backup_id} verified'})
+
+@app.route('/admin/replication', methods=['GET'])
+@require_auth
+@require_admin
+def get_replication_status():
+    """Replication state of this instance: publishing on the primary, lag on a follower (admin only)."""
+    return jsonify(replica.stats() if FOLLOWER else replication_publisher.stats())
+
 # Static file serving for frontend
 @app.route('/')
 def serve_frontend():
@@ -679,18 +3543,168 @@ def serve_static(filename):
 # Health check endpoint
 @app.route('/health')
 def health_check():
-    """Health check endpoint."""
-    return jsonify({
+    """Health check endpoint. A follower reports 503 while its copy is missing or too far behind."""
+    health = {
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
-        'service': 'API Key Management Service'
-    })
+        'service': 'API Key Management Service',
+        'role': KEYSTORE_ROLE
+    }
+    if not FOLLOWER:
+        return jsonify(health)
+    lag = replica.lag() if replica.ready() else None
+    health['replication_lag'] = lag
+    if lag is None or lag > FOLLOWER_MAX_LAG:
+        health['status'] = 'lagging'
+        return jsonify(health), 503
+    return jsonify(health)
+
+class SamplingProfiler:
+    """Samples the stacks of every thread in this worker for a few seconds.
+
+    Output is in collapsed-stack format ("thread;frame;frame count"), which
+    flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def capture(self, seconds, interval):
+        """Returns a Counter of collapsed stacks, or None if a capture is already running."""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            own_thread = threading.get_ident()
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        code = frame.f_code
+                        frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    frames.append(thread_names.get(thread_id, str(thread_id)))
+                    stacks[';'.join(reversed(frames))] += 1
+                time.sleep(interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+profiler = SamplingProfiler()
+
+@app.route('/admin/profile', methods=['POST'])
+@require_auth
+@require_admin
+def capture_profile():
+    """Sample the stacks of the worker serving this request for ?seconds= (admin only).
+
+    ?interval_ms= sets the sampling interval (default 10). ?format=collapsed
+    (default) returns collapsed stacks for flame graphs; ?format=json returns
+    the functions seen most often. With several workers, only the worker
+    that receives this request is profiled.
+    """
+    seconds = request.args.get('seconds', default=10, type=float)
+    if not 0 < seconds <= PROFILER_MAX_SECONDS:
+        return jsonify({'error': 'Invalid duration', 'details': f'seconds must be between 0 and {PROFILER_MAX_SECONDS}'}), 400
+    interval = max(request.args.get('interval_ms', default=10, type=float), 1) / 1000.0
+    
+    log_access('capture_profile')
+    stacks = profiler.capture(seconds, interval)
+    if stacks is None:
+        return jsonify({'error': 'A profile is already being captured in this worker'}), 409
+    
+    if request.args.get('format') == 'json':
+        # Inclusive counts: each function counted once per sample it appears in;
+        # self counts: the function was on top of the stack
+        functions = Counter()
+        self_functions = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')[1:]
+            for frame in set(frames):
+                functions[frame] += count
+            if frames:
+                self_functions[frames[-1]] += count
+        return jsonify({
+            'pid': os.getpid(),
+            'samples': sum(stacks.values()),
+            'top_functions': [{'function': name, 'samples': count} for name, count in functions.most_common(50)],
+            'top_self': [{'function': name, 'samples': count} for name, count in self_functions.most_common(50)]
+        })
+    
+    body = ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+    return Response(body, mimetype='text/plain')
+
+def database_file_sizes():
+    """DB and WAL file sizes, read at scrape time."""
+    sizes = []
+    for name, path, documentation in (
+        ('keystore_db_size_bytes', DATABASE, 'Size of the SQLite database file.'),
+        ('keystore_db_wal_size_bytes', DATABASE + '-wal', 'Size of the SQLite write-ahead log.')
+    ):
+        try:
+            sizes.append((name, 'gauge', documentation, os.path.getsize(path)))
+        except OSError:
+            sizes.append((name, 'gauge', documentation, 0))
+    return sizes
+
+metrics.scrape_collectors.append(database_file_sizes)
+
+def replication_lag_metric():
+    """Follower lag, read at scrape time."""
+    lag = replica.lag()
+    if lag is None:
+        return []
+    return [('keystore_replication_lag_seconds', 'gauge', 'Seconds the follower copy may be behind the primary.', lag)]
+
+if FOLLOWER:
+    metrics.scrape_collectors.append(replication_lag_metric)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics for all workers."""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Endpoint not found'}), 404
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return jsonify({'error': 'Invalid metrics token'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
 
+@app.errorhandler(PasswordHashingBusy)
+def password_hashing_busy(error):
+    response = jsonify({'error': 'Server busy', 'details': 'Too many concurrent password operations, retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.errorhandler(RateLimited)
+def rate_limited(error):
+    response = jsonify({'error': 'Rate limit exceeded', 'details': f'Retry in {error.retry_after:.2f} seconds'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+@app.errorhandler(ServerOverloaded)
+def server_overloaded(error):
+    response = jsonify({'error': 'Server busy', 'details': f'Request shed by admission control ({error.reason}), retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.errorhandler(AuditWriteFailed)
+def audit_write_failed(error):
+    response = jsonify({'error': 'Audit log unavailable', 'details': 'The access log entry for this request could not be written, retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 @app.errorhandler(500)
 def internal_error(error):
     # Log the full exception for debugging
@@ -701,9 +3715,13 @@ def internal_error(error):
 if __name__ == '__main__':
     print("Initializing API Key Management Service...")
     
-    # Initialize database
-    init_db()
-    print("Database initialized successfully")
+    # Initialize database (a follower installs the primary's latest snapshot instead)
+    if FOLLOWER:
+        replica.install_latest()
+        print("Replica installed" if replica.ready() else f"No snapshot in {REPLICATION_DIR} yet, waiting for the primary")
+    else:
+        init_db()
+        print("Database initialized successfully")
     
     # Print default credentials
     print("\n" + "="*50)
@@ -715,7 +3733,8 @@ if __name__ == '__main__':
     print(f"Encryption key: {ENCRYPTION_KEY}")
     print(f"JWT Secret: {SECRET_KEY}")
     
-    # Run the application
-    print("Starting server on http://localhost:5000")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Run the development server. For production use gunicorn:
+    #   gunicorn -c gunicorn.conf.py enhanced_keystore_service:app
+    print("Starting development server on http://localhost:5000")
+    app.run(debug=DEBUG, host='0.0.0.0', port=5000, threaded=True)
 
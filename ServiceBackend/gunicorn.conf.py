@@ -0,0 +1,94 @@
+"""
+Gunicorn configuration for the API Key Management Service.
+
+Usage:
+    gunicorn -c gunicorn.conf.py                      # Flask app (WSGI)
+    KEYSTORE_MODE=asgi gunicorn -c gunicorn.conf.py   # asyncio mode, see keystore_asgi.py
+
+All settings can be overridden through environment variables (see .env_SAMPLE.txt).
+The database schema is initialized once in the master process before any
+worker is forked.
+"""
+
+import os
+import multiprocessing
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+bind = os.environ.get('KEYSTORE_BIND', '0.0.0.0:5000')
+
+# Serving mode: 'wsgi' (the Flask app) or 'asgi' (one event loop per worker, run by uvicorn)
+if os.environ.get('KEYSTORE_MODE', 'wsgi').lower() == 'asgi':
+    wsgi_app = 'keystore_asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'enhanced_keystore_service:app'
+    # Worker model: 'gthread' (threads per process, the default) or 'sync' (one request per process)
+    worker_class = os.environ.get('KEYSTORE_WORKER_CLASS', 'gthread')
+workers = _env_int('KEYSTORE_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8))
+threads = _env_int('KEYSTORE_THREADS', 4) if worker_class == 'gthread' else 1
+
+# Load the app once in the master so workers share its memory and start fast
+preload_app = os.environ.get('KEYSTORE_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+
+# Recycle workers after a number of requests to bound memory growth; the jitter
+# keeps all workers from restarting at the same moment
+max_requests = _env_int('KEYSTORE_MAX_REQUESTS', 10000)
+max_requests_jitter = _env_int('KEYSTORE_MAX_REQUESTS_JITTER', 1000)
+
+timeout = _env_int('KEYSTORE_TIMEOUT', 60)
+graceful_timeout = _env_int('KEYSTORE_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('KEYSTORE_KEEPALIVE', 5)
+
+accesslog = os.environ.get('KEYSTORE_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('KEYSTORE_LOG_LEVEL', 'info')
+
+# A sync worker is killed once a request outlives timeout, GET /keys:watch streams
+# included: end streams before that (clients resume with Last-Event-ID)
+if worker_class == 'sync':
+    os.environ.setdefault('CHANGE_FEED_STREAM_MAX_SECONDS', str(max(1, timeout - 10)))
+
+def _check_settings(server, service):
+    """Refuse settings that break requests across workers or kill long-lived requests."""
+    cfg = server.cfg
+    missing = [name for name in ('SECRET_KEY', 'ENCRYPTION_KEY') if not os.environ.get(name)]
+    if missing and (cfg.workers > 1 or not cfg.preload_app):
+        # Each process that imports the app would generate its own keys: tokens issued by
+        # one worker fail on another, and values one worker encrypts no other can read
+        raise RuntimeError(
+            f"{' and '.join(missing)} must be set when running more than one worker or without "
+            f"preload (run HelperScripts/generate-keys.sh)")
+    if cfg.worker_class_str == 'sync':
+        for name in ('CHANGE_FEED_STREAM_MAX_SECONDS', 'CHANGE_FEED_MAX_WAIT'):
+            if getattr(service, name) >= cfg.timeout:
+                raise RuntimeError(
+                    f"{name}={getattr(service, name)} is not below the sync worker timeout ({cfg.timeout}s); "
+                    f"lower it or use KEYSTORE_WORKER_CLASS=gthread")
+
+def on_starting(server):
+    """Check the configuration, then create/upgrade the schema exactly once, before workers fork.
+
+    A follower (KEYSTORE_ROLE=follower) installs the primary's latest snapshot instead.
+    """
+    import enhanced_keystore_service as service
+    _check_settings(server, service)
+    if service.FOLLOWER:
+        service.replica.install_latest()
+        server.log.info("Replica installed" if service.replica.ready() else "No snapshot from the primary yet")
+    else:
+        service.init_db()
+        server.log.info("Database initialized successfully")
+    service.metrics.reset_snapshots()
+
+def post_worker_init(worker):
+    """Start replication (publishing or following) without waiting for the first request."""
+    import enhanced_keystore_service as service
+    service.replication_publisher.ensure_started()
+    service.replica.ensure_started()
+
+def worker_exit(server, worker):
+    """Flush queued audit log rows before the worker process goes away."""
+    import enhanced_keystore_service as service
+    service.audit_writer.stop()
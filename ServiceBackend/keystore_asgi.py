@@ -0,0 +1,691 @@
+#!/usr/bin/env python3
+"""
+Asyncio (ASGI) serving mode for the API Key Management Service.
+
+Usage:
+    KEYSTORE_MODE=asgi gunicorn -c gunicorn.conf.py    # uvicorn workers
+    python keystore_asgi.py                           # single process, development
+
+In the Flask (WSGI) mode every open request holds a worker thread. Here one
+event loop per process owns the connections, so idle keep-alive
+connections, GET /keys:changes long-polls and GET /keys:watch streams cost
+a coroutine each instead of a thread.
+
+GET /keys/<key_name>, GET /keys:changes and GET /keys:watch are served on
+the event loop:
+  * reads run on a few dedicated reader connections in a small thread pool
+  * writes (audit rows) are queued to a single writer task, which commits
+    everything queued so far in one transaction
+  * JWT verification and Fernet decryption run on a separate crypto pool
+All other routes are passed to the Flask app on a bounded thread pool, so
+routes, auth checks and response shapes are identical in both modes.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import tempfile
+import threading
+import traceback
+from functools import wraps
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.http import parse_etags, quote_etag
+
+import enhanced_keystore_service as ks
+
+# Threads serving the routes handled by the Flask app
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+
+# Reader connections of the async SQLite layer, and threads for JWT/Fernet work
+ASGI_DB_READERS = int(os.environ.get('ASGI_DB_READERS', 4))
+ASGI_CRYPTO_THREADS = int(os.environ.get('ASGI_CRYPTO_THREADS', 2))
+
+# Most queued writes the writer task commits in one transaction
+ASGI_WRITE_BATCH_SIZE = int(os.environ.get('ASGI_WRITE_BATCH_SIZE', 500))
+
+# Request bodies passed to Flask are kept in memory up to this size, then spooled to disk
+ASGI_SPOOL_BYTES = 1024 * 1024
+
+class AsyncDatabase:
+    """Async SQLite access: reads on a reader pool, writes through one writer task."""
+
+    _STOP = object()
+
+    def __init__(self, readers, write_batch_size):
+        self.readers = max(1, readers)
+        self.write_batch_size = max(1, write_batch_size)
+        self._local = threading.local()
+        self._read_executor = None
+        self._write_executor = None
+        self._write_conn = None
+        self._queue = None
+        self._writer = None
+        self._pid = None
+
+    def start(self):
+        """Create the pools and the writer task (on the running loop, in this process)."""
+        if self._writer is not None and not self._writer.done() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._read_executor = ThreadPoolExecutor(self.readers, thread_name_prefix='asgi-db-read')
+        self._write_executor = ThreadPoolExecutor(1, thread_name_prefix='asgi-db-write')
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.get_running_loop().create_task(self._run_writer())
+
+    async def stop(self):
+        """Commit everything queued and stop the writer task."""
+        if self._writer is None or self._writer.done() or self._pid != os.getpid():
+            return
+        self._queue.put_nowait(self._STOP)
+        await self._writer
+
+    def _read(self, sql, params, one):
+        if ks.FOLLOWER:
+            # Borrow from the shared pool, which lets go of a retired copy of the
+            # database at once; an idle reader thread would keep it locked
+            conn = ks.db_pool.acquire()
+            try:
+                cursor = conn.execute(sql, params)
+                return cursor.fetchone() if one else cursor.fetchall()
+            finally:
+                ks.db_pool.release(conn)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = ks.open_db_connection()
+        cursor = conn.execute(sql, params)
+        return cursor.fetchone() if one else cursor.fetchall()
+
+    async def fetchall(self, sql, params=()):
+        return await asyncio.get_running_loop().run_in_executor(self._read_executor, self._read, sql, params, False)
+
+    async def fetchone(self, sql, params=()):
+        return await asyncio.get_running_loop().run_in_executor(self._read_executor, self._read, sql, params, True)
+
+    async def write(self, sql, rows, wait=True):
+        """Queue executemany(sql, rows). With wait=True, return once it is committed."""
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._queue.put_nowait((sql, rows, future))
+        if future is not None:
+            await future
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _run_writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            stopping = item is self._STOP
+            batch = [] if stopping else [item]
+            # Everything queued while the previous commit ran shares the next one
+            while not stopping and len(batch) < self.write_batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is self._STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if batch:
+                error = await loop.run_in_executor(self._write_executor, self._write_batch, batch)
+                for _, _, future in batch:
+                    if future is None or future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+            if stopping:
+                await loop.run_in_executor(self._write_executor, self._close_writer)
+                return
+
+    def _write_batch(self, batch):
+        if self._write_conn is None:
+            self._write_conn = ks.open_db_connection()
+        error = None
+        # Retried like ks.AuditLogWriter; waiters get the last error, audit rows are counted as dropped
+        for attempt in range(max(0, ks.AUDIT_WRITE_RETRIES) + 1):
+            if attempt:
+                time.sleep(0.05 * attempt)
+            start = time.perf_counter()
+            try:
+                for sql, rows, _ in batch:
+                    self._write_conn.executemany(sql, rows)
+                self._write_conn.commit()
+                ks.audit_batch_duration.observe(time.perf_counter() - start)
+                return None
+            except Exception as e:
+                self._write_conn.rollback()
+                error = e
+                print(f"Error writing {len(batch)} queued statements (attempt {attempt + 1}): {e}")
+        ks.audit_rows_dropped.inc(amount=sum(len(rows) for sql, rows, _ in batch if sql == ks.ACCESS_LOG_INSERT))
+        return error
+
+    def _close_writer(self):
+        if self._write_conn is not None:
+            self._write_conn.close()
+            self._write_conn = None
+
+class KeyChangeNotifier:
+    """Wakes waiting change-feed coroutines when key_changes advances.
+
+    Changes made in this process wake waiters at once through
+    ks.key_change_listeners. Changes made by other workers are found by one
+    MAX(seq) query per poll interval for the whole process, not one query per
+    waiter.
+    """
+
+    def __init__(self, database, interval):
+        self.database = database
+        self.interval = interval
+        self.event = None
+        self._latest = None
+        self._loop = None
+        self._task = None
+        self._pid = None
+        ks.key_change_listeners.append(self._notify_threadsafe)
+
+    def start(self):
+        if self._task is not None and not self._task.done() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self._task = self._loop.create_task(self._poll())
+
+    def _notify_threadsafe(self):
+        loop = self._loop
+        if loop is not None and self._pid == os.getpid() and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        self.event.set()
+        self.event = asyncio.Event()
+
+    async def wait(self, event, timeout):
+        """Wait until `event` (read before querying) fires or timeout seconds pass."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _poll(self):
+        while True:
+            try:
+                row = await self.database.fetchone('SELECT MAX(seq) AS seq FROM key_changes')
+            except Exception as e:
+                print(f"Error polling key changes: {e}")
+            else:
+                latest = row['seq'] or 0
+                if self._latest is not None and latest != self._latest:
+                    self._wake()
+                self._latest = latest
+            await asyncio.sleep(self.interval)
+
+database = AsyncDatabase(ASGI_DB_READERS, ASGI_WRITE_BATCH_SIZE)
+key_changes = KeyChangeNotifier(database, ks.CHANGE_FEED_POLL_INTERVAL)
+crypto_executor = None
+wsgi_executor = None
+_started_pid = None
+
+def ensure_started():
+    """Start the pools and background tasks of this process (after a fork, in the worker)."""
+    global crypto_executor, wsgi_executor, _started_pid
+    if _started_pid == os.getpid():
+        return
+    _started_pid = os.getpid()
+    crypto_executor = ThreadPoolExecutor(max(1, ASGI_CRYPTO_THREADS), thread_name_prefix='asgi-crypto')
+    wsgi_executor = ThreadPoolExecutor(max(1, ASGI_WSGI_THREADS), thread_name_prefix='asgi-wsgi')
+    database.start()
+    key_changes.start()
+    ks.metrics.ensure_started()
+    ks.start_background_jobs()
+
+async def run_crypto(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(crypto_executor, function, *args)
+
+# --- Requests and responses of the native routes ---
+
+class AsyncRequest:
+    """The parts of an ASGI HTTP scope the native routes need."""
+
+    __slots__ = ('method', 'path', 'headers', 'args', 'remote_addr', 'current_user', 'auth_token')
+
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {}
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            self.headers[name] = f"{self.headers[name]},{value}" if name in self.headers else value
+        self.args = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else None
+        self.current_user = None
+        self.auth_token = None
+
+    def arg(self, name, default=None, type=int):
+        """First value of a query parameter, converted like Flask's request.args.get(type=...)."""
+        values = self.args.get(name)
+        if not values:
+            return default
+        try:
+            return type(values[0])
+        except ValueError:
+            return default
+
+class AsyncResponse:
+    """Status, headers and a body that is either bytes or an async iterator of bytes."""
+
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, body=b'', status=200, content_type='application/json', headers=()):
+        self.status = status
+        self.body = body
+        self.headers = [('content-type', content_type)] + list(headers)
+
+def json_response(data, status=200):
+    # Same serialization as Flask's jsonify
+    if ks.app.debug:
+        text = ks.app.json.dumps(data, indent=2)
+    else:
+        text = ks.app.json.dumps(data, separators=(',', ':'))
+    return AsyncResponse((text + '\n').encode(), status)
+
+def not_modified(etag):
+    return AsyncResponse(b'', 304, 'text/html; charset=utf-8', [('etag', quote_etag(etag))])
+
+def rejection_response(status, data, retry_after):
+    response = json_response(data, status)
+    response.headers.append(('retry-after', str(max(1, retry_after))))
+    return response
+
+def require_auth(handler):
+    """Async counterpart of ks.require_auth: sets request.current_user and request.auth_token."""
+    @wraps(handler)
+    async def decorated_function(request, *args):
+        auth_header = request.headers.get('authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return json_response({'error': 'Authentication required', 'details': 'No token provided'}, 401)
+
+        token = auth_header.split(' ')[1]
+        payload = await run_crypto(ks.verify_jwt_token, token)
+        if not payload:
+            return json_response({'error': 'Invalid or expired token', 'details': 'Token verification failed'}, 401)
+
+        request.current_user = payload
+        request.auth_token = token
+        try:
+            # Rows queued for this process's writer task count towards the audit backlog
+            ks.admit_request(payload, database.pending())
+        except ks.RateLimited as e:
+            return rejection_response(429, {'error': 'Rate limit exceeded', 'details': f'Retry in {e.retry_after:.2f} seconds'},
+                                      math.ceil(e.retry_after))
+        except ks.ServerOverloaded as e:
+            return rejection_response(503, {'error': 'Server busy', 'details': f'Request shed by admission control ({e.reason}), retry shortly'},
+                                      e.retry_after)
+        return await handler(request, *args)
+    return decorated_function
+
+async def log_access(request, action, key_name=None, success=True):
+    """Write an access_log row through the writer task, honouring AUDIT_LOG_MODE."""
+    user = request.current_user or {}
+    row = (user.get('user_id'), user.get('username'), key_name, action,
+           request.remote_addr, request.headers.get('user-agent', ''), success)
+    start = time.perf_counter()
+    if ks.FOLLOWER:
+        await asyncio.get_running_loop().run_in_executor(None, ks.append_follower_access_rows, [row])
+        ks.audit_write_duration.observe(time.perf_counter() - start, 'inbox')
+        return
+    # 'async' returns before the commit; 'sync' and 'group' wait for it
+    await database.write(ks.ACCESS_LOG_INSERT, [row], wait=ks.AUDIT_LOG_MODE != 'async')
+    ks.audit_write_duration.observe(time.perf_counter() - start, ks.AUDIT_LOG_MODE)
+
+def decrypt_uncached(key):
+    """Decrypt a key that just missed ks.key_cache and cache it (the miss is already counted)."""
+    value = ks.cipher.decrypt(key['encrypted_value'].encode()).decode()
+    ks.key_cache.put(key['key_name'], key['updated_at'], key['encrypted_value'], value)
+    return value
+
+# --- Native routes ---
+
+@require_auth
+async def get_key(request, key_name):
+    """Get a specific API key with its value."""
+    if request.current_user['role'] == 'admin':
+        key = await database.fetchone('SELECT * FROM api_keys WHERE key_name = ?', (key_name,))
+    else:
+        key = await database.fetchone(
+            'SELECT * FROM api_keys WHERE key_name = ? AND owner_id = ?',
+            (key_name, request.current_user['user_id'])
+        )
+
+    if not key:
+        await log_access(request, 'view_key', key_name, success=False)
+        return json_response({'error': 'Key not found'}, 404)
+
+    # The caller already holds this version: skip decryption entirely
+    etag = ks.key_etag(key)
+    if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+        await log_access(request, 'view_key', key_name)
+        return not_modified(etag)
+
+    try:
+        decrypted_key = ks.key_cache.get(key['key_name'], key['updated_at'], key['encrypted_value'])
+        if decrypted_key is None:
+            decrypted_key = await run_crypto(decrypt_uncached, key)
+    except Exception as e:
+        await log_access(request, 'view_key', key_name, success=False)
+        print(f"Decryption error for key {key_name}: {e}") # Log internal error
+        return json_response({'error': 'Failed to decrypt key', 'details': str(e)}, 500)
+
+    await log_access(request, 'view_key', key_name)
+    response = json_response({
+        'key_name': key['key_name'],
+        'api_key': decrypted_key,
+        'description': key['description'],
+        'created_at': key['created_at'],
+        'updated_at': key['updated_at']
+    })
+    response.headers.append(('etag', quote_etag(etag)))
+    return response
+
+async def read_key_changes(user, since, limit=ks.CHANGE_FEED_PAGE_SIZE):
+    """Return key changes after seq `since` visible to user."""
+    query = 'SELECT seq, key_name, op, changed_at FROM key_changes WHERE seq > ?'
+    params = [since]
+    if user['role'] != 'admin':
+        query += ' AND owner_id = ?'
+        params.append(user['user_id'])
+    query += f' ORDER BY seq LIMIT {int(limit)}'
+    rows = await database.fetchall(query, params)
+    return [{'seq': row['seq'], 'key_name': row['key_name'], 'op': row['op'], 'changed_at': row['changed_at']} for row in rows]
+
+async def latest_key_change_seq():
+    row = await database.fetchone('SELECT MAX(seq) AS seq FROM key_changes')
+    return row['seq'] or 0
+
+async def wait_for_key_changes(user, since, timeout):
+    """Wait until changes after `since` are visible or `timeout` seconds pass."""
+    deadline = time.monotonic() + timeout
+    while True:
+        # Taken before the query so a change committed in between is not missed
+        event = key_changes.event
+        changes = await read_key_changes(user, since)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        await key_changes.wait(event, remaining)
+
+@require_auth
+async def get_key_changes(request):
+    """Long-poll for key changes after ?since=<seq>, waiting up to ?wait= seconds."""
+    since = request.arg('since')
+    if since is None:
+        since = await latest_key_change_seq()
+    wait = request.arg('wait', default=ks.CHANGE_FEED_MAX_WAIT)
+    wait = max(0, min(wait, ks.CHANGE_FEED_MAX_WAIT))
+
+    changes = await wait_for_key_changes(request.current_user, since, wait)
+    last_seq = changes[-1]['seq'] if changes else since
+
+    await log_access(request, 'key_changes')
+    return json_response({'changes': changes, 'last_seq': last_seq})
+
+@require_auth
+async def watch_key_changes(request):
+    """Stream key changes as Server-Sent Events, resuming after ?since= or Last-Event-ID."""
+    since = request.arg('since')
+    if since is None:
+        try:
+            since = int(request.headers.get('last-event-id', ''))
+        except ValueError:
+            since = None
+    if since is None:
+        since = await latest_key_change_seq()
+
+    await log_access(request, 'watch_keys')
+
+    async def generate(since):
+        # Clients reconnect with Last-Event-ID once the stream ends
+        stream_deadline = time.monotonic() + ks.CHANGE_FEED_STREAM_MAX_SECONDS
+        yield f"retry: {int(ks.CHANGE_FEED_POLL_INTERVAL * 1000)}\n\n".encode()
+        while time.monotonic() < stream_deadline:
+            changes = await wait_for_key_changes(request.current_user, since,
+                                                 min(ks.CHANGE_FEED_HEARTBEAT, stream_deadline - time.monotonic()))
+            if not changes:
+                yield b": heartbeat\n\n"
+                continue
+            for change in changes:
+                yield f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change)}\n\n".encode()
+            since = changes[-1]['seq']
+
+    return AsyncResponse(generate(since), content_type='text/event-stream; charset=utf-8', headers=[
+        ('cache-control', 'no-cache'),
+        ('x-accel-buffering', 'no')  # Disable nginx response buffering
+    ])
+
+def match_native_route(method, path):
+    """(handler, args, route) for requests served on the event loop, else None."""
+    if method != 'GET':
+        return None
+    if path == '/keys:changes':
+        return get_key_changes, (), '/keys:changes'
+    if path == '/keys:watch':
+        return watch_key_changes, (), '/keys:watch'
+    if path.startswith('/keys/'):
+        key_name = path[len('/keys/'):]
+        if key_name and '/' not in key_name:
+            return get_key, (key_name,), '/keys/<key_name>'
+    return None
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+async def send_response(response, request, receive, send, elapsed):
+    headers = list(response.headers)
+    # Same CORS headers flask_cors adds to Flask responses
+    origin = request.headers.get('origin')
+    headers.append(('access-control-allow-origin', origin or '*'))
+    if origin:
+        headers.append(('vary', 'Origin'))
+    if ks.SERVER_TIMING_ENABLED:
+        headers.append(('server-timing', f'total;dur={elapsed * 1000:.2f}'))
+    lag = ks.replica.lag() if ks.FOLLOWER else None
+    if lag is not None:
+        headers.append(('x-replication-lag', f'{lag:.3f}'))
+
+    if isinstance(response.body, bytes):
+        headers.append(('content-length', str(len(response.body))))
+        await send({'type': 'http.response.start', 'status': response.status,
+                    'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': response.body})
+        return
+
+    await send({'type': 'http.response.start', 'status': response.status,
+                'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+    # Stop streaming as soon as the client goes away instead of at the next heartbeat
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    chunks = response.body.__aiter__()
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait({next_chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                next_chunk.cancel()
+                try:
+                    await next_chunk
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+                break
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                await send({'type': 'http.response.body', 'body': b''})
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        disconnected.cancel()
+        await chunks.aclose()
+
+async def serve_native(match, scope, receive, send):
+    handler, args, route = match
+    request = AsyncRequest(scope)
+    start = time.perf_counter()
+    status = 500
+    if ks.METRICS_ENABLED:
+        ks.http_requests_in_flight.inc(route)
+    try:
+        try:
+            if ks.FOLLOWER and not ks.replica.ready():
+                response = json_response({'error': 'Replica not ready', 'details': 'No snapshot from the primary has been installed yet'}, 503)
+            else:
+                response = await handler(request, *args)
+        except Exception as e:
+            traceback.print_exc()
+            response = json_response({'error': 'Internal server error', 'details': str(e)}, 500)
+        status = response.status
+        await send_response(response, request, receive, send, time.perf_counter() - start)
+    finally:
+        elapsed = time.perf_counter() - start
+        if ks.SLOW_REQUEST_MS > 0 and elapsed * 1000 >= ks.SLOW_REQUEST_MS:
+            print(f"Slow request: {request.method} {request.path} -> {status} total={elapsed * 1000:.1f}ms")
+        if ks.METRICS_ENABLED:
+            ks.http_requests_in_flight.dec(route)
+            ks.http_request_duration.observe(elapsed, request.method, route)
+            ks.http_requests_total.inc(request.method, route, str(status))
+
+# --- Everything else: the Flask app on a bounded thread pool ---
+
+def build_environ(scope, body, content_length):
+    """WSGI environ for an ASGI HTTP scope whose body has been read into `body`."""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(content_length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'] = server[0]
+    environ['SERVER_PORT'] = str(server[1] or 80)
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+        environ['REMOTE_PORT'] = str(client[1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue  # Replaced by the length actually received
+        key = name if name == 'CONTENT_TYPE' else f'HTTP_{name}'
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def run_wsgi(environ, loop, send):
+    """Run the Flask app in a pool thread, forwarding its response to the event loop."""
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    start = {}
+    def start_response(status, headers, exc_info=None):
+        if exc_info and start.get('sent'):
+            raise exc_info[1].with_traceback(exc_info[2])
+        start['message'] = {
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        }
+        return lambda data: send_body(data)
+
+    def send_body(data):
+        if not start.get('sent'):
+            send_from_thread(start['message'])
+            start['sent'] = True
+        if data:
+            send_from_thread({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+    result = ks.app(environ, start_response)
+    try:
+        for data in result:
+            send_body(data)
+        send_body(b'')
+        send_from_thread({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()  # Runs Flask's teardown handlers
+
+async def serve_wsgi(scope, receive, send):
+    body = tempfile.SpooledTemporaryFile(max_size=ASGI_SPOOL_BYTES)
+    try:
+        content_length = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunk = message.get('body', b'')
+            body.write(chunk)
+            content_length += len(chunk)
+            more_body = message.get('more_body', False)
+        body.seek(0)
+        environ = build_environ(scope, body, content_length)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(wsgi_executor, run_wsgi, environ, loop, send)
+    finally:
+        body.close()
+
+# --- ASGI entry point ---
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            ensure_started()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await database.stop()
+            await asyncio.get_running_loop().run_in_executor(None, ks.audit_writer.stop)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return  # WebSockets are not supported
+    ensure_started()
+    match = match_native_route(scope['method'], scope['path'])
+    if match is None:
+        await serve_wsgi(scope, receive, send)
+    else:
+        await serve_native(match, scope, receive, send)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("Initializing API Key Management Service (asyncio mode)...")
+    if ks.FOLLOWER:
+        ks.replica.install_latest()
+    else:
+        ks.init_db()
+        print("Database initialized successfully")
+    print("Starting development server on http://localhost:5000")
+    uvicorn.run(app, host='0.0.0.0', port=5000, lifespan='on')
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Hot backup and verified restore for the API Key Management Service database.
+
+Backups are taken with SQLite's online backup API while the service keeps
+running. A backup is either:
+  * full        - the whole snapshot, gzip-compressed
+  * incremental - only the pages that changed since the previous backup
+
+Every backup has a JSON manifest holding the SHA-256 of the compressed
+file and of the reconstructed database, so a restore can verify the whole
+chain before touching the live database.
+
+Usage:
+    python keystore_backup.py backup [--incremental]
+    python keystore_backup.py list
+    python keystore_backup.py verify <backup_id>
+    python keystore_backup.py restore <backup_id> [--yes]   (service must be stopped)
+"""
+
+import os
+import sys
+import json
+import gzip
+import fcntl
+import shutil
+import struct
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime
+from contextlib import closing
+
+DATABASE = os.environ.get('DATABASE', '/app/data/keystore.db')
+BACKUP_DIR = os.environ.get('BACKUP_DIR', os.path.join(os.path.dirname(DATABASE), 'backups'))
+
+# Pages copied per backup step and the pause between steps (seconds)
+BACKUP_STEP_PAGES = int(os.environ.get('BACKUP_STEP_PAGES', 256))
+BACKUP_STEP_SLEEP = float(os.environ.get('BACKUP_STEP_SLEEP', 0.01))
+
+# A paced backup restarts whenever another connection writes to the database.
+# After this many restarts the copy is finished in a single step instead, which
+# in WAL mode reads one consistent snapshot without blocking writers.
+BACKUP_MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', 3))
+
+CHUNK_SIZE = 1024 * 1024
+PAGE_HASH_SIZE = 16
+
+
+class BackupError(Exception):
+    """A backup could not be created, verified or restored."""
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _file_sha256(path, opener=open):
+    digest = hashlib.sha256()
+    with opener(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _page_hashes(path, page_size):
+    """Concatenated short digests of every page of a database file."""
+    hashes = bytearray()
+    with open(path, 'rb') as f:
+        for page in iter(lambda: f.read(page_size), b''):
+            hashes += hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+    return bytes(hashes)
+
+
+def _fsync_write(path, data_writer):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        data_writer(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_page_records(path, records):
+    """Write (page_number, page) records as an incremental backup file."""
+    def write_pages(f):
+        # Each record is a 4-byte big-endian page number followed by the page
+        with gzip.GzipFile(fileobj=f, mode='wb') as out:
+            for page_number, page in records:
+                out.write(struct.pack('>I', page_number) + page)
+    _fsync_write(path, write_pages)
+
+
+def _new_backup_id():
+    return 'keystore-' + datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')
+
+
+def _manifest_path(backup_dir, backup_id):
+    return os.path.join(backup_dir, f'{backup_id}.json')
+
+
+def load_manifest(backup_dir, backup_id):
+    path = _manifest_path(backup_dir, backup_id)
+    if not os.path.exists(path):
+        raise BackupError(f'Backup {backup_id} not found in {backup_dir}')
+    with open(path) as f:
+        return json.load(f)
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """Manifests of all backups in backup_dir, oldest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(backup_dir)):
+        if name.startswith('keystore-') and name.endswith('.json'):
+            with open(os.path.join(backup_dir, name)) as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def snapshot_database(database, dest_path, step_pages=BACKUP_STEP_PAGES, step_sleep=BACKUP_STEP_SLEEP):
+    """Copy database to dest_path with the online backup API, in paced steps."""
+    progress = {'remaining': None, 'restarts': 0}
+
+    def on_progress(status, remaining, total):
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > BACKUP_MAX_RESTARTS:
+                raise _TooManyRestarts()
+        progress['remaining'] = remaining
+
+    with closing(sqlite3.connect(database, timeout=30)) as source:
+        try:
+            with closing(sqlite3.connect(dest_path)) as dest:
+                source.backup(dest, pages=max(1, step_pages), progress=on_progress, sleep=step_sleep)
+        except _TooManyRestarts:
+            print(f"Backup restarted {progress['restarts']} times under write load; finishing in one step")
+            with closing(sqlite3.connect(dest_path)) as dest:
+                source.backup(dest, pages=-1)
+
+    with closing(sqlite3.connect(dest_path)) as dest:
+        result = dest.execute('PRAGMA integrity_check').fetchone()[0]
+        page_size = dest.execute('PRAGMA page_size').fetchone()[0]
+        page_count = dest.execute('PRAGMA page_count').fetchone()[0]
+    if result != 'ok':
+        raise BackupError(f'Snapshot failed integrity check: {result}')
+    return page_size, page_count
+
+
+def create_backup(database=DATABASE, backup_dir=BACKUP_DIR, incremental=False, skip_unchanged=False, extra=None):
+    """Take a full or incremental backup and return its manifest.
+
+    An incremental backup stores only the pages that differ from the most
+    recent backup; it falls back to a full backup when there is no usable base.
+    With skip_unchanged, an incremental backup that would hold no pages is not
+    written and None is returned. extra is added to the manifest.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    with open(os.path.join(backup_dir, '.backup.lock'), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupError('Another backup is already running')
+
+        backup_id = _new_backup_id()
+        snapshot_path = os.path.join(backup_dir, f'.{backup_id}.snapshot')
+        try:
+            page_size, page_count = snapshot_database(database, snapshot_path)
+            page_hashes = _page_hashes(snapshot_path, page_size)
+
+            base = list_backups(backup_dir)[-1] if incremental and list_backups(backup_dir) else None
+            if base is not None and (base['page_size'] != page_size or not base['page_hashes']):
+                base = None
+            base_hashes = None
+            if base is not None:
+                base_hashes_path = os.path.join(backup_dir, base['page_hashes'])
+                if os.path.exists(base_hashes_path):
+                    with open(base_hashes_path, 'rb') as f:
+                        base_hashes = f.read()
+
+            manifest = {
+                'id': backup_id,
+                'kind': 'incremental' if base_hashes is not None else 'full',
+                'base': base['id'] if base_hashes is not None else None,
+                'created_at': datetime.utcnow().isoformat(),
+                'page_size': page_size,
+                'page_count': page_count,
+                'db_sha256': _file_sha256(snapshot_path),
+                'page_hashes': f'{backup_id}.pages'
+            }
+
+            if manifest['kind'] == 'full':
+                manifest['file'] = f'{backup_id}.db.gz'
+
+                def write_full(f):
+                    with gzip.GzipFile(fileobj=f, mode='wb') as out, open(snapshot_path, 'rb') as src:
+                        shutil.copyfileobj(src, out, CHUNK_SIZE)
+                _fsync_write(os.path.join(backup_dir, manifest['file']), write_full)
+                manifest['changed_pages'] = page_count
+            else:
+                manifest['file'] = f'{backup_id}.pages.gz'
+                changed = [
+                    page_number for page_number in range(1, page_count + 1)
+                    if page_hashes[(page_number - 1) * PAGE_HASH_SIZE:page_number * PAGE_HASH_SIZE]
+                    != base_hashes[(page_number - 1) * PAGE_HASH_SIZE:page_number * PAGE_HASH_SIZE]
+                ]
+                if not changed and page_count == base['page_count'] and skip_unchanged:
+                    return None
+
+                def read_changed():
+                    with open(snapshot_path, 'rb') as src:
+                        for page_number in changed:
+                            src.seek((page_number - 1) * page_size)
+                            yield page_number, src.read(page_size)
+                _write_page_records(os.path.join(backup_dir, manifest['file']), read_changed())
+                manifest['changed_pages'] = len(changed)
+
+            _fsync_write(os.path.join(backup_dir, manifest['page_hashes']), lambda f: f.write(page_hashes))
+            manifest.update(extra or {})
+            return _finish_manifest(backup_dir, manifest)
+        finally:
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+
+
+def _finish_manifest(backup_dir, manifest):
+    manifest['file_sha256'] = _file_sha256(os.path.join(backup_dir, manifest['file']))
+    manifest['file_size'] = os.path.getsize(os.path.join(backup_dir, manifest['file']))
+    # The manifest is written last: a backup without one never happened
+    _fsync_write(_manifest_path(backup_dir, manifest['id']), lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+    return manifest
+
+
+def write_page_set(backup_dir, base_id, page_size, page_count, pages, extra=None):
+    """Store pages ({page_number: page}) as an incremental backup on top of base_id.
+
+    For callers that already know which pages changed (replication reads them
+    from the WAL). Such a backup has no page hashes and no database checksum:
+    it is verified by its file checksum only, and cannot be the base of an
+    incremental backup taken with create_backup.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    backup_id = _new_backup_id()
+    manifest = {
+        'id': backup_id,
+        'kind': 'incremental',
+        'base': base_id,
+        'created_at': datetime.utcnow().isoformat(),
+        'page_size': page_size,
+        'page_count': page_count,
+        'db_sha256': None,
+        'page_hashes': None,
+        'file': f'{backup_id}.pages.gz',
+        'changed_pages': len(pages)
+    }
+    _write_page_records(os.path.join(backup_dir, manifest['file']), sorted(pages.items()))
+    manifest.update(extra or {})
+    return _finish_manifest(backup_dir, manifest)
+
+
+def backup_chain(backup_dir, backup_id):
+    """Manifests needed to rebuild backup_id, starting with its full backup."""
+    chain = []
+    manifest = load_manifest(backup_dir, backup_id)
+    while True:
+        chain.append(manifest)
+        if manifest['kind'] == 'full':
+            return list(reversed(chain))
+        manifest = load_manifest(backup_dir, manifest['base'])
+
+
+def apply_backup(backup_dir, manifest, dest_path):
+    """Apply one backup to dest_path: write a full one, or patch the pages of an incremental
+    one onto its base. Verifies the file and the result against the manifest."""
+    file_path = os.path.join(backup_dir, manifest['file'])
+    if not os.path.exists(file_path):
+        raise BackupError(f"Backup file {manifest['file']} is missing")
+    if _file_sha256(file_path) != manifest['file_sha256']:
+        raise BackupError(f"Backup file {manifest['file']} is corrupt (checksum mismatch)")
+
+    if manifest['kind'] == 'full':
+        with gzip.open(file_path, 'rb') as src, open(dest_path, 'wb') as out:
+            shutil.copyfileobj(src, out, CHUNK_SIZE)
+    else:
+        page_size = manifest['page_size']
+        with gzip.open(file_path, 'rb') as src, open(dest_path, 'r+b') as out:
+            while True:
+                header = src.read(4)
+                if not header:
+                    break
+                page_number = struct.unpack('>I', header)[0]
+                out.seek((page_number - 1) * page_size)
+                out.write(src.read(page_size))
+            out.truncate(manifest['page_count'] * page_size)
+
+    if manifest['db_sha256'] is not None and _file_sha256(dest_path) != manifest['db_sha256']:
+        raise BackupError(f"Rebuilt database for {manifest['id']} does not match its checksum")
+
+
+def rebuild_snapshot(backup_dir, backup_id, dest_path):
+    """Rebuild the database of backup_id into dest_path, verifying every step."""
+    for manifest in backup_chain(backup_dir, backup_id):
+        apply_backup(backup_dir, manifest, dest_path)
+
+    with closing(sqlite3.connect(dest_path)) as conn:
+        result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    if result != 'ok':
+        raise BackupError(f'Rebuilt database failed integrity check: {result}')
+
+
+def verify_backup(backup_dir, backup_id):
+    """Rebuild backup_id in a temporary file and check it. Raises BackupError on failure."""
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp_dir:
+        rebuild_snapshot(backup_dir, backup_id, os.path.join(tmp_dir, 'verify.db'))
+
+
+def restore_backup(backup_id, database=DATABASE, backup_dir=BACKUP_DIR):
+    """Replace database with backup_id after verifying it. The service must be stopped.
+
+    The current database is kept next to it as <database>.pre-restore-<timestamp>.
+    Returns that path (or None if there was no database).
+    """
+    restore_path = database + '.restore'
+    rebuild_snapshot(backup_dir, backup_id, restore_path)
+    with open(restore_path, 'rb') as f:
+        os.fsync(f.fileno())
+
+    previous_path = None
+    if os.path.exists(database):
+        # Fold the WAL into the old file so the kept copy is complete on its own
+        with closing(sqlite3.connect(database)) as conn:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        previous_path = f"{database}.pre-restore-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
+        os.replace(database, previous_path)
+
+    # A leftover WAL would be replayed on top of the restored file and corrupt it
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    os.replace(restore_path, database)
+    return previous_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Back up and restore the keystore database.')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--dir', default=BACKUP_DIR, help='Backup directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = commands.add_parser('backup', help='Take a hot backup of the running database')
+    backup_parser.add_argument('--incremental', action='store_true', help='Store only pages changed since the last backup')
+    commands.add_parser('list', help='List backups')
+    verify_parser = commands.add_parser('verify', help='Rebuild a backup in a temp file and check it')
+    verify_parser.add_argument('backup_id')
+    restore_parser = commands.add_parser('restore', help='Restore a backup (stop the service first)')
+    restore_parser.add_argument('backup_id')
+    restore_parser.add_argument('--yes', action='store_true', help='Do not ask for confirmation')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'backup':
+            manifest = create_backup(args.database, args.dir, incremental=args.incremental)
+            print(f"✅ {manifest['kind'].capitalize()} backup {manifest['id']}: "
+                  f"{manifest['changed_pages']} of {manifest['page_count']} pages, {manifest['file_size']} bytes")
+            print(manifest['id'])
+        elif args.command == 'list':
+            for manifest in list_backups(args.dir):
+                print(f"{manifest['id']}  {manifest['kind']:<11}  {manifest['file_size']:>12} bytes  base={manifest['base']}")
+        elif args.command == 'verify':
+            verify_backup(args.dir, args.backup_id)
+            print(f"✅ Backup {args.backup_id} verified")
+        elif args.command == 'restore':
+            if not args.yes:
+                reply = input(f"Replace {args.database} with backup {args.backup_id}? The service must be stopped. (y/N): ")
+                if reply.strip().lower() != 'y':
+                    print("Restore cancelled.")
+                    return 1
+            previous_path = restore_backup(args.backup_id, args.database, args.dir)
+            print(f"✅ Restored {args.backup_id} to {args.database}")
+            if previous_path:
+                print(f"    Previous database kept at {previous_path}")
+    except BackupError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
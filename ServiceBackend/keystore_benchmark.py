@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Load-test and benchmark harness for the API Key Management Service.
+
+Starts the service (gunicorn by default) against a temporary database,
+seeds users, keys and access log rows, then drives a weighted mix of
+requests at one or more fixed concurrency levels. Reports throughput and
+p50/p95/p99 latency per operation and saves the results as JSON so runs
+can be compared.
+
+Usage:
+    python keystore_benchmark.py                                   # defaults
+    python keystore_benchmark.py --concurrency 1,8,32 --duration 30
+    python keystore_benchmark.py --mix get_key=70,list_keys=20,add_key=10
+    python keystore_benchmark.py --compare benchmarks/baseline.json --fail-on-regression 15
+
+Only the standard library is needed besides the service's own requirements.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import sqlite3
+import argparse
+import tempfile
+import platform
+import threading
+import subprocess
+import http.client
+import urllib.parse
+from datetime import datetime, timedelta
+
+from cryptography.fernet import Fernet
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MIX = 'login=2,list_keys=25,get_key=55,add_key=10,logs=8'
+OPERATIONS = ('login', 'list_keys', 'get_key', 'add_key', 'logs')
+BENCH_PASSWORD = 'bench-password-123'
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation '{name}' in --mix (choose from {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Client:
+    """One keep-alive HTTP connection, used by a single thread."""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def request(self, method, path, body=None, token=None, content_type='application/json'):
+        headers = {}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        if body is not None:
+            headers['Content-Type'] = content_type
+            if not isinstance(body, (bytes, str)):
+                body = json.dumps(body)
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # Reconnect once: the server may have recycled the worker or closed keep-alive
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        return response.status, data
+
+    def close(self):
+        self.conn.close()
+
+
+class ServiceProcess:
+    """Runs the service against a temporary database."""
+
+    def __init__(self, args):
+        self.args = args
+        self.tmp_dir = tempfile.mkdtemp(prefix='keystore-bench-')
+        self.database = os.path.join(self.tmp_dir, 'keystore.db')
+        self.port = args.port or free_port()
+        self.process = None
+        self.log_path = os.path.join(self.tmp_dir, 'service.log')
+
+    def start(self):
+        env = dict(os.environ)
+        env.update({
+            'DATABASE': self.database,
+            'SECRET_KEY': 'bench-' + 'x' * 40,
+            'ENCRYPTION_KEY': Fernet.generate_key().decode(),
+            'AUDIT_RETENTION_DAYS': '0',  # Seeded log rows are backdated; keep them
+            'METRICS_DIR': os.path.join(self.tmp_dir, 'metrics'),
+            'SLOW_REQUEST_MS': '0',
+            'BACKUP_DIR': os.path.join(self.tmp_dir, 'backups'),
+            'KEYSTORE_BIND': f'127.0.0.1:{self.port}',
+            'KEYSTORE_ACCESS_LOG': os.devnull,
+            'RATE_LIMIT_ENABLED': '0',  # Measure capacity (also the service default); pass --env RATE_LIMIT_ENABLED=1 to include admission control
+        })
+        env.update(dict(item.split('=', 1) for item in self.args.env))
+        if self.args.workers:
+            env['KEYSTORE_WORKERS'] = str(self.args.workers)
+
+        if self.args.server == 'gunicorn':
+            # gunicorn.conf.py selects the app (--env KEYSTORE_MODE=asgi for the asyncio mode)
+            command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py']
+        else:
+            # Flask's threaded development server (single process)
+            command = [sys.executable, '-c',
+                       'import enhanced_keystore_service as s; s.init_db(); '
+                       f's.app.run(host="127.0.0.1", port={self.port}, threaded=True)']
+        self.log_file = open(self.log_path, 'w')
+        self.process = subprocess.Popen(command, cwd=SERVICE_DIR, env=env, stdout=self.log_file, stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise SystemExit(f"Service exited during startup, see {self.log_path}")
+            try:
+                status, _ = Client(self.port).request('GET', '/health')
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise SystemExit(f"Service did not become healthy, see {self.log_path}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.process is not None:
+            self.log_file.close()
+        if not self.args.keep:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def seed(service, args):
+    """Create bench users, their keys (bulk import) and backdated log rows. Returns the user list."""
+    client = Client(service.port)
+    status, data = client.request('POST', '/auth/login', {'username': 'admin', 'password': 'admin123'})
+    if status != 200:
+        raise SystemExit(f"Admin login failed: {status} {data[:200]}")
+    admin_token = json.loads(data)['token']
+
+    users = [{'username': 'admin', 'password': 'admin123', 'role': 'admin'}]
+    for i in range(args.users):
+        username = f'bench-user-{i}'
+        status, data = client.request('POST', '/users', {'username': username, 'password': BENCH_PASSWORD, 'role': 'user'}, admin_token)
+        if status not in (200, 201):
+            raise SystemExit(f"Creating {username} failed: {status} {data[:200]}")
+        users.append({'username': username, 'password': BENCH_PASSWORD, 'role': 'user'})
+
+    # Log rows are attributed by id, which does not follow the order of `users` (the default 'user' account exists too)
+    ids = {}
+    cursor = None
+    while True:
+        path = '/users?fields=id,username&sort=name&limit=1000'
+        if cursor:
+            path += f'&cursor={urllib.parse.quote(cursor)}'
+        status, data = client.request('GET', path, token=admin_token)
+        if status != 200:
+            raise SystemExit(f"Listing users failed: {status} {data[:200]}")
+        page = json.loads(data)
+        ids.update((entry['username'], entry['id']) for entry in page['users'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    for user in users:
+        user['id'] = ids[user['username']]
+
+    for user in users:
+        status, data = client.request('POST', '/auth/login', {'username': user['username'], 'password': user['password']})
+        user['token'] = json.loads(data)['token']
+        user['keys'] = []
+
+    # Spread the keys over all users, one bulk import per user
+    for index, user in enumerate(users):
+        names = [f'{user["username"]}-key-{n}' for n in range(index, args.keys, len(users))]
+        if not names:
+            continue
+        body = '\n'.join(json.dumps({'key_name': name, 'api_key': f'sk-bench-{name}', 'description': 'benchmark key'}) for name in names)
+        status, data = client.request('POST', '/keys:import', body, user['token'], content_type='application/x-ndjson')
+        if status != 200:
+            raise SystemExit(f"Key import failed: {status} {data[:200]}")
+        user['keys'] = names
+    client.close()
+
+    if args.logs:
+        rng = random.Random(args.seed)
+        start = datetime.utcnow() - timedelta(days=30)
+        actions = ('view_key', 'list_keys', 'login_success', 'update_key', 'login_failed')
+        with sqlite3.connect(service.database, timeout=30) as conn:
+            rows = []
+            for i in range(args.logs):
+                user = users[i % len(users)]
+                action = rng.choice(actions)
+                rows.append((user['id'], user['username'], rng.choice(user['keys']) if user['keys'] else None,
+                             action, (start + timedelta(seconds=i * 2592000 / args.logs)).strftime('%Y-%m-%d %H:%M:%S'),
+                             f'10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}', 'keystore-benchmark', action != 'login_failed'))
+                if len(rows) == 10000:
+                    conn.executemany('INSERT INTO access_log (user_id, user_name, key_name, action, timestamp, ip_address, user_agent, success) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                    rows = []
+            conn.executemany('INSERT INTO access_log (user_id, user_name, key_name, action, timestamp, ip_address, user_agent, success) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    return users
+
+
+def run_level(service, users, mix, concurrency, duration, warmup, seed_value):
+    """Drive the mix with `concurrency` closed-loop clients. Returns per-operation samples."""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: {'latencies': [], 'errors': 0, 'statuses': {}} for name in names}
+    lock = threading.Lock()
+    start_at = time.monotonic() + warmup
+    stop_at = start_at + duration
+    counter = [0]
+
+    def worker(worker_id):
+        rng = random.Random(f'{seed_value}-{concurrency}-{worker_id}')
+        client = Client(service.port)
+        user = users[worker_id % len(users)]
+        local = {name: ([], 0, {}) for name in names}
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= stop_at:
+                    break
+                op = rng.choices(names, weights)[0]
+                if op == 'login':
+                    args = ('POST', '/auth/login', {'username': user['username'], 'password': user['password']}, None)
+                elif op == 'list_keys':
+                    args = ('GET', '/keys', None, user['token'])
+                elif op == 'get_key':
+                    key_name = rng.choice(user['keys']) if user['keys'] else 'missing'
+                    args = ('GET', f'/keys/{key_name}', None, user['token'])
+                elif op == 'add_key':
+                    with lock:
+                        counter[0] += 1
+                        n = counter[0]
+                    args = ('POST', '/keys', {'key_name': f'bench-new-{concurrency}-{worker_id}-{n}', 'api_key': 'sk-new', 'description': 'benchmark'}, user['token'])
+                else:
+                    args = ('GET', '/logs', None, user['token'])
+
+                started = time.perf_counter()
+                try:
+                    status, _ = client.request(*args)
+                except OSError:
+                    status = 0
+                elapsed = time.perf_counter() - started
+                if now < start_at:
+                    continue  # Warmup
+                latencies, errors, statuses = local[op]
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 0 or status >= 400:
+                    local[op] = (latencies, errors + 1, statuses)
+        finally:
+            client.close()
+            with lock:
+                for name, (latencies, errors, statuses) in local.items():
+                    results[name]['latencies'].extend(latencies)
+                    results[name]['errors'] += errors
+                    for status, count in statuses.items():
+                        results[name]['statuses'][str(status)] = results[name]['statuses'].get(str(status), 0) + count
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(latencies, errors, duration):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / duration, 2),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVICE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_level(level):
+    print(f"\nConcurrency {level['concurrency']}:")
+    print(f"  {'operation':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in list(level['operations'].items()) + [('ALL', level['overall'])]:
+        print(f"  {name:<10} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>9} "
+              f"{stats['p50_ms'] or '-':>9} {stats['p95_ms'] or '-':>9} {stats['p99_ms'] or '-':>9}")
+
+
+def compare(result, baseline_path, threshold):
+    """Print throughput/p95 changes against a baseline. Returns True if any exceeds threshold percent."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    baseline_levels = {level['concurrency']: level for level in baseline['levels']}
+    regressed = False
+    print(f"\nCompared with {baseline_path} ({baseline.get('git_revision')}, {baseline.get('started_at')}):")
+    for level in result['levels']:
+        base = baseline_levels.get(level['concurrency'])
+        if base is None:
+            continue
+        for name, stats in [('ALL', level['overall'])] + list(level['operations'].items()):
+            base_stats = base['overall'] if name == 'ALL' else base['operations'].get(name)
+            if not base_stats or not base_stats['p95_ms'] or not stats['p95_ms'] or not base_stats['throughput_rps']:
+                continue
+            p95_change = (stats['p95_ms'] - base_stats['p95_ms']) / base_stats['p95_ms'] * 100
+            rps_change = (stats['throughput_rps'] - base_stats['throughput_rps']) / base_stats['throughput_rps'] * 100
+            flag = ''
+            if threshold is not None and (p95_change > threshold or rps_change < -threshold):
+                flag = '  <-- regression'
+                regressed = True
+            print(f"  c={level['concurrency']:<4} {name:<10} p95 {p95_change:+7.1f}%   throughput {rps_change:+7.1f}%{flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the keystore service.')
+    parser.add_argument('--server', choices=('gunicorn', 'flask'), default='gunicorn')
+    parser.add_argument('--workers', type=int, help='gunicorn worker processes (KEYSTORE_WORKERS)')
+    parser.add_argument('--port', type=int, help='Port to listen on (default: a free port)')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help='Extra service environment, e.g. AUDIT_LOG_MODE=group')
+    parser.add_argument('--users', type=int, default=10, help='Regular users to create (default 10)')
+    parser.add_argument('--keys', type=int, default=1000, help='Keys to create, spread over all users (default 1000)')
+    parser.add_argument('--logs', type=int, default=100000, help='Access log rows to seed (default 100000)')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated client concurrency levels (default 1,8,32)')
+    parser.add_argument('--duration', type=float, default=20, help='Measured seconds per level (default 20)')
+    parser.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds before each level (default 3)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Operation weights (default {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for data and request choice')
+    parser.add_argument('--output', help='Result file (default benchmarks/bench-<timestamp>.json)')
+    parser.add_argument('--compare', help='Baseline result file to compare against')
+    parser.add_argument('--fail-on-regression', type=float, metavar='PERCENT',
+                        help='Exit with status 1 if p95 grows or throughput drops by more than PERCENT')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary database and service log')
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    started_at = datetime.utcnow()
+
+    service = ServiceProcess(args)
+    try:
+        print(f"Starting {args.server} on port {service.port} (database {service.database})...")
+        service.start()
+        print(f"Seeding {args.users} users, {args.keys} keys, {args.logs} log rows...")
+        seed_start = time.monotonic()
+        users = seed(service, args)
+        print(f"Seeded in {time.monotonic() - seed_start:.1f}s")
+
+        result_levels = []
+        for concurrency in levels:
+            print(f"Running {concurrency} concurrent clients for {args.duration}s (+{args.warmup}s warmup)...")
+            samples = run_level(service, users, mix, concurrency, args.duration, args.warmup, args.seed)
+            level = {
+                'concurrency': concurrency,
+                'operations': {name: summarize(data['latencies'], data['errors'], args.duration) for name, data in samples.items()},
+                'statuses': {name: data['statuses'] for name, data in samples.items()},
+                'overall': summarize([v for data in samples.values() for v in data['latencies']],
+                                     sum(data['errors'] for data in samples.values()), args.duration)
+            }
+            result_levels.append(level)
+            print_level(level)
+    finally:
+        service.stop()
+
+    result = {
+        'started_at': started_at.isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'sqlite': sqlite3.sqlite_version,
+        'parameters': {
+            'server': args.server, 'workers': args.workers, 'env': args.env, 'users': args.users,
+            'keys': args.keys, 'logs': args.logs, 'duration': args.duration, 'warmup': args.warmup,
+            'mix': mix, 'seed': args.seed
+        },
+        'levels': result_levels
+    }
+
+    output = args.output or os.path.join('benchmarks', f"bench-{started_at.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare and compare(result, args.compare, args.fail_on_regression):
+        print("❌ Performance regression detected")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Minimal Prometheus metrics registry for the API Key Management Service.
+
+Counters, gauges and histograms with labels, rendered in the Prometheus
+text exposition format. Recording a sample is a dict update under a lock,
+cheap enough to leave on in production.
+
+With gunicorn, every worker process keeps its own registry. When a
+snapshot directory is configured, each worker periodically writes its
+values to <dir>/<pid>.json and a scrape served by any worker merges all of
+them. Counters and histograms of workers that have exited are folded into
+dead.json so totals never go backwards; gauges only count live workers.
+"""
+
+import os
+import json
+import time
+import fcntl
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """One metric family. Label values are passed positionally in labelnames order."""
+
+    def __init__(self, registry, name, kind, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if kind == 'histogram' else ()
+        self.values = {}  # labels tuple -> number, or [bucket counts..., sum, count] for histograms
+
+    def inc(self, *labels, amount=1):
+        with self.registry.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self.registry.lock:
+            self.values[labels] = value
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.registry.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+
+class MetricsRegistry:
+    """Holds the metrics of one process and renders the merged view of all workers."""
+
+    def __init__(self, snapshot_dir=None, snapshot_interval=5):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.before_collect = []  # callables that refresh gauges just before a snapshot or scrape
+        self.scrape_collectors = []  # callables returning extra (metric, value) pairs computed at scrape time
+        self._thread = None
+        self._pid = os.getpid()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Metric(self, name, 'counter', documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Metric(self, name, 'gauge', documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Metric(self, name, 'histogram', documentation, labelnames, buckets))
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    # --- Multi-process snapshots ---
+
+    def ensure_started(self):
+        """Start the snapshot thread in this process (after a fork, in the new worker)."""
+        if not self.snapshot_dir:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            # Values inherited from the parent belong to the parent's snapshot
+            if self._pid != os.getpid():
+                for metric in self.metrics.values():
+                    metric.values.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='metrics-snapshot', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                print(f"Error writing metrics snapshot: {e}")
+
+    def snapshot(self):
+        for refresh in self.before_collect:
+            refresh()
+        with self.lock:
+            return {
+                name: {json.dumps(list(labels)): (list(value) if isinstance(value, list) else value)
+                       for labels, value in metric.values.items()}
+                for name, metric in self.metrics.items()
+            }
+
+    def reset_snapshots(self):
+        """Remove snapshots left by a previous run (call once before workers start)."""
+        if not self.snapshot_dir or not os.path.isdir(self.snapshot_dir):
+            return
+        for name in os.listdir(self.snapshot_dir):
+            if name.endswith('.json') or name.endswith('.tmp'):
+                os.remove(os.path.join(self.snapshot_dir, name))
+
+    def write_snapshot(self):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = os.path.join(self.snapshot_dir, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def _merge(self, total, snapshot, include_gauges):
+        for name, values in snapshot.items():
+            metric = self.metrics.get(name)
+            if metric is None or (metric.kind == 'gauge' and not include_gauges):
+                continue
+            merged = total.setdefault(name, {})
+            for labels, value in values.items():
+                if isinstance(value, list):
+                    current = merged.get(labels)
+                    merged[labels] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    merged[labels] = merged.get(labels, 0) + value
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def collect(self):
+        """Merged values of every worker: {name: {labels json: value}}."""
+        total = {}
+        self._merge(total, self.snapshot(), include_gauges=True)
+        if not self.snapshot_dir or not os.path.isdir(self.snapshot_dir):
+            return total
+
+        with open(os.path.join(self.snapshot_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            dead_path = os.path.join(self.snapshot_dir, 'dead.json')
+            dead = self._load(dead_path)
+            dead_changed = False
+            for name in os.listdir(self.snapshot_dir):
+                if not name.endswith('.json') or name == 'dead.json':
+                    continue
+                try:
+                    pid = int(name[:-len('.json')])
+                except ValueError:
+                    continue
+                if pid == os.getpid():
+                    continue
+                path = os.path.join(self.snapshot_dir, name)
+                try:
+                    os.kill(pid, 0)
+                    alive = True
+                except ProcessLookupError:
+                    alive = False
+                except PermissionError:
+                    alive = True
+                if alive:
+                    self._merge(total, self._load(path), include_gauges=True)
+                else:
+                    # Keep the counts of exited workers so totals stay monotonic
+                    self._merge(dead, self._load(path), include_gauges=False)
+                    os.remove(path)
+                    dead_changed = True
+            if dead_changed:
+                with open(dead_path + '.tmp', 'w') as f:
+                    json.dump(dead, f)
+                os.replace(dead_path + '.tmp', dead_path)
+            self._merge(total, dead, include_gauges=False)
+        return total
+
+    # --- Exposition ---
+
+    def render(self):
+        """Prometheus text exposition of all metrics."""
+        values = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for labels_json, value in sorted(values.get(name, {}).items()):
+                labels = json.loads(labels_json)
+                if metric.kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(metric.labelnames, labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-2]):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f'{name}_bucket{_format_labels(metric.labelnames, labels, le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(metric.labelnames, labels)} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(metric.labelnames, labels)} {value[-1]}')
+        for collector in self.scrape_collectors:
+            for name, kind, documentation, value in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
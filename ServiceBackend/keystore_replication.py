@@ -0,0 +1,514 @@
+"""
+File-based replication of the keystore database to read-only followers.
+
+The primary publishes its database into a shared directory as a stream of
+keystore_backup snapshots: a full backup followed by incremental page sets.
+The page sets are read straight from the database's WAL, so a publish costs
+in proportion to what was written since the previous one, not to the size
+of the database. A full snapshot is taken when the stream starts and every
+full_every page sets after that, for followers that join late or fall
+behind. A heartbeat file (primary.json) names the newest snapshot and
+records when the primary last confirmed that it was still current.
+
+A follower keeps two copies of the database and points DATABASE (a
+symlink) at the current one. New page sets are patched onto the other copy,
+which then becomes current. A copy is only patched while no connection has
+it open (see open_replica), so followers open it immutable.
+
+Followers cannot write to their copy: the access_log rows they produce are
+appended to per-process NDJSON files in <dir>/inbox, which the primary
+imports into its own access_log.
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import socket
+import struct
+import sqlite3
+from datetime import datetime
+
+import keystore_backup
+
+HEARTBEAT_FILE = 'primary.json'
+INBOX_DIR = 'inbox'
+
+# Full snapshots older than this many chains are deleted; the previous chain is
+# kept so a follower that is still applying it is not cut off
+KEEP_CHAINS = 2
+
+# SQLite WAL file format (https://www.sqlite.org/fileformat2.html#walformat)
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+WAL_MAGIC = 0x377f0682  # The low bit is set when checksums are big-endian
+
+# The publisher reads new WAL frames while writers carry on, up to this many
+# passes, until a pass finds at most WAL_BLOCKING_FRAMES; the rest is read with
+# writers blocked
+WAL_CATCH_UP_PASSES = 5
+WAL_BLOCKING_FRAMES = 256
+
+# The two copies a follower alternates between
+REPLICA_COPIES = ('replica-a', 'replica-b')
+
+# ioctl that makes a file share another's extents (Linux: btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+class ReplicationError(Exception):
+    pass
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+def read_json(path):
+    """Contents of a JSON file, or None if it does not exist."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_json(path, data):
+    """Replace path atomically, so readers on other hosts never see a partial file."""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_heartbeat(replication_dir):
+    return read_json(os.path.join(replication_dir, HEARTBEAT_FILE))
+
+
+# --- Primary ---
+
+def _wal_checksum(data, s0, s1, big_endian):
+    words = struct.unpack(f"{'>' if big_endian else '<'}{len(data) // 4}I", data)
+    for i in range(0, len(words), 2):
+        s0 = (s0 + words[i] + s1) & 0xFFFFFFFF
+        s1 = (s1 + words[i + 1] + s0) & 0xFFFFFFFF
+    return s0, s1
+
+
+def read_wal(wal_path, position=None, collect=True):
+    """Pages committed to a WAL after position.
+
+    position is None (read from the first frame) or one returned by an
+    earlier call. When the WAL was restarted since then (its salt changed),
+    reading starts over at the first frame of the new log. Frames after the
+    last commit are left for the next call. With collect=False only the
+    position is returned.
+
+    Returns (position, pages, page_count): pages maps page number to its
+    newest committed content, page_count is the database size after the last
+    commit read (None if there was none).
+    """
+    # Where an empty log leaves off: whatever is written next starts a new one
+    empty = {'salt': None, 'page_size': None, 'frame': 0, 'checksum': None}
+    try:
+        f = open(wal_path, 'rb')
+    except FileNotFoundError:
+        return empty, {}, None
+    with f:
+        header = f.read(WAL_HEADER_SIZE)
+        if len(header) < WAL_HEADER_SIZE:
+            return empty, {}, None
+        magic, _, page_size, _, salt1, salt2, check1, check2 = struct.unpack('>8I', header)
+        if magic & ~1 != WAL_MAGIC:
+            raise ReplicationError(f'{wal_path} is not a SQLite WAL')
+        big_endian = bool(magic & 1)
+        if _wal_checksum(header[:24], 0, 0, big_endian) != (check1, check2):
+            raise ReplicationError(f'{wal_path} has a damaged header')
+
+        if position is not None and position['salt'] == [salt1, salt2] and position['page_size'] == page_size:
+            frame, checksum = position['frame'], tuple(position['checksum'])
+        else:
+            frame, checksum = 0, (check1, check2)
+        committed = {'salt': [salt1, salt2], 'page_size': page_size, 'frame': frame, 'checksum': list(checksum)}
+
+        pages, pending, page_count = {}, {}, None
+        frame_size = WAL_FRAME_HEADER_SIZE + page_size
+        # Frames appended while this runs are left for the next call
+        last_frame = (os.fstat(f.fileno()).st_size - WAL_HEADER_SIZE) // frame_size
+        f.seek(WAL_HEADER_SIZE + frame * frame_size)
+        while frame < last_frame:
+            frame_header = f.read(WAL_FRAME_HEADER_SIZE)
+            page = f.read(page_size)
+            if len(frame_header) < WAL_FRAME_HEADER_SIZE or len(page) < page_size:
+                break
+            page_number, commit_size, frame_salt1, frame_salt2, check1, check2 = struct.unpack('>6I', frame_header)
+            if (frame_salt1, frame_salt2) != (salt1, salt2):
+                break  # Left over from before the log was restarted
+            checksum = _wal_checksum(frame_header[:8] + page, *checksum, big_endian)
+            if checksum != (check1, check2):
+                break  # Not completely written yet
+            frame += 1
+            if collect:
+                pending[page_number] = page
+            if commit_size:
+                pages.update(pending)
+                pending = {}
+                page_count = commit_size
+                committed.update(frame=frame, checksum=list(checksum))
+    return committed, pages, page_count
+
+
+def prune_chains(replication_dir, keep=KEEP_CHAINS):
+    """Delete snapshots that belong to chains older than the newest `keep` ones."""
+    manifests = keystore_backup.list_backups(replication_dir)
+    full_ids = [manifest['id'] for manifest in manifests if manifest['kind'] == 'full']
+    if len(full_ids) <= keep:
+        return 0
+    cutoff = full_ids[-keep]
+    removed = 0
+    for manifest in manifests:
+        if manifest['id'] >= cutoff:
+            break
+        # The manifest goes first: a snapshot without one no longer exists
+        for name in (f"{manifest['id']}.json", manifest['file'], manifest['page_hashes']):
+            if name is None:
+                continue
+            try:
+                os.remove(os.path.join(replication_dir, name))
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
+
+
+class Publisher:
+    """Publishes a WAL-mode database to replication_dir, reading changed pages from its WAL.
+
+    SQLite copies WAL frames into the database file and then restarts the
+    log (a checkpoint). Frames must be published before that happens, so the
+    publisher keeps a read transaction open (the pin) at the position it has
+    published up to: checkpoints stop there and the log cannot restart past
+    it. To move the pin, writers are blocked for as long as it takes to read
+    the new frames and checkpoint.
+
+    self.conn is for the caller too: its own commits (such as imported
+    follower audit rows) do not count as changes. They are published with
+    the next change made through any other connection, or when forced.
+    """
+
+    def __init__(self, database, replication_dir, full_every, timeout=30):
+        self.database = database
+        self.replication_dir = replication_dir
+        self.full_every = max(1, full_every)
+        self.wal_path = database + '-wal'
+        self.conn = sqlite3.connect(database, timeout=timeout)
+        self._pin = sqlite3.connect(database, timeout=timeout)
+        if self.conn.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+            raise ReplicationError(f'{database} is not in WAL mode')
+        self.position = None  # WAL position published up to; None until a full snapshot is published
+        self.version = None
+
+    def close(self):
+        self.conn.close()
+        self._pin.close()
+
+    def _read_new_frames(self, checkpoint, collect=True):
+        """Read what was committed after self.position and move the pin past it, with writers blocked.
+
+        Returns what read_wal returns. self.position is None afterwards: the
+        caller sets it once everything read has been published.
+        """
+        # Most of the new frames are read while writers carry on: the pin stops
+        # the log from restarting, and a frame still being written fails its checksum
+        position, pages, page_count = self.position, {}, None
+        for _ in range(WAL_CATCH_UP_PASSES):
+            start = position
+            position, new_pages, new_page_count = read_wal(self.wal_path, position, collect)
+            pages.update(new_pages)
+            page_count = new_page_count or page_count
+            if start is not None and position['salt'] == start['salt'] \
+                    and position['frame'] - start['frame'] <= WAL_BLOCKING_FRAMES:
+                break
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            position, tail_pages, tail_page_count = read_wal(self.wal_path, position, collect)
+            pages.update(tail_pages)
+            page_count = tail_page_count or page_count
+            # From here on the frames just read can leave the WAL; until they
+            # are published, only a full snapshot is safe
+            self.position = None
+            if self._pin.in_transaction:
+                self._pin.commit()
+            if checkpoint:
+                self._pin.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            self._pin.execute('BEGIN')
+            self._pin.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        finally:
+            self.conn.rollback()
+        return position, pages, page_count
+
+    def _publish_full(self, heartbeat):
+        # A chain that follows the previous snapshot lets followers that have it carry on patching
+        follows = heartbeat.get('latest') if self.position is not None else None
+        position, _, _ = self._read_new_frames(checkpoint=False, collect=False)
+        # Taken after the pin moved: it holds everything up to position and maybe
+        # some frames after it, which the next page set writes again
+        manifest = keystore_backup.create_backup(self.database, self.replication_dir, extra={'follows': follows})
+        self.position = position
+        heartbeat['chain_length'] = 1
+        return manifest
+
+    def _publish_changes(self, heartbeat):
+        position, pages, page_count = self._read_new_frames(checkpoint=True)
+        manifest = None
+        if page_count is not None:
+            pages = {number: page for number, page in pages.items() if number <= page_count}
+            manifest = keystore_backup.write_page_set(
+                self.replication_dir, heartbeat['latest'], position['page_size'], page_count, pages)
+            heartbeat['chain_length'] = heartbeat.get('chain_length', 0) + 1
+        self.position = position
+        return manifest
+
+    def publish(self, checked_at=None, force=False):
+        """Publish what was committed since the last publish, then refresh the heartbeat.
+
+        The first publish is a full snapshot. checked_at is when the caller
+        last saw the database unchanged before this call (defaults to now);
+        followers measure their lag from it. force also publishes changes
+        made only through self.conn. Returns the newest snapshot's manifest,
+        or None.
+        """
+        os.makedirs(self.replication_dir, exist_ok=True)
+        checked_at = checked_at or _now()
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        heartbeat = read_heartbeat(self.replication_dir) or {}
+        published = []
+        if self.position is None or not heartbeat.get('latest'):
+            published.append(self._publish_full(heartbeat))
+        elif version != self.version or force:
+            manifest = self._publish_changes(heartbeat)
+            if manifest is not None:
+                heartbeat['latest'] = manifest['id']
+                published.append(manifest)
+                if heartbeat['chain_length'] >= self.full_every:
+                    published.append(self._publish_full(heartbeat))
+        self.version = version
+        for manifest in published:
+            heartbeat['latest'] = manifest['id']
+            heartbeat['latest_as_of'] = checked_at
+        heartbeat['checked_at'] = checked_at
+        write_json(os.path.join(self.replication_dir, HEARTBEAT_FILE), heartbeat)
+        if published and published[-1]['kind'] == 'full':
+            prune_chains(self.replication_dir)
+        return published[-1] if published else None
+
+
+def import_inbox(replication_dir, conn, insert_sql):
+    """Insert the access_log rows followers left in the inbox, then delete their files.
+
+    insert_sql takes (timestamp, user_id, user_name, key_name, action,
+    ip_address, user_agent, success). Each file is locked while it is read so
+    a follower never appends to a file that is about to be removed. Rows of a
+    file imported just before a crash may be imported twice.
+    """
+    inbox = os.path.join(replication_dir, INBOX_DIR)
+    if not os.path.isdir(inbox):
+        return 0
+    imported = 0
+    for name in sorted(os.listdir(inbox)):
+        if not name.endswith('.ndjson'):
+            continue
+        path = os.path.join(inbox, name)
+        try:
+            f = open(path)
+        except FileNotFoundError:
+            continue
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            rows = []
+            for line in f:
+                try:
+                    rows.append(tuple(json.loads(line)))
+                except ValueError:
+                    # A follower that died mid-write can leave a torn last line
+                    print(f"Skipping unreadable audit row in {name}")
+            if rows:
+                conn.executemany(insert_sql, rows)
+                conn.commit()
+            os.remove(path)
+        imported += len(rows)
+    return imported
+
+
+# --- Follower ---
+
+def append_inbox(replication_dir, rows):
+    """Append access_log rows, as (timestamp, ...) lists, to this process's inbox file."""
+    inbox = os.path.join(replication_dir, INBOX_DIR)
+    path = os.path.join(inbox, f'{socket.gethostname()}-{os.getpid()}.ndjson')
+    data = ''.join(json.dumps(row) + '\n' for row in rows)
+    os.makedirs(inbox, exist_ok=True)
+    while True:
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_nlink == 0:
+                continue  # Imported and removed by the primary while we waited for the lock
+            f.write(data)
+            return
+
+
+def follower_state_path(database):
+    return database + '.replica.json'
+
+
+def read_follower_state(database):
+    """The snapshot installed as database: {'applied', 'as_of', 'installed_at', 'copy', 'copies'}, or None.
+
+    copy is the copy database points to; copies maps each copy to the snapshot it holds.
+    """
+    return read_json(follower_state_path(database))
+
+
+def open_replica(database):
+    """Open the copy database points to and share-lock it. Returns (path, file).
+
+    The installer only patches a copy that nobody holds this lock on: keep
+    the file open for as long as the copy is read.
+    """
+    while True:
+        path = os.path.realpath(database)
+        f = open(path, 'rb')
+        fcntl.flock(f, fcntl.LOCK_SH)
+        # The copy may have been retired and patched while we waited for the lock
+        if os.path.realpath(database) == path:
+            return path, f
+        f.close()
+
+
+def _steps_since(replication_dir, latest_id, applied_id):
+    """How to bring a copy of applied_id (or None) to latest_id.
+
+    Returns (full, steps): the page sets to apply in order, after the full
+    snapshot to rebuild from, or with full None if the copy can be patched.
+    """
+    steps, full, full_steps = [], None, 0
+    manifest_id = latest_id
+    while manifest_id is not None:
+        if manifest_id == applied_id:
+            return None, list(reversed(steps))
+        try:
+            manifest = keystore_backup.load_manifest(replication_dir, manifest_id)
+        except keystore_backup.BackupError:
+            break  # Pruned: applied_id is too old to patch
+        if manifest['kind'] == 'full':
+            if full is None:
+                full, full_steps = manifest, len(steps)
+            manifest_id = manifest.get('follows')
+        else:
+            steps.append(manifest)
+            manifest_id = manifest['base']
+    if full is None:
+        raise ReplicationError(f'No full snapshot leads to {latest_id}')
+    return full, list(reversed(steps[:full_steps]))
+
+
+def _clone(source_path, dest_path):
+    """Copy a file, sharing its extents instead where the filesystem supports it."""
+    with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+        try:
+            fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+        except OSError:
+            shutil.copyfileobj(source, dest, keystore_backup.CHUNK_SIZE)
+
+
+def _build_copy(replication_dir, path, version, latest_id, current_path, current_version):
+    """Bring the copy at path, holding version, to latest_id."""
+    full, steps = _steps_since(replication_dir, latest_id, version)
+    if full is not None and current_path is not None:
+        current_full, current_steps = _steps_since(replication_dir, latest_id, current_version)
+        if current_full is None:
+            _clone(current_path, path)
+            full, steps = None, current_steps
+    if full is not None:
+        keystore_backup.apply_backup(replication_dir, full, path)
+    for manifest in steps:
+        keystore_backup.apply_backup(replication_dir, manifest, path)
+    with open(path, 'r+b') as f:
+        # Pages come from a WAL database; immutable readers of the copy must not look for a WAL
+        f.seek(18)
+        f.write(b'\x01\x01')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _point(database, path):
+    link_path = database + '.link'
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.basename(path), link_path)
+    os.replace(link_path, database)
+
+
+def update_follower(replication_dir, database):
+    """Make database point to a copy of the newest published snapshot unless it already does.
+
+    The caller must make sure only one process per database does this at a
+    time. Returns the follower state.
+    """
+    state = read_follower_state(database)
+    heartbeat = read_heartbeat(replication_dir)
+    if not heartbeat or not heartbeat.get('latest'):
+        return state
+    latest_id = heartbeat['latest']
+    if not (state and state.get('copies') and os.path.islink(database) and os.path.exists(database)):
+        state = None
+    if state and state['applied'] == latest_id:
+        return state
+
+    copies = dict(state['copies']) if state else {}
+    current = state['copy'] if state else None
+    spare = next(name for name in REPLICA_COPIES if name != current)
+    spare_path = f'{database}.{spare}'
+    version = copies.pop(spare, None)
+    if state:
+        # Until the spare is finished, a crash must not leave it looking usable
+        write_json(follower_state_path(database), {**state, 'copies': copies})
+
+    with open(spare_path, 'ab') as spare_file:
+        try:
+            fcntl.flock(spare_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            build_path = spare_path
+        except BlockingIOError:
+            # Connections still read the spare: build a new file to replace it
+            build_path, version = spare_path + '.tmp', None
+        current_path = f'{database}.{current}' if current else None
+        try:
+            _build_copy(replication_dir, build_path, version, latest_id, current_path, copies.get(current))
+        except keystore_backup.BackupError as e:
+            raise ReplicationError(f'Cannot apply snapshot {latest_id}: {e}')
+        if build_path != spare_path:
+            os.replace(build_path, spare_path)
+        _point(database, spare_path)
+        copies[spare] = latest_id
+        state = {'applied': latest_id, 'as_of': heartbeat['latest_as_of'], 'installed_at': _now(),
+                 'copy': spare, 'copies': copies}
+        write_json(follower_state_path(database), state)
+    return state
+
+
+def replication_lag(heartbeat, state, now=None):
+    """Seconds the follower's copy may be behind the primary, or None before the first snapshot.
+
+    A copy of the newest snapshot is as current as the primary's last check;
+    an older one is as current as the moment its snapshot was taken.
+    """
+    if not state:
+        return None
+    if heartbeat and heartbeat.get('latest') == state['applied']:
+        as_of = heartbeat['checked_at']
+    else:
+        as_of = state['as_of']
+    now = now or datetime.utcnow()
+    return max(0.0, (now - datetime.fromisoformat(as_of)).total_seconds())
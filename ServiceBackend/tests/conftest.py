@@ -0,0 +1,95 @@
+"""Shared fixtures: one service instance backed by a temporary DATABASE.
+
+The service reads its configuration when it is imported, so the environment
+is prepared here before the first import. Tests share the database and use
+unique key names so they do not depend on each other's data.
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+from cryptography.fernet import Fernet
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_PATH = os.path.join(SERVICE_DIR, 'enhanced_keystore_service.py')
+
+DATA_DIR = tempfile.mkdtemp(prefix='keystore-tests-')
+OLD_ENCRYPTION_KEY = Fernet.generate_key().decode()
+
+os.environ.update({
+    'DATABASE': os.path.join(DATA_DIR, 'primary', 'keystore.db'),
+    'SECRET_KEY': 'test-secret-key-' + 'x' * 32,
+    'ENCRYPTION_KEY': Fernet.generate_key().decode(),
+    'ENCRYPTION_KEYS_PREVIOUS': OLD_ENCRYPTION_KEY,
+    'METRICS_DIR': os.path.join(DATA_DIR, 'metrics'),
+    'AUDIT_RETENTION_DAYS': '0',
+    'KEY_ROTATION_BATCH_SIZE': '2',
+    'KEY_ROTATION_BATCH_PAUSE': '0',
+    'CHANGE_FEED_MAX_WAIT': '2',
+})
+os.environ.pop('KEYSTORE_ROLE', None)
+os.makedirs(os.path.dirname(os.environ['DATABASE']), exist_ok=True)
+sys.path.insert(0, SERVICE_DIR)
+
+import enhanced_keystore_service as ks  # noqa: E402
+
+ks.init_db()
+
+
+def load_service(module_name, **env):
+    """Import a second, independent instance of the service with extra environment settings."""
+    saved = os.environ.copy()
+    os.environ.update(env)
+    try:
+        spec = importlib.util.spec_from_file_location(module_name, SERVICE_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    return module
+
+
+def login(client, username='admin', password='admin123'):
+    response = client.post('/auth/login', json={'username': username, 'password': password})
+    assert response.status_code == 200, response.get_json()
+    return {'Authorization': 'Bearer ' + response.get_json()['token']}
+
+
+@pytest.fixture(scope='session')
+def service():
+    return ks
+
+
+@pytest.fixture
+def client():
+    return ks.app.test_client()
+
+
+@pytest.fixture(scope='session')
+def admin_headers():
+    return login(ks.app.test_client())
+
+
+@pytest.fixture(scope='session')
+def user_headers():
+    return login(ks.app.test_client(), 'user', 'user123')
+
+
+@pytest.fixture
+def key_name():
+    """A key name no other test uses."""
+    return f'test-{uuid.uuid4().hex[:12]}'
+
+
+@pytest.fixture
+def add_key(client, admin_headers):
+    def add(name, value='secret-value', description='', headers=admin_headers):
+        response = client.post('/keys', json={'key_name': name, 'api_key': value, 'description': description},
+                               headers=headers)
+        assert response.status_code == 201, response.get_json()
+        return response
+    return add
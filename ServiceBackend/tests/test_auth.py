@@ -0,0 +1,37 @@
+"""Login, logout and token revocation."""
+import sqlite3
+from contextlib import closing
+
+from conftest import login
+
+
+def test_logout_revokes_only_the_presented_token(client):
+    revoked = login(client)
+    other = login(client)
+    assert client.get('/keys', headers=revoked).status_code == 200
+
+    assert client.post('/auth/logout', headers=revoked).status_code == 200
+    assert client.get('/keys', headers=revoked).status_code == 401
+    assert client.get('/keys', headers=other).status_code == 200
+
+
+def test_revocations_reach_other_workers_through_the_database(client, service, monkeypatch):
+    headers = login(client)
+    token = headers['Authorization'].split(' ')[1]
+    assert client.get('/keys', headers=headers).status_code == 200
+
+    # Another worker revokes the token: only the access_tokens row changes here
+    with closing(sqlite3.connect(service.DATABASE)) as conn:
+        conn.execute('INSERT INTO access_tokens (token_hash, user_id, expires_at, is_active) '
+                     "VALUES (?, 1, datetime('now', '+1 hour'), 0)", (service.token_digest(token),))
+        conn.commit()
+
+    monkeypatch.setattr(service.token_revocations, '_next_sync', 0)
+    assert client.get('/keys', headers=headers).status_code == 401
+
+
+def test_invalid_credentials_and_tokens_are_rejected(client):
+    response = client.post('/auth/login', json={'username': 'admin', 'password': 'wrong'})
+    assert response.status_code == 401
+    assert client.get('/keys', headers={'Authorization': 'Bearer not-a-token'}).status_code == 401
+    assert client.get('/keys').status_code == 401
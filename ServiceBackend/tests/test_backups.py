@@ -0,0 +1,101 @@
+"""Hot backups: the admin endpoints, verification and restore."""
+import os
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import keystore_backup
+
+
+def run_backup(client, headers, service, incremental=False):
+    response = client.post('/admin/backups', json={'incremental': incremental}, headers=headers)
+    assert response.status_code == 202
+    service.backup_runner._thread.join(30)
+    assert service.backup_runner.last_error is None
+    return service.backup_runner.last_backup
+
+
+def rows(database):
+    with closing(sqlite3.connect(database)) as conn:
+        return [row[0] for row in conn.execute('SELECT value FROM items ORDER BY value')]
+
+
+@pytest.fixture
+def scratch_database(tmp_path):
+    database = str(tmp_path / 'scratch.db')
+    with closing(sqlite3.connect(database)) as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE items (value TEXT)')
+        conn.executemany('INSERT INTO items VALUES (?)', [(f'item-{i:04d}',) for i in range(500)])
+        conn.commit()
+    return database
+
+
+def test_backup_endpoints_create_list_and_verify(client, admin_headers, service, add_key, key_name):
+    full = run_backup(client, admin_headers, service)
+    add_key(key_name)
+    incremental = run_backup(client, admin_headers, service, incremental=True)
+    assert full['kind'] == 'full'
+    assert incremental['kind'] == 'incremental'
+    assert incremental['base'] == full['id']
+
+    listing = client.get('/admin/backups', headers=admin_headers).get_json()
+    assert [backup['id'] for backup in listing['backups']][-2:] == [full['id'], incremental['id']]
+    assert listing['last_backup']['id'] == incremental['id']
+
+    response = client.post(f"/admin/backups/{incremental['id']}/verify", headers=admin_headers)
+    assert response.status_code == 200
+
+
+def test_verify_reports_a_corrupt_backup(client, admin_headers, service):
+    backup = run_backup(client, admin_headers, service)
+    with open(os.path.join(service.BACKUP_DIR, backup['file']), 'r+b') as f:
+        f.seek(100)
+        f.write(b'corrupted')
+    response = client.post(f"/admin/backups/{backup['id']}/verify", headers=admin_headers)
+    assert response.status_code == 422
+    assert 'checksum' in response.get_json()['details']
+
+    assert client.post('/admin/backups/not-a-backup/verify', headers=admin_headers).status_code == 400
+    assert client.post('/admin/backups/keystore-missing/verify', headers=admin_headers).status_code == 422
+
+
+def test_restore_rebuilds_an_incremental_backup(scratch_database, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    full = keystore_backup.create_backup(scratch_database, backup_dir)
+    with closing(sqlite3.connect(scratch_database)) as conn:
+        conn.execute("UPDATE items SET value = value || '-changed' WHERE rowid % 50 = 0")
+        conn.commit()
+    expected = rows(scratch_database)
+    incremental = keystore_backup.create_backup(scratch_database, backup_dir, incremental=True)
+    assert incremental['changed_pages'] < full['changed_pages']
+
+    with closing(sqlite3.connect(scratch_database)) as conn:
+        conn.execute('DELETE FROM items')
+        conn.commit()
+    previous = keystore_backup.restore_backup(incremental['id'], scratch_database, backup_dir)
+
+    assert rows(scratch_database) == expected
+    assert rows(previous) == []
+    assert not os.path.exists(scratch_database + '-wal')
+
+
+def test_unchanged_incremental_backup_can_be_skipped(scratch_database, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    keystore_backup.create_backup(scratch_database, backup_dir)
+    assert keystore_backup.create_backup(scratch_database, backup_dir, incremental=True, skip_unchanged=True) is None
+
+
+def test_restore_refuses_a_backup_with_a_missing_base(scratch_database, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    full = keystore_backup.create_backup(scratch_database, backup_dir)
+    with closing(sqlite3.connect(scratch_database)) as conn:
+        conn.execute("INSERT INTO items VALUES ('extra')")
+        conn.commit()
+    incremental = keystore_backup.create_backup(scratch_database, backup_dir, incremental=True)
+    os.remove(os.path.join(backup_dir, full['file']))
+
+    with pytest.raises(keystore_backup.BackupError):
+        keystore_backup.restore_backup(incremental['id'], scratch_database, backup_dir)
+    assert 'extra' in rows(scratch_database)
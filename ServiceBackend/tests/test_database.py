@@ -0,0 +1,125 @@
+"""The connection pool and the group-commit audit log writer."""
+import sqlite3
+import threading
+from contextlib import closing
+
+import pytest
+
+
+def count_access_rows(service, action):
+    with closing(sqlite3.connect(service.DATABASE)) as conn:
+        return conn.execute('SELECT COUNT(*) FROM access_log WHERE action = ?', (action,)).fetchone()[0]
+
+
+def audit_row(action, key_name=None):
+    return (1, 'admin', key_name, action, '127.0.0.1', 'pytest', True)
+
+
+# ConnectionPool
+
+def test_pool_reuses_released_connections(service):
+    pool = service.ConnectionPool(2, 0.1)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+
+def test_pool_times_out_when_every_connection_is_busy(service):
+    pool = service.ConnectionPool(1, 0.05)
+    conn = pool.acquire()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+
+def test_pool_hands_a_released_connection_to_a_waiter(service):
+    pool = service.ConnectionPool(1, 5)
+    conn = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    pool.release(conn)
+    waiter.join(5)
+    assert acquired == [conn]
+
+
+def test_pool_rolls_back_uncommitted_work_on_release(service):
+    pool = service.ConnectionPool(1, 0.1)
+    conn = pool.acquire()
+    conn.execute('BEGIN')
+    conn.execute('INSERT INTO access_log (action) VALUES (?)', ('pool_rollback',))
+    pool.release(conn)
+    assert not conn.in_transaction
+    assert count_access_rows(service, 'pool_rollback') == 0
+
+
+def test_pool_replaces_connections_opened_before_invalidate(service):
+    pool = service.ConnectionPool(2, 0.1)
+    idle = pool.acquire()
+    busy = pool.acquire()
+    pool.release(idle)
+
+    pool.invalidate()
+    assert pool.generation == 1
+    pool.release(busy)
+    fresh = pool.acquire()
+    assert fresh is not idle and fresh is not busy
+    assert fresh.execute('SELECT 1').fetchone()[0] == 1
+
+
+# AuditLogWriter
+
+def test_audit_writer_commits_before_waiting_submit_returns(service):
+    writer = service.AuditLogWriter(100, 10, 5)
+    try:
+        writer.submit([audit_row('audit_wait')], wait=True)
+        assert count_access_rows(service, 'audit_wait') == 1
+    finally:
+        writer.stop()
+
+
+def test_audit_writer_flush_and_stop_write_everything_queued(service):
+    writer = service.AuditLogWriter(1000, 50, 50)
+    for _ in range(120):
+        writer.submit([audit_row('audit_flush')])
+    writer.flush()
+    assert count_access_rows(service, 'audit_flush') == 120
+
+    writer.submit([audit_row('audit_stop')] * 3)
+    writer.stop()
+    assert count_access_rows(service, 'audit_stop') == 3
+    assert writer.pending() == 0
+
+
+def test_group_mode_requests_are_logged_when_they_return(client, admin_headers, service, monkeypatch, key_name):
+    monkeypatch.setattr(service, 'AUDIT_LOG_MODE', 'group')
+    response = client.post('/keys:batch_get', json={'key_names': [key_name, key_name + '-2']}, headers=admin_headers)
+    assert response.status_code == 200
+
+    with closing(sqlite3.connect(service.DATABASE)) as conn:
+        rows = conn.execute(
+            'SELECT key_name FROM access_log WHERE key_name IN (?, ?) ORDER BY id', (key_name, key_name + '-2')
+        ).fetchall()
+    assert [row[0] for row in rows] == [key_name, key_name + '-2']
+
+
+def test_audit_writer_fails_waiters_and_counts_rows_it_cannot_write(service, monkeypatch):
+    monkeypatch.setattr(service, 'ACCESS_LOG_INSERT', 'INSERT INTO missing_table VALUES (?, ?, ?, ?, ?, ?, ?)')
+    dropped = service.audit_rows_dropped.values.get((), 0)
+    writer = service.AuditLogWriter(100, 10, 5, retries=1)
+    try:
+        with pytest.raises(service.AuditWriteFailed):
+            writer.submit([audit_row('audit_fail')] * 2, wait=True)
+        assert service.audit_rows_dropped.values.get((), 0) == dropped + 2
+    finally:
+        writer.stop()
+
+
+def test_group_mode_request_fails_when_its_audit_row_is_dropped(client, admin_headers, service, monkeypatch, key_name):
+    monkeypatch.setattr(service, 'AUDIT_LOG_MODE', 'group')
+    monkeypatch.setattr(service, 'ACCESS_LOG_INSERT', 'INSERT INTO missing_table VALUES (?, ?, ?, ?, ?, ?, ?)')
+    monkeypatch.setattr(service.audit_writer, 'retries', 0)
+    response = client.get(f'/keys/{key_name}', headers=admin_headers)
+    assert response.status_code == 503
+    assert response.get_json()['error'] == 'Audit log unavailable'
@@ -0,0 +1,110 @@
+"""Background re-encryption of stored keys with the primary ENCRYPTION_KEY."""
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from conftest import OLD_ENCRYPTION_KEY
+
+
+@pytest.fixture
+def old_keys(service, add_key, key_name):
+    """Four keys whose values were written with the previous encryption key, in id order."""
+    old_cipher = Fernet(OLD_ENCRYPTION_KEY.encode())
+    names = [f'{key_name}-{i}' for i in range(4)]
+    for name in names:
+        add_key(name, f'value-of-{name}')
+    conn = service.open_db_connection()
+    try:
+        for name in names:
+            conn.execute('UPDATE api_keys SET encrypted_value = ? WHERE key_name = ?',
+                         (old_cipher.encrypt(f'value-of-{name}'.encode()).decode(), name))
+        conn.commit()
+        ids = [conn.execute('SELECT id FROM api_keys WHERE key_name = ?', (name,)).fetchone()[0] for name in names]
+    finally:
+        conn.close()
+    return list(zip(ids, names))
+
+
+def uses_primary_key(service, name):
+    conn = service.open_db_connection()
+    try:
+        value = conn.execute('SELECT encrypted_value FROM api_keys WHERE key_name = ?', (name,)).fetchone()[0]
+    finally:
+        conn.close()
+    try:
+        service.primary_cipher.decrypt(value.encode())
+        return True
+    except InvalidToken:
+        return False
+
+
+def wait_for_job(service):
+    service.key_rotation._thread.join(30)
+    return service.key_rotation.stats()['job']
+
+
+def test_old_keys_stay_readable_before_rotation(client, admin_headers, service, old_keys):
+    for _, name in old_keys:
+        assert not uses_primary_key(service, name)
+        assert client.get(f'/keys/{name}', headers=admin_headers).get_json()['api_key'] == f'value-of-{name}'
+
+
+def test_rotation_reencrypts_every_key(client, admin_headers, service, old_keys):
+    response = client.post('/admin/key-rotation', json={'restart': True}, headers=admin_headers)
+    assert response.status_code == 202
+    job = wait_for_job(service)
+
+    assert job['status'] == 'completed'
+    assert job['failed'] == 0
+    assert job['reencrypted'] >= len(old_keys)
+    for _, name in old_keys:
+        assert uses_primary_key(service, name)
+        assert client.get(f'/keys/{name}', headers=admin_headers).get_json()['api_key'] == f'value-of-{name}'
+    assert client.get('/admin/key-rotation', headers=admin_headers).get_json()['job']['progress'] == 1.0
+
+
+def test_rotation_keeps_etags_and_stays_out_of_the_change_feed(client, admin_headers, service, old_keys):
+    name = old_keys[0][1]
+    etag = client.get(f'/keys/{name}', headers=admin_headers).headers['ETag']
+    since = client.get('/keys:changes?wait=0', headers=admin_headers).get_json()['last_seq']
+
+    client.post('/admin/key-rotation', json={'restart': True}, headers=admin_headers)
+    assert wait_for_job(service)['status'] == 'completed'
+
+    assert uses_primary_key(service, name)
+    assert client.get(f'/keys/{name}', headers={**admin_headers, 'If-None-Match': etag}).status_code == 304
+    feed = client.get(f'/keys:changes?since={since}&wait=0', headers=admin_headers).get_json()
+    assert feed['changes'] == []
+
+
+def test_interrupted_rotation_resumes_from_its_checkpoint(service, old_keys):
+    # A previous worker stopped after the first two keys of the batch
+    checkpoint = old_keys[1][0]
+    conn = service.open_db_connection()
+    try:
+        conn.execute('''
+            INSERT OR REPLACE INTO key_rotation (id, target_key, status, last_id, total, reencrypted,
+                already_current, failed, started_at, updated_at)
+            VALUES (1, ?, 'running', ?, 0, 0, 0, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ''', (service.key_rotation.target_key, checkpoint))
+        conn.commit()
+    finally:
+        conn.close()
+
+    service.key_rotation._checked_pid = None
+    service.key_rotation.resume_if_pending()
+    job = wait_for_job(service)
+
+    assert job['status'] == 'completed'
+    assert [uses_primary_key(service, name) for _, name in old_keys] == [False, False, True, True]
+
+
+def test_completed_rotation_is_not_resumed(service):
+    conn = service.open_db_connection()
+    try:
+        conn.execute("UPDATE key_rotation SET status = 'completed' WHERE id = 1")
+        conn.commit()
+    finally:
+        conn.close()
+    service.key_rotation._checked_pid = None
+    service.key_rotation.resume_if_pending()
+    assert not service.key_rotation.running_here()
@@ -0,0 +1,175 @@
+"""Key endpoints: batch get, ETag / 304, the change feed and bulk import."""
+import json
+
+
+def ndjson(*rows):
+    return '\n'.join(json.dumps(row) for row in rows) + '\n'
+
+
+def statuses(response):
+    return {result['key_name']: result['status'] for result in response.get_json()['results']}
+
+
+# POST /keys:batch_get
+
+def test_batch_get_returns_found_and_missing_keys_in_order(client, admin_headers, add_key, key_name):
+    add_key(key_name, 'value-1')
+    response = client.post('/keys:batch_get', json={'key_names': [key_name + '-missing', key_name]},
+                           headers=admin_headers)
+    assert response.status_code == 200
+    keys = response.get_json()['keys']
+    assert [key['key_name'] for key in keys] == [key_name + '-missing', key_name]
+    assert keys[0]['status'] == 'missing'
+    assert keys[1]['status'] == 'found'
+    assert keys[1]['api_key'] == 'value-1'
+
+
+def test_batch_get_reports_other_users_keys_as_missing(client, user_headers, add_key, key_name):
+    add_key(key_name)
+    response = client.post('/keys:batch_get', json={'key_names': [key_name, key_name + '-missing']},
+                           headers=user_headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    # Indistinguishable from a name that does not exist, as with GET /keys/<name>
+    assert body['keys'] == [{'key_name': key_name, 'status': 'missing'},
+                            {'key_name': key_name + '-missing', 'status': 'missing'}]
+    assert body['summary'] == {'found': 0, 'missing': 2, 'error': 0}
+    assert client.get(f'/keys/{key_name}', headers=user_headers).status_code == 404
+
+
+def test_batch_get_returns_a_users_own_keys(client, user_headers, add_key, key_name):
+    add_key(key_name, 'user-value', headers=user_headers)
+    response = client.post('/keys:batch_get', json={'key_names': [key_name]}, headers=user_headers)
+    assert response.get_json()['keys'][0]['api_key'] == 'user-value'
+
+
+def test_batch_get_rejects_empty_and_oversized_requests(client, admin_headers, service, monkeypatch):
+    assert client.post('/keys:batch_get', json={'key_names': []}, headers=admin_headers).status_code == 400
+    monkeypatch.setattr(service, 'BATCH_GET_MAX_KEYS', 2)
+    response = client.post('/keys:batch_get', json={'key_names': ['a', 'b', 'c']}, headers=admin_headers)
+    assert response.status_code == 400
+
+
+# ETag / If-None-Match
+
+def test_get_key_returns_304_until_the_key_changes(client, admin_headers, add_key, key_name):
+    add_key(key_name, 'value-1')
+    first = client.get(f'/keys/{key_name}', headers=admin_headers)
+    etag = first.headers['ETag']
+
+    cached = client.get(f'/keys/{key_name}', headers={**admin_headers, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+
+    client.put(f'/keys/{key_name}', json={'api_key': 'value-2', 'description': 'changed'}, headers=admin_headers)
+    changed = client.get(f'/keys/{key_name}', headers={**admin_headers, 'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.get_json()['api_key'] == 'value-2'
+    assert changed.headers['ETag'] != etag
+
+
+def test_get_key_etag_changes_when_only_the_value_changes(client, admin_headers, add_key, key_name):
+    # Same second as the write before: updated_at alone could not tell the versions apart
+    add_key(key_name, 'value-1', 'unchanged')
+    etag = client.get(f'/keys/{key_name}', headers=admin_headers).headers['ETag']
+    client.put(f'/keys/{key_name}', json={'api_key': 'value-2'}, headers=admin_headers)
+
+    response = client.get(f'/keys/{key_name}', headers={**admin_headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['api_key'] == 'value-2'
+    assert response.headers['ETag'] != etag
+
+
+def test_key_list_etag_changes_when_a_key_is_added(client, admin_headers, add_key, key_name):
+    etag = client.get('/keys', headers=admin_headers).headers['ETag']
+    assert client.get('/keys', headers={**admin_headers, 'If-None-Match': etag}).status_code == 304
+
+    add_key(key_name)
+    response = client.get('/keys', headers={**admin_headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+# GET /keys:changes
+
+def test_change_feed_reports_writes_after_since(client, admin_headers, add_key, key_name):
+    since = client.get('/keys:changes?wait=0', headers=admin_headers).get_json()['last_seq']
+    add_key(key_name)
+    client.delete(f'/keys/{key_name}', headers=admin_headers)
+
+    feed = client.get(f'/keys:changes?since={since}&wait=0', headers=admin_headers).get_json()
+    changes = [(change['key_name'], change['op']) for change in feed['changes'] if change['key_name'] == key_name]
+    assert [name for name, _ in changes] == [key_name, key_name]
+    assert changes[0][1] != changes[1][1]
+    assert feed['last_seq'] == feed['changes'][-1]['seq']
+
+    empty = client.get(f"/keys:changes?since={feed['last_seq']}&wait=0", headers=admin_headers).get_json()
+    assert empty == {'changes': [], 'last_seq': feed['last_seq']}
+
+
+def test_change_feed_only_shows_a_users_own_keys(client, user_headers, add_key, key_name):
+    since = client.get('/keys:changes?wait=0', headers=user_headers).get_json()['last_seq']
+    add_key(key_name)
+    feed = client.get(f'/keys:changes?since={since}&wait=0', headers=user_headers).get_json()
+    assert key_name not in [change['key_name'] for change in feed['changes']]
+
+
+# POST /keys:import
+
+def test_import_skip_keeps_existing_keys(client, admin_headers, add_key, key_name):
+    add_key(key_name, 'original')
+    body = ndjson({'key_name': key_name, 'api_key': 'imported'}, {'key_name': key_name + '-new', 'api_key': 'new'})
+    response = client.post('/keys:import?on_conflict=skip', data=body, headers=admin_headers)
+    assert response.status_code == 200
+    assert statuses(response) == {key_name: 'skipped', key_name + '-new': 'created'}
+    assert client.get(f'/keys/{key_name}', headers=admin_headers).get_json()['api_key'] == 'original'
+
+
+def test_import_overwrite_replaces_existing_keys(client, admin_headers, add_key, key_name):
+    add_key(key_name, 'original')
+    body = ndjson({'key_name': key_name, 'api_key': 'imported', 'description': 'from import'})
+    response = client.post('/keys:import?on_conflict=overwrite', data=body, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.get_json()['summary']['overwritten'] == 1
+    key = client.get(f'/keys/{key_name}', headers=admin_headers).get_json()
+    assert (key['api_key'], key['description']) == ('imported', 'from import')
+
+
+def test_import_overwrite_denies_other_users_keys(client, user_headers, add_key, key_name):
+    add_key(key_name, 'original')
+    body = ndjson({'key_name': key_name, 'api_key': 'imported'})
+    response = client.post('/keys:import?on_conflict=overwrite', data=body, headers=user_headers)
+    assert statuses(response) == {key_name: 'denied'}
+
+
+def test_import_fail_writes_nothing_on_conflict(client, admin_headers, add_key, key_name):
+    add_key(key_name, 'original')
+    body = ndjson({'key_name': key_name + '-new', 'api_key': 'new'}, {'key_name': key_name, 'api_key': 'imported'})
+    response = client.post('/keys:import?on_conflict=fail', data=body, headers=admin_headers)
+    assert response.status_code == 409
+    assert statuses(response) == {key_name + '-new': 'aborted', key_name: 'conflict'}
+    assert client.get(f'/keys/{key_name}-new', headers=admin_headers).status_code == 404
+    assert client.get(f'/keys/{key_name}', headers=admin_headers).get_json()['api_key'] == 'original'
+
+
+def test_import_reports_invalid_rows_and_rejects_unknown_policies(client, admin_headers, key_name):
+    body = 'not json\n' + ndjson({'key_name': key_name}, {'key_name': key_name + '-ok', 'api_key': 'v'})
+    response = client.post('/keys:import', data=body, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.get_json()['summary']['invalid'] == 2
+    assert response.get_json()['summary']['created'] == 1
+
+    response = client.post('/keys:import?on_conflict=merge', data=body, headers=admin_headers)
+    assert response.status_code == 400
+
+
+def test_export_bundle_imports_into_the_same_keys(client, admin_headers, add_key, key_name):
+    add_key(key_name, 'exported-value')
+    lines = client.get('/keys:export', headers=admin_headers).data.decode().splitlines()
+    assert json.loads(lines[0])['type'] == 'keystore-bundle'
+    entry = next(json.loads(line) for line in lines[1:] if json.loads(line)['key_name'] == key_name)
+
+    client.delete(f'/keys/{key_name}', headers=admin_headers)
+    response = client.post('/keys:import', data=ndjson(entry), headers=admin_headers)
+    assert statuses(response) == {key_name: 'created'}
+    assert client.get(f'/keys/{key_name}', headers=admin_headers).get_json()['api_key'] == 'exported-value'
@@ -0,0 +1,235 @@
+"""Replication: WAL shipping to follower copies, and request routing on a follower."""
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import closing
+
+import pytest
+from werkzeug.serving import make_server
+
+import keystore_replication
+from conftest import DATA_DIR, load_service
+
+
+def read_items(database):
+    with closing(sqlite3.connect(database)) as conn:
+        return conn.execute('SELECT value FROM items ORDER BY rowid').fetchall()
+
+
+@pytest.fixture
+def primary(tmp_path):
+    database = str(tmp_path / 'primary.db')
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE items (value TEXT)')
+    conn.executemany('INSERT INTO items VALUES (?)', [(f'item-{i}',) for i in range(200)])
+    conn.commit()
+    yield database, conn
+    conn.close()
+
+
+@pytest.fixture
+def publisher(primary, tmp_path):
+    publisher = keystore_replication.Publisher(primary[0], str(tmp_path / 'replication'), 100)
+    yield publisher
+    publisher.close()
+
+
+# Publishing and installing copies
+
+def test_read_wal_of_a_missing_log_is_empty(tmp_path):
+    position, pages, page_count = keystore_replication.read_wal(str(tmp_path / 'missing-wal'))
+    assert position['frame'] == 0
+    assert pages == {}
+    assert page_count is None
+
+
+def test_follower_copy_follows_published_changes(primary, publisher, tmp_path):
+    database, conn = primary
+    follower = str(tmp_path / 'follower' / 'keystore.db')
+    os.makedirs(os.path.dirname(follower))
+
+    assert publisher.publish()['kind'] == 'full'
+    state = keystore_replication.update_follower(publisher.replication_dir, follower)
+    assert read_items(follower) == read_items(database)
+
+    conn.execute("UPDATE items SET value = 'changed' WHERE rowid = 7")
+    conn.execute("INSERT INTO items VALUES ('added')")
+    conn.commit()
+    manifest = publisher.publish()
+    assert manifest['kind'] == 'incremental'
+    assert manifest['base'] == state['applied']
+
+    new_state = keystore_replication.update_follower(publisher.replication_dir, follower)
+    assert new_state['applied'] == manifest['id']
+    assert new_state['copy'] != state['copy']
+    assert read_items(follower) == read_items(database)
+    with closing(sqlite3.connect(follower)) as copy:
+        assert copy.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+
+
+def test_unchanged_database_publishes_only_a_heartbeat(primary, publisher):
+    publisher.publish()
+    latest = keystore_replication.read_heartbeat(publisher.replication_dir)['latest']
+    assert publisher.publish() is None
+    heartbeat = keystore_replication.read_heartbeat(publisher.replication_dir)
+    assert heartbeat['latest'] == latest
+
+
+def test_publisher_connection_changes_wait_for_force(primary, publisher):
+    publisher.publish()
+    publisher.conn.execute("INSERT INTO items VALUES ('imported')")
+    publisher.conn.commit()
+    assert publisher.publish() is None
+    assert publisher.publish(force=True)['kind'] == 'incremental'
+
+
+def test_long_chains_end_in_a_full_snapshot_that_follows_them(primary, tmp_path):
+    database, conn = primary
+    publisher = keystore_replication.Publisher(database, str(tmp_path / 'replication'), 2)
+    try:
+        first = publisher.publish()
+        for i in range(2):
+            conn.execute('INSERT INTO items VALUES (?)', (f'chain-{i}',))
+            conn.commit()
+            manifest = publisher.publish()
+        assert manifest['kind'] == 'full'
+        assert manifest['follows'] is not None
+        assert manifest['follows'] != first['id']
+    finally:
+        publisher.close()
+
+
+def test_copy_held_by_a_reader_is_replaced_instead_of_patched(primary, publisher, tmp_path):
+    database, conn = primary
+    follower = str(tmp_path / 'follower.db')
+    publisher.publish()
+    keystore_replication.update_follower(publisher.replication_dir, follower)
+    held_path, held = keystore_replication.open_replica(follower)
+    try:
+        for value in ('second', 'third'):
+            conn.execute('INSERT INTO items VALUES (?)', (value,))
+            conn.commit()
+            publisher.publish()
+            keystore_replication.update_follower(publisher.replication_dir, follower)
+
+        # The third snapshot went into the held copy's slot as a new file
+        assert os.path.realpath(follower) == held_path
+        assert os.fstat(held.fileno()).st_ino != os.stat(held_path).st_ino
+        assert read_items(follower)[-1] == ('third',)
+    finally:
+        held.close()
+
+
+# Routing on a follower
+
+@pytest.fixture
+def make_follower(service):
+    """Load a follower instance of the service reading the primary's REPLICATION_DIR."""
+    def make(replication_dir=service.REPLICATION_DIR):
+        follower_dir = os.path.join(DATA_DIR, f'follower-{uuid.uuid4().hex[:8]}')
+        return load_service(
+            f'keystore_follower_{uuid.uuid4().hex[:8]}',
+            KEYSTORE_ROLE='follower',
+            DATABASE=os.path.join(follower_dir, 'keystore.db'),
+            REPLICATION_DIR=replication_dir,
+            METRICS_DIR=os.path.join(follower_dir, 'metrics'),
+            REPLICATION_POLL_INTERVAL='3600'
+        )
+    return make
+
+
+@pytest.fixture
+def service_publisher(service):
+    publisher = keystore_replication.Publisher(service.DATABASE, service.REPLICATION_DIR, 100)
+    yield publisher
+    publisher.close()
+
+
+@pytest.fixture
+def follower(make_follower, service, service_publisher):
+    follower = make_follower()
+    service.replication_publisher.run_once(service_publisher)
+    follower.replica.sync()
+    return follower
+
+
+def test_follower_refuses_reads_until_it_has_a_snapshot(make_follower, admin_headers, tmp_path):
+    client = make_follower(str(tmp_path / 'empty-replication')).app.test_client()
+    response = client.get('/keys', headers=admin_headers)
+    assert response.status_code == 503
+    assert response.get_json()['error'] == 'Replica not ready'
+    assert client.get('/health').status_code == 503
+
+
+def test_follower_serves_reads_from_its_copy(follower, service, service_publisher, admin_headers, add_key, key_name):
+    add_key(key_name, 'replicated-value')
+    service.replication_publisher.run_once(service_publisher)
+    follower.replica.sync()
+    client = follower.app.test_client()
+
+    response = client.get(f'/keys/{key_name}', headers=admin_headers)
+    assert response.status_code == 200
+    assert response.get_json()['api_key'] == 'replicated-value'
+    assert float(response.headers['X-Replication-Lag']) >= 0
+
+    response = client.post('/keys:batch_get', json={'key_names': [key_name]}, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.get_json()['keys'][0]['api_key'] == 'replicated-value'
+    assert client.get('/health').status_code == 200
+
+
+def test_follower_health_reports_lag(follower, monkeypatch):
+    monkeypatch.setattr(follower, 'FOLLOWER_MAX_LAG', -1)
+    response = follower.app.test_client().get('/health')
+    assert response.status_code == 503
+    assert response.get_json()['status'] == 'lagging'
+
+
+def test_follower_refuses_writes_without_a_primary(follower, admin_headers, key_name):
+    response = follower.app.test_client().post('/keys', json={'key_name': key_name, 'api_key': 'v'},
+                                               headers=admin_headers)
+    assert response.status_code == 503
+    assert response.get_json()['error'] == 'Read-only follower'
+
+
+def test_follower_forwards_writes_to_the_primary(follower, service, admin_headers, monkeypatch, key_name):
+    server = make_server('127.0.0.1', 0, service.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        monkeypatch.setattr(follower, 'FOLLOWER_PRIMARY_URL', f'http://127.0.0.1:{server.server_port}')
+        client = follower.app.test_client()
+        response = client.post('/keys', json={'key_name': key_name, 'api_key': 'forwarded'}, headers=admin_headers)
+        assert response.status_code == 201
+        assert 'X-Replication-Lag' not in response.headers
+    finally:
+        server.shutdown()
+        thread.join()
+
+    primary_client = service.app.test_client()
+    assert primary_client.get(f'/keys/{key_name}', headers=admin_headers).get_json()['api_key'] == 'forwarded'
+    # Not on the follower until the next publish
+    assert follower.app.test_client().get(f'/keys/{key_name}', headers=admin_headers).status_code == 404
+
+
+def test_follower_reports_an_unreachable_primary(follower, admin_headers, monkeypatch, key_name):
+    monkeypatch.setattr(follower, 'FOLLOWER_PRIMARY_URL', 'http://127.0.0.1:1')
+    response = follower.app.test_client().post('/keys', json={'key_name': key_name, 'api_key': 'v'},
+                                               headers=admin_headers)
+    assert response.status_code == 502
+
+
+def test_follower_audit_rows_reach_the_primary(follower, service, service_publisher, admin_headers, key_name):
+    follower.app.test_client().get(f'/keys/{key_name}', headers=admin_headers)
+    service.replication_publisher.run_once(service_publisher)
+
+    conn = service.open_db_connection()
+    try:
+        row = conn.execute("SELECT success FROM access_log WHERE key_name = ? AND action = 'view_key'",
+                           (key_name,)).fetchone()
+    finally:
+        conn.close()
+    assert row is not None
+    assert not row['success']
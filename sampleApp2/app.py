@@ -5,9 +5,11 @@ import json
 import requests
 import sys
 import logging
+import threading
 import traceback
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
+from keystore_client import KeystoreClient
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for frontend requests
@@ -44,59 +46,27 @@ if not KEYSTORE_JWT_TOKEN:
 if not GENERATIVE_AI_KEY_NAME:
     logger.critical("GENERATIVE_AI_KEY_NAME environment variable not set. Secure key retrieval will fail.")
 
-_cached_generative_ai_api_key = None
+# Shared Keystore client: pooled session, TTL cache with refresh-ahead and single-flight fetches
+keystore = KeystoreClient(
+    KEYSTORE_API_BASE,
+    KEYSTORE_JWT_TOKEN,
+    ttl=int(os.environ.get('KEYSTORE_CACHE_TTL', 300)),
+    refresh_ahead=int(os.environ.get('KEYSTORE_REFRESH_AHEAD', 60))
+)
 
 def get_generative_ai_api_key_securely():
-    global _cached_generative_ai_api_key
-    if _cached_generative_ai_api_key:
-        logger.info("Using cached Generative AI API Key.")
-        return _cached_generative_ai_api_key
-    if not KEYSTORE_JWT_TOKEN:
-        logger.error("Error in get_generative_ai_api_key_securely: KEYSTORE_JWT_TOKEN is not set in environment.")
-        return None
-    if not GENERATIVE_AI_KEY_NAME:
-        logger.error("Error in get_generative_ai_api_key_securely: GENERATIVE_AI_KEY_NAME is not set in environment.")
-        return None
-    try:
-        headers = {
-            'Authorization': f'Bearer {KEYSTORE_JWT_TOKEN}',
-            'Content-Type': 'application/json'
-        }
-        keystore_url = f"{KEYSTORE_API_BASE}/keys/{GENERATIVE_AI_KEY_NAME}"
-        logger.info(f"Attempting to retrieve Generative AI API Key from Keystore at URL: {keystore_url}")
-        response = requests.get(keystore_url, headers=headers, timeout=10)
-        logger.info(f"Keystore response status code: {response.status_code}")
-        if not response.ok:
-            error_details = response.text
-            logger.error(f"Error response from Keystore: {error_details}")
-            try:
-                error_json = response.json()
-                logger.error(f"Keystore error JSON: {error_json.get('error', 'N/A')}")
-            except json.JSONDecodeError: pass
-            raise requests.exceptions.RequestException(f"Keystore returned non-2xx status: {response.status_code}")
-        key_data = response.json()
-        api_key = key_data.get('api_key')
-        if not api_key:
-            logger.error("Error: 'api_key' field not found or is empty in successful Keystore response.")
-            return None
-        _cached_generative_ai_api_key = api_key
-        logger.info("Successfully retrieved Generative AI API Key from Keystore.")
-        return api_key
-    except requests.exceptions.ConnectionError as e:
-        logger.error(f"Connection Error: Could not connect to Keystore service at {KEYSTORE_API_BASE}. Is it running and accessible from inside this container? Details: {e}")
-        return None
-    except requests.exceptions.Timeout as e:
-        logger.error(f"Timeout Error: Request to Keystore service timed out at {KEYSTORE_API_BASE}. Details: {e}")
-        return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error retrieving key from Keystore: {e}. Full traceback:\n{traceback.format_exc()}")
-        return None
-    except json.JSONDecodeError:
-        logger.error(f"Error: Could not decode JSON response from Keystore. Response was not valid JSON. Raw Keystore response text: {response.text}")
-        return None
-    except Exception as e:
-        logger.error(f"An unexpected error occurred during key retrieval in get_generative_ai_api_key_securely: {e}. Full traceback:\n{traceback.format_exc()}")
-        return None
+    return keystore.get_key(GENERATIVE_AI_KEY_NAME)
+
+# Warm the cache at startup without delaying it
+if KEYSTORE_JWT_TOKEN and GENERATIVE_AI_KEY_NAME:
+    threading.Thread(
+        target=keystore.prefetch,
+        args=([GENERATIVE_AI_KEY_NAME],),
+        name='keystore-prefetch',
+        daemon=True
+    ).start()
+    # Drop cached keys as soon as they are rotated in Keystore
+    keystore.start_change_watch()
 
 @app.route('/')
 def serve_index():
@@ -160,9 +130,16 @@ def chat():
             },
         }
         
-        llm_api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{GENERATIVE_AI_MODEL}:generateContent?key={generative_ai_api_key}"
+        llm_api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{GENERATIVE_AI_MODEL}:generateContent"
+
+        def send_llm_request(api_key):
+            return requests.post(llm_api_url, params={'key': api_key}, headers={'Content-Type': 'application/json'}, json=llm_payload, timeout=20)
+
         logger.info(f"Calling LLM API for prompt: '{user_prompt[:50]}...' with T={temperature_param}, Max={max_output_tokens_param}")
-        llm_response = requests.post(llm_api_url, headers={'Content-Type': 'application/json'}, json=llm_payload, timeout=20)
+        # Re-fetches the key from Keystore and retries once if the provider rejects it as stale
+        llm_response = keystore.call_with_key(GENERATIVE_AI_KEY_NAME, send_llm_request)
+        if llm_response is None:
+            return jsonify({'error': 'Generative AI API Key not available. Check Keystore configuration or connectivity.'}), 500
         llm_response.raise_for_status()
 
         llm_result = llm_response.json()
@@ -5,9 +5,11 @@ import json
 import requests
 import sys
 import logging
+import threading
 import traceback
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
+from keystore_client import KeystoreClient
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for frontend requests
@@ -72,60 +74,27 @@ DEFAULT_LLM_MAX_OUTPUT_TOKENS = int(os.environ.get('LLM_MAX_OUTPUT_TOKENS', 200)
 if not KEYSTORE_JWT_TOKEN:
     logger.critical("KEYSTORE_JWT_TOKEN environment variable not set. Secure key retrieval will fail.")
 
-_cached_generative_ai_api_key = {} # Use a dictionary to cache keys per key_name
+# Shared Keystore client: pooled session, TTL cache with refresh-ahead and single-flight fetches
+keystore = KeystoreClient(
+    KEYSTORE_API_BASE,
+    KEYSTORE_JWT_TOKEN,
+    ttl=int(os.environ.get('KEYSTORE_CACHE_TTL', 300)),
+    refresh_ahead=int(os.environ.get('KEYSTORE_REFRESH_AHEAD', 60))
+)
 
 def get_generative_ai_api_key_securely(key_name):
-    global _cached_generative_ai_api_key
-    if key_name in _cached_generative_ai_api_key:
-        logger.info(f"Using cached Generative AI API Key for {key_name}.")
-        return _cached_generative_ai_api_key[key_name]
-    
-    if not KEYSTORE_JWT_TOKEN:
-        logger.error("Error in get_generative_ai_api_key_securely: KEYSTORE_JWT_TOKEN is not set in environment.")
-        return None
-    if not key_name:
-        logger.error("Error in get_generative_ai_api_key_securely: key_name is not provided.")
-        return None
-    try:
-        headers = {
-            'Authorization': f'Bearer {KEYSTORE_JWT_TOKEN}',
-            'Content-Type': 'application/json'
-        }
-        keystore_url = f"{KEYSTORE_API_BASE}/keys/{key_name}"
-        logger.info(f"Attempting to retrieve Generative AI API Key '{key_name}' from Keystore at URL: {keystore_url}")
-        response = requests.get(keystore_url, headers=headers, timeout=10)
-        logger.info(f"Keystore response status code: {response.status_code}")
-        if not response.ok:
-            error_details = response.text
-            logger.error(f"Error response from Keystore: {error_details}")
-            try:
-                error_json = response.json()
-                logger.error(f"Keystore error JSON: {error_json.get('error', 'N/A')}")
-            except json.JSONDecodeError: pass
-            raise requests.exceptions.RequestException(f"Keystore returned non-2xx status: {response.status_code}")
-        key_data = response.json()
-        api_key = key_data.get('api_key')
-        if not api_key:
-            logger.error("Error: 'api_key' field not found or is empty in successful Keystore response.")
-            return None
-        _cached_generative_ai_api_key[key_name] = api_key
-        logger.info(f"Successfully retrieved Generative AI API Key for '{key_name}' from Keystore.")
-        return api_key
-    except requests.exceptions.ConnectionError as e:
-        logger.error(f"Connection Error: Could not connect to Keystore service at {KEYSTORE_API_BASE}. Is it running and accessible from inside this container? Details: {e}")
-        return None
-    except requests.exceptions.Timeout as e:
-        logger.error(f"Timeout Error: Request to Keystore service timed out at {KEYSTORE_API_BASE}. Details: {e}")
-        return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error retrieving key from Keystore: {e}. Full traceback:\n{traceback.format_exc()}")
-        return None
-    except json.JSONDecodeError:
-        logger.error(f"Error: Could not decode JSON response from Keystore. Response was not valid JSON. Raw Keystore response text: {response.text}")
-        return None
-    except Exception as e:
-        logger.error(f"An unexpected error occurred during key retrieval in get_generative_ai_api_key_securely: {e}. Full traceback:\n{traceback.format_exc()}")
-        return None
+    return keystore.get_key(key_name)
+
+# Warm the cache with every configured key in one batch request, without delaying startup
+if KEYSTORE_JWT_TOKEN and LLM_OPTIONS:
+    threading.Thread(
+        target=keystore.prefetch,
+        args=([opt['key_name'] for opt in LLM_OPTIONS],),
+        name='keystore-prefetch',
+        daemon=True
+    ).start()
+    # Drop cached keys as soon as they are rotated in Keystore
+    keystore.start_change_watch()
 
 @app.route('/')
 def serve_index():
@@ -289,7 +258,7 @@ def chat():
                     "maxOutputTokens": max_output_tokens_param,
                 },
             }
-            llm_url = f"https://generativelanguage.googleapis.com/v1beta/models/{current_generative_ai_model}:generateContent?key={generative_ai_api_key}"
+            llm_url = f"https://generativelanguage.googleapis.com/v1beta/models/{current_generative_ai_model}:generateContent"
             
         elif current_generative_ai_type == "openai" or current_generative_ai_type == "openrouter":
             # OpenAI and OpenRouter expect 'messages' array with 'role' and 'content'
@@ -320,18 +289,21 @@ def chat():
                 # llm_headers['HTTP-Referer'] = "http://localhost:5001" # Replace with your app's actual URL
                 # llm_headers['X-Title'] = "SampleApp3-Chatbot"
 
-            llm_headers['Authorization'] = f'Bearer {generative_ai_api_key}'
-
         else:
             logger.error(f"Unsupported LLM type specified in environment variable: '{current_generative_ai_type}'. Key='{current_generative_ai_key_name}', Model='{current_generative_ai_model}'")
             return jsonify({'error': 'Unsupported LLM type configured on the backend.'}), 500
 
-        scrubbed_llm_url = llm_url
-        if "key=" in scrubbed_llm_url:
-            scrubbed_llm_url = scrubbed_llm_url.split("key=")[0] + "key=****"
-
-        logger.info(f"Calling LLM API for model '{current_generative_ai_model}' (Type: {current_generative_ai_type}) to {scrubbed_llm_url} with T={final_temperature_for_api}, Max={max_output_tokens_param}")
-        llm_response = requests.post(llm_url, headers=llm_headers, json=llm_payload, timeout=20)
+        def send_llm_request(api_key):
+            # Gemini takes the key as a query parameter; OpenAI/OpenRouter as a Bearer token
+            if current_generative_ai_type == "gemini":
+                return requests.post(llm_url, params={'key': api_key}, headers=llm_headers, json=llm_payload, timeout=20)
+            return requests.post(llm_url, headers={**llm_headers, 'Authorization': f'Bearer {api_key}'}, json=llm_payload, timeout=20)
+
+        logger.info(f"Calling LLM API for model '{current_generative_ai_model}' (Type: {current_generative_ai_type}) to {llm_url} with T={final_temperature_for_api}, Max={max_output_tokens_param}")
+        # Re-fetches the key from Keystore and retries once if the provider rejects it as stale
+        llm_response = keystore.call_with_key(current_generative_ai_key_name, send_llm_request)
+        if llm_response is None:
+            return jsonify({'error': f'Generative AI API Key for {current_generative_ai_key_name} not available. Check Keystore configuration or connectivity.'}), 500
         llm_response.raise_for_status()
 
         llm_result = llm_response.json()